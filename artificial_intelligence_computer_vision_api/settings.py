@@ -136,3 +136,119 @@ REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
 }
+
+# Face analysis
+# Load the cascade classifiers once per worker process at startup.
+FACE_PRELOAD_CLASSIFIERS = True
+# Rotation search: exhaustive, coarse_to_fine or fast, with an optional
+# budget of cascade calls and seconds per analysis (None for no limit), and
+# the number of agreeing cascade passes after which an angle stops early.
+FACE_SEARCH_STRATEGY = 'exhaustive'
+FACE_SEARCH_MAX_CALLS = None
+FACE_SEARCH_MAX_SECONDS = None
+FACE_SEARCH_MIN_VOTES = None
+# Evaluate the rotation angles concurrently: None (sequential), 'thread' or
+# 'process', on FACE_PARALLEL_WORKERS workers (None for one per CPU).
+FACE_PARALLEL_MODE = None
+FACE_PARALLEL_WORKERS = None
+# Run the cascades on a copy of the image downscaled to this largest side
+# (None for the full resolution), optionally refining each face at full
+# resolution around its downscaled detection.
+FACE_DETECTION_MAX_DIMENSION = None
+FACE_DETECTION_REFINE = False
+# Merging of the detections of the cascade passes: 'compat' keeps the largest
+# of overlapping rectangles, 'nms' keeps adjacent faces. With
+# FACE_DETECTION_VERIFY, each merged face is searched again with a finer scale
+# factor around its rectangle, the faces not found again being dropped.
+FACE_RECTANGLE_FILTER = 'compat'
+FACE_DETECTION_VERIFY = False
+# Radius of the patch averaged around each facial skin sample (0 samples
+# single pixels).
+FACE_SKIN_PATCH_RADIUS = 0
+# Cache of the results by image content and configuration: maximum number
+# of in-process entries (0 disables it), lifetime in seconds and optional
+# alias of a Django cache backend shared by the worker processes.
+FACE_RESULT_CACHE_SIZE = 1024
+FACE_RESULT_CACHE_TTL = 3600
+FACE_RESULT_CACHE_ALIAS = None
+# Asynchronous analyses (?async=1): number of worker threads draining the
+# queue of pending images in each server process (0 to leave the queue to
+# the face_worker management command) and seconds between two checks of an
+# idle worker.
+FACE_JOB_WORKERS = 2
+FACE_JOB_POLL_SECONDS = 2.0
+# Batch analyses (/image_analysis/face/batch): maximum number of images and
+# total bytes of a batch, archives being counted by their content, and
+# number of concurrent analyses (None for one per CPU).
+FACE_BATCH_MAX_FILES = 100
+FACE_BATCH_MAX_BYTES = 100 * 1024 * 1024
+FACE_BATCH_WORKERS = None
+# Retention in days of the annotated images stored on request
+# (?annotate=1), applied by the cleanup_face_artifacts management command
+# (None to keep them).
+FACE_ARTIFACT_RETENTION_DAYS = 30
+# Video analyses (/image_analysis/face/video): number of frames between two
+# full detections, the faces being tracked in between, rotation search
+# strategy and largest side of the keyframes, and maximum number of frames
+# analyzed (None for the whole video).
+FACE_VIDEO_KEYFRAME_INTERVAL = 15
+FACE_VIDEO_SEARCH_STRATEGY = 'fast'
+FACE_VIDEO_MAX_DIMENSION = 640
+FACE_VIDEO_MAX_FRAMES = 9000
+# Try the rotation angles in order of their recent wins: half-life of a win
+# in number of analyses and optional JSON file persisting the statistics
+# across restarts and worker processes (None to keep them in memory).
+FACE_ROTATION_PRIOR = True
+FACE_ROTATION_PRIOR_HALF_LIFE = 1000
+FACE_ROTATION_PRIOR_PATH = None
+# Record the requests and the analyses (durations, stages, search, image
+# size, cache hits) in per-process metrics exposed at
+# /image_analysis/metrics, and the request header asking for a timings block
+# in the response of a synchronous analysis.
+FACE_METRICS = True
+FACE_TIMINGS_HEADER = 'X-Face-Timings'
+# Face detector backend: 'haar' (frontal and profile Haar cascades), 'lbp'
+# (a faster LBP cascade) or 'dnn' (an SSD network run with cv2.dnn on the
+# CPU). The LBP cascade is read from FACE_LBP_CASCADE_PATH, None for the
+# lbpcascade_frontalface_improved.xml shipped in face/classifiers. The network
+# is not distributed and is read from local files: its weights and the
+# optional description of the network, with the input side and the minimum
+# confidence of its detections.
+FACE_DETECTOR = 'haar'
+FACE_LBP_CASCADE_PATH = None
+FACE_DNN_MODEL_PATH = None
+FACE_DNN_CONFIG_PATH = None
+FACE_DNN_INPUT_SIZE = 300
+FACE_DNN_CONFIDENCE = 0.5
+# Storage of the uploads analyzed synchronously, which are decoded from the
+# request buffer: 'sync' (stored before answering), 'deferred' (name
+# reserved, file written by a background thread) or 'none' (only the
+# results are kept). Queued uploads (?async=1) are always stored first.
+FACE_UPLOAD_PERSISTENCE = 'sync'
+# Memory bounds of the analyses: bytes an analysis may allocate, larger
+# images being decoded at a half, a quarter or an eighth of their size
+# (None for no bound), and number of decoded pixels from which an image is
+# large, at most FACE_MAX_LARGE_ANALYSES large images being analyzed at once
+# by a process (None for no limit).
+FACE_ANALYSIS_MEMORY_BYTES = 256 * 1024 * 1024
+FACE_LARGE_IMAGE_PIXELS = 8000000
+FACE_MAX_LARGE_ANALYSES = 1
+# Analyses of the event loop view (/image_analysis/face/realtime): number of
+# analyses running at once (None for one per CPU), number of analyses
+# waiting for a worker beyond which the requests are rejected with 429 (None
+# for twice the workers), and longest deadline of a request, which stops the
+# rotation search.
+FACE_REALTIME_WORKERS = None
+FACE_REALTIME_QUEUE_SIZE = None
+FACE_REALTIME_DEADLINE_SECONDS = 10
+
+# Analyses reusing the faces of a near-duplicate: an image whose perceptual
+# hash differs by at most FACE_NEAR_DUPLICATE_DISTANCE bits (0 to 15) from
+# the hash of an image analyzed with the same configuration only has its
+# skin sampled. None disables the lookup.
+FACE_NEAR_DUPLICATE_DISTANCE = 4
+
+# Listing of the stored results (GET /image_analysis/face/results): images per
+# page by default and at most with ?limit=.
+FACE_RESULTS_PAGE_SIZE = 100
+FACE_RESULTS_MAX_PAGE_SIZE = 1000
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from .models import Image
+from .models import Face, Image
 
 admin.site.register(Image)
+admin.site.register(Face)
@@ -0,0 +1,177 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class QueueFull(Exception):
+    """
+    Exception raised when an analysis is submitted to a full queue.
+
+    Attributes:
+    retry_after (int): Seconds after which the client may retry.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__('The analysis queue is full')
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """
+    Exception raised when an analysis reaches the deadline of its request
+    before it starts.
+    """
+
+
+class BoundedAnalysisExecutor:
+    """
+    Class running the analyses of the event loop views on a thread pool
+    with a bounded queue.
+
+    An analysis submitted while every worker is busy and max_queue analyses
+    are already waiting is rejected at once, with an estimate of the time
+    the queue needs to drain based on the recent durations of the analyses.
+
+    Attributes:
+    workers (int): Number of analyses running at once.
+    max_queue (int): Number of analyses waiting for a worker.
+
+    Methods:
+    submit(function, *args): Queues an analysis.
+    pending(): Returns the number of running and waiting analyses.
+    expected_wait(): Estimates the wait of a new analysis.
+    retry_after(): Estimates when a rejected client may retry.
+    shutdown(): Stops the thread pool.
+    """
+
+    # Weight of the last duration in the moving average of the durations.
+    SMOOTHING = 0.2
+
+    def __init__(self, workers=None, max_queue=None):
+        """
+        Initializes a BoundedAnalysisExecutor object.
+
+        Keyword arguments:
+        workers (int): Number of analyses running at once, the number of
+        CPUs by default.
+        max_queue (int): Number of analyses waiting for a worker, twice the
+        number of workers by default.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = (self.workers * 2 if max_queue is None
+                          else max_queue)
+        self._executor = ThreadPoolExecutor(
+            self.workers, thread_name_prefix='face-analysis'
+        )
+        self._pending = 0
+        self._average_seconds = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """
+        Method that queues an analysis, raising QueueFull when the queue
+        is full.
+
+        Keyword arguments:
+        function (callable): The analysis, run in a worker thread.
+        args: Arguments of the function.
+
+        Returns:
+        concurrent.futures.Future -- The outcome of the function.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise QueueFull(self.__retry_after())
+            self._pending += 1
+        future = self._executor.submit(self.__run, function, args)
+        future.add_done_callback(self.__release)
+        return future
+
+    def pending(self):
+        """
+        Method that returns the number of running and waiting analyses.
+
+        Returns:
+        int -- The number of analyses submitted and not finished.
+        """
+        with self._lock:
+            return self._pending
+
+    def expected_wait(self):
+        """
+        Method that estimates the wait of an analysis submitted now before
+        a worker runs it.
+
+        Returns:
+        float -- Estimated seconds, 0 when a worker is idle or no analysis
+        finished yet.
+        """
+        with self._lock:
+            return self.__wait(self._pending + 1)
+
+    def retry_after(self):
+        """
+        Method that estimates when a rejected client may retry.
+
+        Returns:
+        int -- Seconds, at least 1.
+        """
+        with self._lock:
+            return self.__retry_after()
+
+    def shutdown(self):
+        """
+        Method that stops the thread pool, the waiting analyses being
+        cancelled.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __run(self, function, args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                if self._average_seconds is None:
+                    self._average_seconds = seconds
+                else:
+                    self._average_seconds += self.SMOOTHING * (
+                        seconds - self._average_seconds
+                    )
+            close_old_connections()
+
+    def __release(self, future):
+        # Also called for the analyses cancelled before running.
+        with self._lock:
+            self._pending -= 1
+
+    def __wait(self, position):
+        if self._average_seconds is None or position <= self.workers:
+            return 0.0
+        return (self._average_seconds
+                * math.ceil((position - self.workers) / self.workers))
+
+    def __retry_after(self):
+        return max(1, math.ceil(self.__wait(self._pending)))
+
+
+@lru_cache(maxsize=None)
+def analysis_executor():
+    """
+    Function returning the executor of the event loop views, configured by
+    the FACE_REALTIME_WORKERS and FACE_REALTIME_QUEUE_SIZE settings.
+
+    Returns:
+    BoundedAnalysisExecutor -- The executor of the process.
+    """
+    return BoundedAnalysisExecutor(
+        getattr(settings, 'FACE_REALTIME_WORKERS', None),
+        getattr(settings, 'FACE_REALTIME_QUEUE_SIZE', None),
+    )
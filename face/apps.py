@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class FaceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'face'
+
+    def ready(self):
+        """
+        Loads the cascade classifiers at startup when
+        FACE_PRELOAD_CLASSIFIERS is enabled, so the first analysis of the
+        worker process does not pay for the XML parsing. The cascades of
+        the FACE_DETECTOR backend are loaded with the Haar cascades used by
+        the refinement and the tracking.
+        """
+        if getattr(settings, 'FACE_PRELOAD_CLASSIFIERS', False):
+            from .classifier_pool import classifier_pool
+            from .face_analysis_algorithm import FaceAnalysisAlgorithm
+            from .models import detector_backend
+            classifier_pool.preload(
+                FaceAnalysisAlgorithm.CASCADE_PATHS
+                + getattr(detector_backend(), 'cascade_paths', [])
+            )
@@ -0,0 +1,65 @@
+import re
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import Image
+
+
+# Name of the grayscale copies written next to the uploads by the former
+# versions of face_detection(): a UUID4 and the extension of the upload.
+LEGACY_GRAY_IMAGE = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}'
+    r'\.\w+$'
+)
+
+
+def delete_expired_annotations(retention_days, dry_run=False):
+    """
+    Function that deletes the annotated images of the analyses older than
+    the retention period, the analysis results being kept.
+
+    Keyword arguments:
+    retention_days (float): Retention period in days.
+    dry_run (bool): Only list the files.
+
+    Returns:
+    list -- Names of the deleted files.
+    """
+    expired = Image.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=retention_days)
+    ).exclude(annotated_image='')
+    deleted = []
+    for image in expired.iterator():
+        deleted.append(image.annotated_image.name)
+        if not dry_run:
+            image.annotated_image.delete(save=False)
+            image.save(update_fields=['annotated_image'])
+    return deleted
+
+
+def delete_legacy_gray_images(dry_run=False):
+    """
+    Function that deletes the grayscale copies left in the upload directory
+    by the former versions of the analysis, which nothing reads.
+
+    Keyword arguments:
+    dry_run (bool): Only list the files.
+
+    Returns:
+    list -- Names of the deleted files.
+    """
+    directory = Image.image.field.upload_to
+    if not default_storage.exists(directory):
+        return []
+    _, files = default_storage.listdir(directory)
+    deleted = []
+    for name in files:
+        path = directory + name
+        if (LEGACY_GRAY_IMAGE.match(name)
+                and not Image.objects.filter(image=path).exists()):
+            deleted.append(path)
+            if not dry_run:
+                default_storage.delete(path)
+    return deleted
@@ -0,0 +1,192 @@
+import json
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from .models import Image, store_faces
+
+
+# Extensions of the archive members analyzed, the other files being skipped.
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+
+class BatchTooLarge(Exception):
+    """
+    Exception raised when a batch exceeds its number of files or bytes.
+    """
+
+
+def read_batch(files, max_files, max_bytes):
+    """
+    Function that reads the images of a batch.
+
+    Each uploaded file is either an image or a zip or tar archive of
+    images. The limits are checked on the declared sizes before reading,
+    so an oversized upload or archive member is never loaded in memory.
+
+    Keyword arguments:
+    files (list): The uploaded files.
+    max_files (int): Maximum number of images.
+    max_bytes (int): Maximum total size of the images.
+
+    Returns:
+    list -- (name, bytes) tuples, in upload and archive order.
+    """
+    images = []
+    total = 0
+
+    def add(name, size, read):
+        nonlocal total
+        total += size
+        if len(images) >= max_files:
+            raise BatchTooLarge(
+                'A batch is limited to {} images'.format(max_files)
+            )
+        if total > max_bytes:
+            raise BatchTooLarge(
+                'A batch is limited to {} bytes'.format(max_bytes)
+            )
+        images.append((os.path.basename(name), read()))
+
+    for uploaded_file in files:
+        if zipfile.is_zipfile(uploaded_file):
+            uploaded_file.seek(0)
+            with zipfile.ZipFile(uploaded_file) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and _is_image_name(member.filename):
+                        add(member.filename, member.file_size,
+                            lambda: archive.read(member))
+            continue
+        uploaded_file.seek(0)
+        archive = _open_tar(uploaded_file)
+        if archive is not None:
+            with archive:
+                for member in archive:
+                    if member.isfile() and _is_image_name(member.name):
+                        add(member.name, member.size,
+                            lambda: archive.extractfile(member).read())
+            continue
+        uploaded_file.seek(0)
+        add(uploaded_file.name, uploaded_file.size, uploaded_file.read)
+    return images
+
+
+def create_batch(images, strategy='', annotate=False, detector=''):
+    """
+    Function that stores the images of a batch and creates their rows with
+    a single bulk insert.
+
+    Keyword arguments:
+    images (list): (name, bytes) tuples returned by read_batch().
+    strategy (str): Name of the rotation search strategy.
+    annotate (bool): Store a copy of each image with the faces framed.
+    detector (str): Name of the detector backend.
+
+    Returns:
+    list -- The pending Image objects, in the order of the images.
+    """
+    rows = [
+        Image(
+            image=default_storage.save(
+                Image.image.field.generate_filename(None, name),
+                ContentFile(data)
+            ),
+            strategy=strategy,
+            detector=detector,
+            annotate=annotate
+        )
+        for name, data in images
+    ]
+    return Image.objects.bulk_create(rows)
+
+
+def analyze_batch(rows, images, workers=None):
+    """
+    Generator that analyzes the images of a batch concurrently.
+
+    The analyses share the warm classifiers of the process. The outcomes
+    are recorded on the rows, which are saved with one bulk update once the
+    batch is over or interrupted. The near-duplicates are looked up by each
+    worker thread on its own database connection, closed after each
+    analysis.
+
+    Keyword arguments:
+    rows (list): The Image objects returned by create_batch().
+    images (list): (name, bytes) tuples returned by read_batch().
+    workers (int): Number of concurrent analyses, one per CPU by default.
+
+    Yields:
+    dict -- The outcome of each image, as soon as its analysis is done.
+    """
+    executor = ThreadPoolExecutor(
+        workers or os.cpu_count() or 1, thread_name_prefix='face-batch'
+    )
+    futures = {
+        executor.submit(_record_analysis, row, data): (index, name, row)
+        for index, (row, (name, data)) in enumerate(zip(rows, images))
+    }
+    try:
+        for future in as_completed(futures):
+            index, name, row = futures[future]
+            outcome = {
+                'index': index,
+                'name': name,
+                'id': row.id,
+                'status': row.status,
+            }
+            if row.status == Image.FAILED:
+                outcome['error'] = row.error
+            else:
+                outcome['analysis_results'] = row.analysis_results
+            if row.annotated_image:
+                outcome['annotated_image'] = row.annotated_image.url
+            yield outcome
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        analyzed = [row for row in rows if row.status != Image.PENDING]
+        Image.objects.bulk_update(analyzed, Image.JOB_FIELDS)
+        store_faces(analyzed)
+        for row in analyzed:
+            row.index_detections()
+
+
+def _record_analysis(row, data):
+    """
+    Function that analyzes an image of a batch on a worker thread, then
+    closes the database connection of the thread.
+    """
+    try:
+        return row.record_analysis(data)
+    finally:
+        connection.close()
+
+
+def ndjson_lines(outcomes):
+    """
+    Generator that encodes the outcomes as newline-delimited JSON.
+    """
+    for outcome in outcomes:
+        yield json.dumps(outcome) + '\n'
+
+
+def _is_image_name(name):
+    """
+    Function that tells whether an archive member is an image to analyze,
+    skipping hidden files such as the __MACOSX metadata.
+    """
+    parts = name.replace('\\', '/').split('/')
+    if any(part.startswith(('.', '__MACOSX')) for part in parts):
+        return False
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _open_tar(uploaded_file):
+    try:
+        return tarfile.open(fileobj=uploaded_file, mode='r:*')
+    except tarfile.TarError:
+        return None
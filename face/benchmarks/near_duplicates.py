@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the near-duplicate index.
+
+Fills a HammingIndex with random 64-bit hashes and measures the lookups of
+copies of stored hashes with a few bits flipped, the way a recompressed or
+resized image differs from its original, checking that each one is found.
+
+Usage: python -m face.benchmarks.near_duplicates [--sizes 10000 1000000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from face.near_duplicates import HammingIndex
+
+
+def flipped_copies(hashes, count, max_distance, seed=0):
+    """
+    Function that picks stored hashes and flips up to max_distance of their
+    bits.
+
+    Keyword arguments:
+    hashes (numpy.ndarray): The stored hashes.
+    count (int): Number of copies.
+    max_distance (int): Maximum number of flipped bits.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    list -- (key, hash) tuples of the original key and the copied hash.
+    """
+    generator = np.random.default_rng(seed)
+    copies = []
+    for key in generator.integers(0, len(hashes), count):
+        value = int(hashes[key])
+        flips = generator.integers(0, max_distance + 1)
+        for bit in generator.choice(64, flips, replace=False):
+            value ^= 1 << int(bit)
+        copies.append((int(key), value))
+    return copies
+
+
+def run(sizes, lookups=1000, max_distance=4):
+    """
+    Function that runs the benchmark.
+
+    Keyword arguments:
+    sizes (list): Numbers of stored hashes.
+    lookups (int): Number of lookups per size.
+    max_distance (int): Maximum number of differing bits of a match.
+
+    Returns:
+    list -- One dictionary of timings in seconds per size.
+    """
+    results = []
+    for size in sizes:
+        hashes = np.random.default_rng(size).integers(
+            -2 ** 63, 2 ** 63, size=size, dtype=np.int64
+        )
+        index = HammingIndex(max_distance)
+        start = time.perf_counter()
+        index.extend(enumerate(hashes.tolist()))
+        build = time.perf_counter() - start
+        copies = flipped_copies(hashes, lookups, max_distance)
+        start = time.perf_counter()
+        found = sum(key in [match for _, match in index.search(value)]
+                    for key, value in copies)
+        lookup = (time.perf_counter() - start) / lookups
+        results.append({'hashes': size, 'build_seconds': build,
+                        'lookup_seconds': lookup,
+                        'found': found / lookups})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--max-distance', type=int, default=4)
+    arguments = parser.parse_args()
+    for result in run(arguments.sizes, arguments.lookups,
+                      arguments.max_distance):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Benchmark of the facial analysis pipeline.
+
+Runs FaceAnalysisAlgorithm over the test images and synthetic rotated,
+scaled and face-free variants, and reports for each case the time spent in
+each stage, the number of detectMultiScale calls, the peak memory
+allocated by Python and NumPy and the peak resident set size, as JSON.
+With --baseline, the results are compared with a saved run and the exit
+status is 1 when a case regressed.
+
+Usage: python -m face.benchmarks.pipeline [--repeat 5] [--output run.json]
+       [--baseline baseline.json] [--tolerance 0.1] [--cases rotated]
+       [--memory-budget 268435456]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from face.classifier_pool import classifier_pool
+from face.face_analysis_algorithm import FaceAnalysisAlgorithm
+from face.memory import peak_rss_bytes, reset_peak_rss
+from face.profiling import StageTimer
+from face.search_strategies import get_strategy
+
+
+TEST_IMAGES_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'test_images'
+)
+FORMAT_VERSION = 1
+
+
+def benchmark_cases(directory=TEST_IMAGES_DIRECTORY):
+    """
+    Function that builds the encoded images of the benchmark.
+
+    Each test image is used as is. The first image with a face is also
+    rotated by 30 and 90 degrees and scaled by one half and two, and a
+    face-free gradient with noise is generated.
+
+    Keyword arguments:
+    directory (str): Directory of the test images.
+
+    Returns:
+    dict -- JPEG-encoded images by case name, in a stable order.
+    """
+    cases = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as image_file:
+            cases[os.path.splitext(name)[0]] = image_file.read()
+    image = cv2.imread(os.path.join(directory, 'image_with_1_face.jpg'))
+    height, width = image.shape[:2]
+    tilt = cv2.getRotationMatrix2D((width / 2, height / 2), 30, 1.0)
+    generator = np.random.default_rng(0)
+    gradient = np.linspace(40, 215, 1280, dtype=np.float32)
+    face_free = np.clip(
+        np.tile(gradient, (960, 1))[:, :, None]
+        + generator.normal(0, 12, (960, 1280, 3)), 0, 255
+    ).astype(np.uint8)
+    variants = {
+        'rotated_30': cv2.warpAffine(image, tilt, (width, height)),
+        'rotated_90': cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE),
+        'scaled_50': cv2.resize(image, None, fx=0.5, fy=0.5,
+                                interpolation=cv2.INTER_AREA),
+        'scaled_200': cv2.resize(image, None, fx=2, fy=2),
+        'face_free': face_free,
+    }
+    for name, variant in variants.items():
+        cases[name] = cv2.imencode(
+            '.jpg', variant, [cv2.IMWRITE_JPEG_QUALITY, 95]
+        )[1].tobytes()
+    return cases
+
+
+def run_case(data, repeat=5, **options):
+    """
+    Function that measures the analysis of an encoded image.
+
+    Keyword arguments:
+    data (bytes): The encoded image.
+    repeat (int): Number of measured analyses.
+    options: Options of FaceAnalysisAlgorithm.
+
+    Returns:
+    dict -- The outcome of the analysis, the median, 90th percentile and
+    maximum of the total seconds, the median seconds of each stage, the
+    number of detectMultiScale calls, the peak memory traced in bytes and
+    the peak resident set size in bytes. Without Linux, the resident set
+    size cannot be reset and is the peak of the process.
+    """
+    totals = []
+    stages = {}
+    peaks = []
+    rss_peaks = []
+    for _ in range(repeat):
+        timer = StageTimer()
+        reset_peak_rss()
+        tracemalloc.start()
+        start = time.perf_counter()
+        algorithm = FaceAnalysisAlgorithm.from_bytes(
+            data, timer=timer, **options
+        )
+        result = algorithm.face_detection()
+        algorithm.encode_annotated_image('.jpg')
+        totals.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        rss_peaks.append(peak_rss_bytes())
+        for stage, seconds in timer.timings().items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        'faces': result['number_of_faces_detected'],
+        'rotation_angle': result['rotation_angle'],
+        'rotations_tried': result['search']['rotations_tried'],
+        'cascade_calls': timer.counts().get('cascades', 0),
+        'seconds': {
+            'median': float(np.median(totals)),
+            'p90': float(np.percentile(totals, 90)),
+            'max': max(totals),
+        },
+        'stages': {stage: float(np.median(seconds))
+                   for stage, seconds in stages.items()},
+        'peak_memory_bytes': max(peaks),
+        'peak_rss_bytes': max(rss_peaks),
+    }
+
+
+def run(repeat=5, case_filters=None, strategy='exhaustive',
+        max_dimension=None, memory_budget=None):
+    """
+    Function that runs the benchmark.
+
+    Keyword arguments:
+    repeat (int): Number of measured analyses per case.
+    case_filters (list): Substrings selecting the cases, every case when
+    empty.
+    strategy (str): Name of the rotation search strategy.
+    max_dimension (int): Largest side of the detection image.
+    memory_budget (int): Bytes an analysis may allocate.
+
+    Returns:
+    dict -- The configuration and the results of each case.
+    """
+    classifier_pool.preload(FaceAnalysisAlgorithm.CASCADE_PATHS)
+    results = []
+    for name, data in benchmark_cases().items():
+        if case_filters and not any(part in name for part in case_filters):
+            continue
+        result = run_case(
+            data, repeat, strategy=get_strategy(strategy),
+            max_dimension=max_dimension, memory_budget=memory_budget
+        )
+        results.append(dict(result, case=name, bytes=len(data)))
+    return {
+        'version': FORMAT_VERSION,
+        'configuration': {
+            'repeat': repeat,
+            'strategy': strategy,
+            'max_dimension': max_dimension,
+            'memory_budget': memory_budget,
+            'opencv': cv2.__version__,
+        },
+        'cases': results,
+    }
+
+
+def compare(current, baseline, tolerance=0.1):
+    """
+    Function that compares a run with a baseline run.
+
+    A case regresses when its median or 90th percentile time, its peak
+    memory or its peak resident set size grows by more than the tolerance,
+    or when it makes more detectMultiScale calls or finds a different
+    number of faces.
+
+    Keyword arguments:
+    current (dict): Results of run().
+    baseline (dict): Results of a previous run().
+    tolerance (float): Relative growth allowed.
+
+    Returns:
+    list -- One comparison per case present in both runs.
+    """
+    baseline_cases = {case['case']: case for case in baseline['cases']}
+    comparisons = []
+    for case in current['cases']:
+        reference = baseline_cases.get(case['case'])
+        if reference is None:
+            continue
+        ratios = {
+            'median_ratio': _ratio(case['seconds']['median'],
+                                   reference['seconds']['median']),
+            'p90_ratio': _ratio(case['seconds']['p90'],
+                                reference['seconds']['p90']),
+            'memory_ratio': _ratio(case['peak_memory_bytes'],
+                                   reference['peak_memory_bytes']),
+        }
+        # Baselines of former versions have no resident set size.
+        if 'peak_rss_bytes' in reference:
+            ratios['rss_ratio'] = _ratio(case['peak_rss_bytes'],
+                                         reference['peak_rss_bytes'])
+        calls_delta = case['cascade_calls'] - reference['cascade_calls']
+        faces_changed = case['faces'] != reference['faces']
+        comparisons.append(dict(
+            ratios, case=case['case'], cascade_calls_delta=calls_delta,
+            faces_changed=faces_changed,
+            regression=(any(ratio > 1 + tolerance
+                            for ratio in ratios.values())
+                        or calls_delta > 0 or faces_changed)
+        ))
+    return comparisons
+
+
+def _ratio(value, reference):
+    return value / reference if reference else float(value > 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cases', nargs='*', default=[],
+                        help='Substrings selecting the cases.')
+    parser.add_argument('--strategy', default='exhaustive')
+    parser.add_argument('--max-dimension', type=int, default=None)
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='Bytes an analysis may allocate.')
+    parser.add_argument('--output', help='File receiving the results.')
+    parser.add_argument('--baseline',
+                        help='Results of a previous run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    arguments = parser.parse_args()
+    results = run(arguments.repeat, arguments.cases, arguments.strategy,
+                  arguments.max_dimension, arguments.memory_budget)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    for case in results['cases']:
+        print(json.dumps(case))
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            comparisons = compare(results, json.load(baseline_file),
+                                  arguments.tolerance)
+        for comparison in comparisons:
+            print(json.dumps(comparison))
+        if any(comparison['regression'] for comparison in comparisons):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Micro-benchmark of the rectangle filtering.
+
+Compares filter_rectangles with the nested Python loops it replaced, on
+random clusters of rectangles similar to the detections of the cascade
+passes on group photos, and checks that the 'compat' mode gives the same
+rectangles.
+
+Usage: python -m face.benchmarks.rectangles [--sizes 10 100 1000 5000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from face.rectangles import filter_rectangles
+
+
+def remove_double_detection(rectangles):
+    """
+    Reference implementation removing the rectangles containing others.
+    """
+    retained_rectangles = []
+    for i in range(len(rectangles)):
+        x_i, y_i, w_i, h_i = rectangles[i]
+        is_contained = False
+        for j in range(len(rectangles)):
+            if i != j:
+                x_j, y_j, w_j, h_j = rectangles[j]
+                if (x_i <= x_j and y_i <= y_j and x_i + w_i >= x_j + w_j
+                        and y_i + h_i >= y_j + h_j):
+                    is_contained = True
+                    break
+        if not is_contained:
+            retained_rectangles.append((x_i, y_i, w_i, h_i))
+    return retained_rectangles
+
+
+def remove_containing_rectangles(rectangles):
+    """
+    Reference implementation removing the rectangles overlapping a
+    retained one.
+    """
+    retained_rectangles = []
+    for i in range(len(rectangles)):
+        x_i, y_i, w_i, h_i = rectangles[i]
+        is_contained_by_other = any(
+            (x_i < x_r + w_r and x_i + w_i > x_r and y_i < y_r + h_r
+             and y_i + h_i > y_r)
+            for (x_r, y_r, w_r, h_r) in retained_rectangles
+        )
+        if not is_contained_by_other:
+            retained_rectangles.append((x_i, y_i, w_i, h_i))
+    return retained_rectangles
+
+
+def reference_filter(rectangles):
+    """
+    Reference implementation of the 'compat' mode of filter_rectangles.
+    """
+    sorted_faces = sorted(rectangles, key=lambda x: x[2] * x[3], reverse=True)
+    faces = remove_double_detection(sorted_faces)
+    return remove_containing_rectangles(faces)
+
+
+def random_rectangles(count, seed=0, width=4000, height=3000):
+    """
+    Function that generates rectangles clustered around random faces, the
+    way several cascade passes detect the same faces with small offsets.
+
+    Keyword arguments:
+    count (int): Number of rectangles.
+    seed (int): Seed of the random generator.
+    width (int): Width of the image.
+    height (int): Height of the image.
+
+    Returns:
+    numpy.ndarray -- Array of shape (count, 4) of rectangles.
+    """
+    generator = np.random.default_rng(seed)
+    faces = max(1, count // 10)
+    sizes = generator.integers(60, 400, faces)
+    centers = np.column_stack((generator.integers(0, width, faces),
+                               generator.integers(0, height, faces)))
+    owners = generator.integers(0, faces, count)
+    jitter = generator.normal(0, 0.08, (count, 3))
+    side = np.maximum(24, sizes[owners] * (1 + jitter[:, 2])).astype(int)
+    corner = (centers[owners] + jitter[:, :2] * sizes[owners, None]
+              - side[:, None] / 2).astype(int)
+    return np.column_stack((corner, side, side)).astype(np.int32)
+
+
+def measure(function, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(sizes, repeat=3, reference_limit=5000):
+    """
+    Function that runs the benchmark.
+
+    Keyword arguments:
+    sizes (list): Numbers of rectangles to filter.
+    repeat (int): Runs per measure, the best one is kept.
+    reference_limit (int): Largest size measured with the loops.
+
+    Returns:
+    list -- One dictionary of timings in seconds per size.
+    """
+    results = []
+    for size in sizes:
+        rectangles = random_rectangles(size)
+        vectorized, retained = measure(filter_rectangles, rectangles,
+                                       repeat=repeat)
+        nms, _ = measure(
+            lambda r: filter_rectangles(r, mode='nms', weighted=True),
+            rectangles, repeat=repeat
+        )
+        result = {'rectangles': size, 'retained': len(retained),
+                  'compat_seconds': vectorized, 'nms_seconds': nms}
+        if size <= reference_limit:
+            loops, expected = measure(reference_filter, rectangles.tolist(),
+                                      repeat=1)
+            result['loops_seconds'] = loops
+            result['identical'] = retained.tolist() == [
+                list(rectangle) for rectangle in expected
+            ]
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reference-limit', type=int, default=5000)
+    arguments = parser.parse_args()
+    for result in run(arguments.sizes, arguments.repeat,
+                      arguments.reference_limit):
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+import cv2
+
+from .classifier_pool import classifier_pool
+from .face_analysis_algorithm import FaceAnalysisAlgorithm
+from .near_duplicates import perceptual_hash
+from .rotation_prior import RotationPrior
+
+
+# This module is imported by the worker processes of analyze_images(),
+# started without Django: it must not import the models.
+
+
+def find_images(paths, extensions, file_list=None):
+    """
+    Generator that lists the images to analyze, in a stable order.
+
+    Keyword arguments:
+    paths (list): Directories, walked recursively, or image files.
+    extensions (tuple): Lowercase extensions of the images, the other
+    files of the directories being skipped.
+    file_list (str): Optional file listing one path per line, '-' for the
+    standard input.
+
+    Yields:
+    str -- The path of each image.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, directories, names in os.walk(path):
+            directories[:] = sorted(
+                name for name in directories if not name.startswith('.')
+            )
+            for name in sorted(names):
+                if (not name.startswith('.')
+                        and name.lower().endswith(extensions)):
+                    yield os.path.join(directory, name)
+    if file_list is not None:
+        listed = (sys.stdin if file_list == '-'
+                  else open(file_list, encoding='utf-8'))
+        try:
+            for line in listed:
+                if line.strip():
+                    yield line.strip()
+        finally:
+            if listed is not sys.stdin:
+                listed.close()
+
+
+class Checkpoint:
+    """
+    Class recording the images already analyzed, so that an interrupted run
+    resumes where it stopped.
+
+    The paths are appended to a text file once their results are written,
+    a run interrupted in between analyzing the last chunk again.
+
+    Attributes:
+    path (str): File path of the checkpoint.
+
+    Methods:
+    record(paths): Marks images as analyzed.
+    close(): Closes the checkpoint file.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes a Checkpoint object from its file, if any.
+
+        Keyword arguments:
+        path (str): File path of the checkpoint.
+        """
+        self.path = path
+        self._done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as checkpoint_file:
+                self._done.update(line.rstrip('\n')
+                                  for line in checkpoint_file)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, path):
+        return path in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def record(self, paths):
+        """
+        Method that marks images as analyzed, the file being synced to disk.
+
+        Keyword arguments:
+        paths (iterable): Paths of the images.
+        """
+        paths = list(paths)
+        self._file.writelines(path + '\n' for path in paths)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._done.update(paths)
+
+    def close(self):
+        """
+        Method that closes the checkpoint file.
+        """
+        self._file.close()
+
+
+class JSONLinesWriter:
+    """
+    Class appending the records of the analyses to a JSON lines file.
+
+    Methods:
+    write(records): Appends records.
+    close(): Closes the file.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes a JSONLinesWriter object.
+
+        Keyword arguments:
+        path (str): File path of the output, appended to when it exists.
+        """
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        """
+        Method that appends records, one JSON object per line.
+
+        Keyword arguments:
+        records (list): Records returned by analyze_images().
+        """
+        self._file.writelines(json.dumps(record) + '\n' for record in records)
+        self._file.flush()
+
+    def close(self):
+        """
+        Method that closes the file.
+        """
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Class writing the records of the analyses as a Parquet dataset, one
+    file per chunk in the output directory, which requires pyarrow.
+
+    The search summary is flattened into columns and the facial skin of
+    the faces is stored in four list columns.
+
+    Methods:
+    write(records): Writes records in a new file of the dataset.
+    close(): Does nothing, each file being complete once written.
+    """
+
+    def __init__(self, directory):
+        """
+        Initializes a ParquetWriter object.
+
+        Keyword arguments:
+        directory (str): Directory of the dataset, added to when it exists.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('The parquet format requires pyarrow')
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._parts = sum(name.endswith('.parquet')
+                          for name in os.listdir(directory))
+
+    def write(self, records):
+        """
+        Method that writes records in a new file of the dataset.
+
+        Keyword arguments:
+        records (list): Records returned by analyze_images().
+        """
+        columns = {name: [] for name in (
+            'path', 'status', 'error', 'seconds', 'number_of_faces_detected',
+            'rotation_angle', 'skin_brightness', 'skin_info', 'votes',
+            'boxes', 'strategy',
+            'detector', 'cascade_calls', 'rotations_tried',
+            'budget_exhausted', 'perceptual_hash'
+        )}
+        for record in records:
+            results = record.get('analysis_results') or {}
+            search = results.get('search', {})
+            skin = results.get('facial_skin', [])
+            row = dict(
+                record, error=record.get('error'),
+                number_of_faces_detected=results.get(
+                    'number_of_faces_detected'
+                ),
+                rotation_angle=results.get('rotation_angle'),
+                skin_brightness=[face['skin_brightness'] for face in skin],
+                skin_info=[face['skin_info'] for face in skin],
+                votes=[face.get('votes') for face in skin],
+                boxes=[face.get('box') for face in skin], **search
+            )
+            for name, values in columns.items():
+                values.append(row.get(name))
+        path = os.path.join(
+            self.directory, 'part-{:05d}.parquet'.format(self._parts)
+        )
+        self._parquet.write_table(self._pyarrow.table(columns), path)
+        self._parts += 1
+
+    def close(self):
+        pass
+
+
+WRITERS = {'jsonl': JSONLinesWriter, 'parquet': ParquetWriter}
+
+
+def analyze_images(paths, options, workers=None, chunk_size=256,
+                   rotation_prior_half_life=None):
+    """
+    Generator that analyzes images on a pool of worker processes.
+
+    Each worker process loads the classifiers once and analyzes whole
+    images with OpenCV on a single thread, so the throughput grows with the
+    number of workers up to the number of CPUs. The paths are consumed one
+    chunk at a time, two chunks being in the pool so that the workers never
+    wait for the results of a chunk to be written.
+
+    Keyword arguments:
+    paths (iterable): Paths of the images.
+    options (dict): Keyword arguments of FaceAnalysisAlgorithm, picklable,
+    such as analysis_options() without the rotation prior.
+    workers (int): Number of worker processes, one per CPU by default.
+    chunk_size (int): Number of images per chunk.
+    rotation_prior_half_life (float): Half-life of the rotation prior of
+    each worker, the angles being tried in their configured order when
+    None.
+
+    Yields:
+    list -- The records of the images of each chunk, in the order of the
+    paths, with the 'path', the 'status' ('done' or 'failed'), the
+    'analysis_results' or the 'error', and the 'seconds' of the analysis.
+    A 'perceptual_hash' and the 'detections' of the image are added when
+    its search was not stopped by the budget.
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(
+        workers or os.cpu_count() or 1, initializer=_initialize_worker,
+        initargs=(options, rotation_prior_half_life)
+    ) as pool:
+        paths = iter(paths)
+        pending = deque()
+        while True:
+            chunk = list(islice(paths, chunk_size))
+            if chunk:
+                pending.append(pool.map_async(_analyze_path, chunk, 1))
+            if pending and (len(pending) > 1 or not chunk):
+                yield pending.popleft().get()
+            if not chunk and not pending:
+                return
+
+
+_worker_options = None
+
+
+def _initialize_worker(options, rotation_prior_half_life):
+    """
+    Function preparing a worker process: OpenCV is limited to one thread,
+    the parallelism coming from the pool, and the classifiers are loaded.
+    """
+    global _worker_options
+    cv2.setNumThreads(1)
+    _worker_options = dict(options, rotation_prior=(
+        None if rotation_prior_half_life is None
+        else RotationPrior(half_life=rotation_prior_half_life)
+    ))
+    classifier_pool.preload(
+        FaceAnalysisAlgorithm.CASCADE_PATHS
+        + getattr(options.get('detector'), 'cascade_paths', [])
+    )
+
+
+def _analyze_path(path):
+    """
+    Function analyzing an image in a worker process.
+    """
+    start = time.perf_counter()
+    record = {'path': path}
+    try:
+        with open(path, 'rb') as image_file:
+            image_data = image_file.read()
+        algorithm = FaceAnalysisAlgorithm.from_bytes(
+            image_data, image_name=path, **_worker_options
+        )
+        record['analysis_results'] = algorithm.face_detection()
+        record['status'] = 'done'
+        if not record['analysis_results']['search']['budget_exhausted']:
+            record['perceptual_hash'] = perceptual_hash(algorithm.load_image())
+            record['detections'] = algorithm.detection_record()
+    except Exception as exception:
+        record['status'] = 'failed'
+        record['error'] = str(exception) or exception.__class__.__name__
+    record['seconds'] = time.perf_counter() - start
+    return record
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+
+
+CLASSIFIERS_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'classifiers'
+)
+
+
+class ClassifierPool:
+    """
+    Class for sharing cascade classifiers inside a worker process.
+
+    Parsing a Haar cascade XML file is expensive, so each classifier is
+    loaded once and then reused by every analysis of the process.
+    cv2.CascadeClassifier instances are not guaranteed to be thread safe,
+    so an instance is lent to a single thread at a time: a thread acquires
+    an idle instance, or a new one is loaded when all the existing instances
+    of this cascade are in use, and gives it back once the detection is done.
+
+    Attributes:
+    directory (str): Directory used to resolve relative cascade file names.
+
+    Methods:
+    acquire(cascade_path): Context manager lending a classifier.
+    preload(cascade_paths): Loads one instance of each cascade.
+    stats(): Returns load times and reuse counts per cascade.
+    """
+
+    def __init__(self, directory=CLASSIFIERS_DIRECTORY):
+        """
+        Initializes a ClassifierPool object.
+
+        Keyword arguments:
+        directory (str): Directory used to resolve relative cascade file
+        names.
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._stats = {}
+
+    @contextmanager
+    def acquire(self, cascade_path):
+        """
+        Method that lends a classifier to the calling thread.
+
+        Keyword arguments:
+        cascade_path (str): File path of the cascade XML file, absolute or
+        relative to the pool directory.
+
+        Returns:
+        cv2.CascadeClassifier -- Classifier reserved for the caller until the
+        end of the with block.
+        """
+        cascade_path = self.__resolve(cascade_path)
+        with self._lock:
+            idle = self._idle.setdefault(cascade_path, [])
+            classifier = idle.pop() if idle else None
+            if classifier is not None:
+                self.__cascade_stats(cascade_path)['reuses'] += 1
+        if classifier is None:
+            classifier = self.__load(cascade_path)
+        try:
+            yield classifier
+        finally:
+            with self._lock:
+                self._idle.setdefault(cascade_path, []).append(classifier)
+
+    def preload(self, cascade_paths):
+        """
+        Method that loads one idle instance of each cascade.
+
+        Keyword arguments:
+        cascade_paths (list): File paths of the cascade XML files.
+        """
+        for cascade_path in cascade_paths:
+            cascade_path = self.__resolve(cascade_path)
+            with self._lock:
+                if self._idle.get(cascade_path):
+                    continue
+            classifier = self.__load(cascade_path)
+            with self._lock:
+                self._idle.setdefault(cascade_path, []).append(classifier)
+
+    def stats(self):
+        """
+        Method that returns the pool statistics.
+
+        Returns:
+        dict -- Dictionary keyed by cascade file name with the number of
+        loaded instances, the total load time in seconds and the number of
+        reuses.
+        Example: {'haarcascade_profileface.xml': {'instances': 1,
+        'load_seconds': 0.03, 'reuses': 91}}
+        """
+        with self._lock:
+            return {
+                os.path.basename(cascade_path): dict(cascade_stats)
+                for cascade_path, cascade_stats in self._stats.items()
+            }
+
+    def clear(self):
+        """
+        Method that drops every idle classifier and the statistics.
+        """
+        with self._lock:
+            self._idle.clear()
+            self._stats.clear()
+
+    def __resolve(self, cascade_path):
+        return os.path.abspath(os.path.join(self.directory, cascade_path))
+
+    def __cascade_stats(self, cascade_path):
+        return self._stats.setdefault(
+            cascade_path, {'instances': 0, 'load_seconds': 0.0, 'reuses': 0}
+        )
+
+    def __load(self, cascade_path):
+        start = time.perf_counter()
+        classifier = cv2.CascadeClassifier(cascade_path)
+        elapsed = time.perf_counter() - start
+        if classifier.empty():
+            raise ValueError(
+                'Unable to load the cascade classifier ' + cascade_path
+            )
+        with self._lock:
+            cascade_stats = self.__cascade_stats(cascade_path)
+            cascade_stats['instances'] += 1
+            cascade_stats['load_seconds'] += elapsed
+        return classifier
+
+
+classifier_pool = ClassifierPool()
@@ -0,0 +1,349 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from .classifier_pool import CLASSIFIERS_DIRECTORY
+
+
+HAAR_CASCADE_PATHS = [
+    os.path.join(CLASSIFIERS_DIRECTORY, 'haarcascade_frontalface_default.xml'),
+    os.path.join(CLASSIFIERS_DIRECTORY, 'haarcascade_profileface.xml'),
+]
+HAAR_PARAMETERS = [
+    {'scale_factor': 1.45, 'min_neighbors': 5},
+    {'scale_factor': 1.48, 'min_neighbors': 6},
+    {'scale_factor': 1.55, 'min_neighbors': 6},
+    {'scale_factor': 1.60, 'min_neighbors': 6},
+    {'scale_factor': 1.70, 'min_neighbors': 6}
+]
+LBP_CASCADE_PATH = os.path.join(
+    CLASSIFIERS_DIRECTORY, 'lbpcascade_frontalface_improved.xml'
+)
+LBP_PARAMETERS = [{'scale_factor': 1.1, 'min_neighbors': 4}]
+MIN_SIZE_RATIO = 13
+
+
+class DetectorBackend:
+    """
+    Base class for the face detectors run by FaceAnalysisAlgorithm on each
+    rotated image.
+
+    Attributes:
+    name (str): Name of the backend.
+    color (bool): Whether the backend detects the faces of the rotated BGR
+    detection image rather than of the equalized grayscale image.
+    min_size_ratio (int): The smallest face detected is the smallest side
+    of the image divided by min_size_ratio.
+
+    Methods:
+    calls_per_image(): Returns the maximum number of detector calls per
+    image.
+    configuration(): Describes the backend.
+    detect(image, budget, strategy, pool, timer): Detects the faces of a
+    preprocessed image.
+    """
+
+    name = None
+    color = False
+
+    def __init__(self, min_size_ratio=MIN_SIZE_RATIO):
+        """
+        Initializes a DetectorBackend object.
+
+        Keyword arguments:
+        min_size_ratio (int): Ratio between the smallest side of the image
+        and the smallest face.
+        """
+        self.min_size_ratio = min_size_ratio
+
+    def calls_per_image(self):
+        """
+        Method that returns the maximum number of detector calls made on an
+        image, each call being charged to the search budget.
+
+        Returns:
+        int -- The number of calls.
+        """
+        raise NotImplementedError
+
+    def configuration(self):
+        """
+        Method that describes the backend.
+
+        Returns:
+        dict -- The name and the options of the backend.
+        """
+        return dict(
+            {key: value for key, value in vars(self).items()
+             if not key.startswith('_')},
+            name=self.name
+        )
+
+    def detect(self, image, budget, strategy, pool, timer):
+        """
+        Method that detects the faces of a preprocessed image.
+
+        Keyword arguments:
+        image (numpy.ndarray): The rotated equalized grayscale image, or the
+        rotated BGR detection image when color is set.
+        budget (SearchBudget): Budget charged for each detector call.
+        strategy (SearchStrategy): Strategy deciding when the passes can
+        stop early.
+        pool (ClassifierPool): Pool lending the cascade classifiers.
+        timer (StageTimer): Timer of the 'cascades' stage.
+
+        Returns:
+        list -- The rectangle arrays (x, y, w, h) of the passes that found
+        faces.
+        """
+        raise NotImplementedError
+
+    def min_size(self, image):
+        """
+        Method that returns the side of the smallest face detected.
+        """
+        height, width = image.shape[:2]
+        return min(int(height / self.min_size_ratio),
+                   int(width / self.min_size_ratio))
+
+
+class CascadeDetector(DetectorBackend):
+    """
+    Backend running every cascade with every parameter set, each pass
+    voting for the faces it finds.
+
+    Attributes:
+    cascade_paths (list): File paths of the cascade XML files, Haar or LBP.
+    parameters (list): Scale factor and minimum neighbors of each pass.
+    """
+
+    def __init__(self, cascade_paths, parameters, **kwargs):
+        """
+        Initializes a CascadeDetector object.
+
+        Keyword arguments:
+        cascade_paths (list): File paths of the cascade XML files.
+        parameters (list): Dictionaries of scale_factor and min_neighbors.
+        kwargs: Options of DetectorBackend.
+        """
+        super().__init__(**kwargs)
+        self.cascade_paths = list(cascade_paths)
+        self.parameters = list(parameters)
+
+    def calls_per_image(self):
+        return len(self.cascade_paths) * len(self.parameters)
+
+    def configuration(self):
+        configuration = super().configuration()
+        configuration['cascade_paths'] = [
+            os.path.basename(cascade_path)
+            for cascade_path in self.cascade_paths
+        ]
+        return configuration
+
+    def detect(self, image, budget, strategy, pool, timer):
+        faces_detected_results = []
+        size = self.min_size(image)
+        for cascade_path in self.cascade_paths:
+            with pool.acquire(cascade_path) as face_cascade:
+                for parameters in self.parameters:
+                    if budget.exhausted() or strategy.is_confident(
+                            len(faces_detected_results)):
+                        return faces_detected_results
+                    budget.charge()
+                    with timer.stage('cascades'):
+                        faces_detected = face_cascade.detectMultiScale(
+                            image,
+                            scaleFactor=parameters['scale_factor'],
+                            minNeighbors=parameters['min_neighbors'],
+                            minSize=(size, size),
+                            flags=cv2.CASCADE_SCALE_IMAGE
+                        )
+                    if len(faces_detected) > 0:
+                        faces_detected_results.append(np.array(faces_detected))
+        return faces_detected_results
+
+
+class HaarDetector(CascadeDetector):
+    """
+    Backend of the Haar cascades of frontal and profile faces, each run
+    with five parameter sets.
+    """
+
+    name = 'haar'
+
+    def __init__(self, cascade_paths=None, parameters=None, **kwargs):
+        super().__init__(cascade_paths or HAAR_CASCADE_PATHS,
+                         parameters or HAAR_PARAMETERS, **kwargs)
+
+
+class LBPDetector(CascadeDetector):
+    """
+    Backend of a local binary pattern cascade, several times faster than
+    the Haar cascades per pass and run with a single parameter set.
+
+    The cascade is not distributed with the OpenCV wheels:
+    lbpcascade_frontalface_improved.xml from the OpenCV repository is
+    shipped with the Haar cascades and read by default.
+    """
+
+    name = 'lbp'
+
+    def __init__(self, cascade_path=LBP_CASCADE_PATH, parameters=None,
+                 **kwargs):
+        """
+        Initializes a LBPDetector object.
+
+        Keyword arguments:
+        cascade_path (str): File path of the LBP cascade XML file.
+        parameters (list): Dictionaries of scale_factor and min_neighbors.
+        kwargs: Options of DetectorBackend.
+        """
+        if not os.path.isfile(cascade_path):
+            raise ValueError('LBP cascade not found: ' + cascade_path)
+        super().__init__([cascade_path], parameters or LBP_PARAMETERS,
+                         **kwargs)
+
+
+class DNNDetector(DetectorBackend):
+    """
+    Backend of a single shot face detection network run with cv2.dnn on
+    the CPU, such as the ResNet-10 SSD of the OpenCV face detector
+    (deploy.prototxt and res10_300x300_ssd_iter_140000.caffemodel).
+
+    One forward pass on the image resized to input_size replaces the
+    cascade passes. The network is given the rotated color image it was
+    trained on, and its detections are kept above a confidence
+    threshold. The networks are loaded from local files once per process
+    and lent to one thread at a time.
+
+    Attributes:
+    model_path (str): File path of the weights.
+    config_path (str): File path of the network description, if the
+    weights do not include it.
+    input_size (int): Side of the square network input.
+    confidence (float): Minimum confidence of a detection.
+    mean (tuple): Mean subtracted from each channel.
+    """
+
+    name = 'dnn'
+    color = True
+
+    def __init__(self, model_path, config_path=None, input_size=300,
+                 confidence=0.5, mean=(104.0, 177.0, 123.0), **kwargs):
+        """
+        Initializes a DNNDetector object.
+
+        Keyword arguments:
+        model_path (str): File path of the weights.
+        config_path (str): File path of the network description.
+        input_size (int): Side of the square network input.
+        confidence (float): Minimum confidence of a detection.
+        mean (tuple): Mean subtracted from each channel.
+        kwargs: Options of DetectorBackend.
+        """
+        for path in (model_path, config_path):
+            if path is not None and not os.path.isfile(path):
+                raise ValueError('DNN model file not found: ' + path)
+        super().__init__(**kwargs)
+        self.model_path = model_path
+        self.config_path = config_path
+        self.input_size = input_size
+        self.confidence = confidence
+        self.mean = tuple(mean)
+
+    def calls_per_image(self):
+        return 1
+
+    def configuration(self):
+        configuration = super().configuration()
+        configuration['model_path'] = os.path.basename(self.model_path)
+        if self.config_path is not None:
+            configuration['config_path'] = os.path.basename(self.config_path)
+        return configuration
+
+    def load_net(self):
+        """
+        Method that loads the network from its files.
+
+        Returns:
+        cv2.dnn.Net -- The network, computed on the CPU.
+        """
+        net = cv2.dnn.readNet(self.model_path, self.config_path or '')
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return net
+
+    def detect(self, image, budget, strategy, pool, timer):
+        if budget.exhausted():
+            return []
+        budget.charge()
+        height, width = image.shape[:2]
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        blob = cv2.dnn.blobFromImage(
+            image, 1.0, (self.input_size, self.input_size), self.mean
+        )
+        with self.__acquire_net() as net, timer.stage('cascades'):
+            net.setInput(blob)
+            output = net.forward()
+        detections = output.reshape(-1, output.shape[-1])
+        detections = detections[detections[:, 2] >= self.confidence]
+        corners = np.clip(detections[:, 3:7], 0, 1) * (
+            width, height, width, height
+        )
+        faces = np.column_stack(
+            (corners[:, :2], corners[:, 2:] - corners[:, :2])
+        ).round().astype(np.int64)
+        faces = faces[(faces[:, 2:] >= self.min_size(image)).all(axis=1)]
+        return [faces] if len(faces) > 0 else []
+
+    @contextmanager
+    def __acquire_net(self):
+        key = (type(self), self.model_path, self.config_path)
+        with _nets_lock:
+            idle = _nets.setdefault(key, [])
+            net = idle.pop() if idle else None
+        if net is None:
+            net = self.load_net()
+        try:
+            yield net
+        finally:
+            with _nets_lock:
+                _nets[key].append(net)
+
+
+# Idle networks by backend class and model files, cv2.dnn.Net instances
+# being used by one thread at a time.
+_nets = {}
+_nets_lock = threading.Lock()
+
+DETECTORS = {
+    detector.name: detector
+    for detector in (HaarDetector, LBPDetector, DNNDetector)
+}
+
+
+def get_detector(name, **kwargs):
+    """
+    Function that creates a detector backend from its name.
+
+    Keyword arguments:
+    name (str): Name of the backend, a key of DETECTORS.
+    kwargs: Options given to the backend constructor.
+
+    Returns:
+    DetectorBackend -- The configured backend.
+    """
+    try:
+        detector_class = DETECTORS[name]
+    except KeyError:
+        raise ValueError(
+            'Unknown detector "{}", expected one of: {}'.format(
+                name, ', '.join(sorted(DETECTORS))
+            )
+        )
+    return detector_class(**kwargs)
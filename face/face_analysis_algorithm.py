@@ -1,9 +1,22 @@
 import os
+import threading
 import cv2
-import uuid
-from statistics import median
+from collections import OrderedDict
+from functools import partial
 import numpy as np
 
+from .classifier_pool import CLASSIFIERS_DIRECTORY, classifier_pool
+from .detectors import (
+    HAAR_CASCADE_PATHS, HAAR_PARAMETERS, MIN_SIZE_RATIO, HaarDetector
+)
+from .profiling import NULL_TIMER
+from .rectangles import count_votes, filter_rectangles
+from .rotation import back_project, back_project_corners, rotate
+from .memory import plan_decode
+from .near_duplicates import rescale_faces
+from .search_strategies import ExhaustiveSearch
+from .skin_analysis import skin_analysis
+
 
 class FaceAnalysisAlgorithm:
     """
@@ -14,256 +27,723 @@ class FaceAnalysisAlgorithm:
 
     Attributes:
     image_name (str): The file path of the image to be analyzed.
+    image (numpy.ndarray): The decoded BGR image, read from image_name once
+    when not provided.
+    classifier_pool (ClassifierPool): Pool lending the cascade classifiers.
+    strategy (SearchStrategy): Strategy ordering and bounding the rotation
+    search.
+    executor (ParallelRotationExecutor): Optional worker pool evaluating
+    the angles concurrently.
+    detector (DetectorBackend): Backend detecting the faces at each angle.
+    max_dimension (int): Largest side of the image the cascades run on.
+    refine (bool): Whether downscaled detections are refined at full
+    resolution.
+    verify (bool): Whether the merged detections are confirmed by a
+    fine-grained pass around them.
+    rectangle_filter (str): Mode merging the detected rectangles.
+    skin_patch_radius (int): Radius of the patch averaged around each skin
+    sample.
+    rotation_prior (RotationPrior): Statistics ordering the angles.
+    orientation_angle (int): Angle tried first.
+    timer (StageTimer): Timer of the stages: decode, resize, preprocess,
+    rotate, cascades, dedupe, skin, annotate and encode.
+    detection_scale (float): Ratio between the detection image and the
+    original image.
+    decode_reduction (int): Factor dividing each side of the encoded image
+    at decoding, 1 unless decoded reduced by from_bytes().
+    faces (numpy.ndarray): Rectangles of the faces found by
+    face_detection(), in the image rotated by rotation.
+    rotation (int): Angle of the detections, None when no face was found.
 
     Methods:
+    from_bytes(data): Creates an analysis of an encoded image buffer.
+    from_array(image): Creates an analysis of an already decoded image.
+    configuration(options): Describes the settings determining the results.
+    load_image(): Returns the decoded image.
+    detection_image(): Returns the image the cascades run on.
     face_detection(): Detects faces in an image and analyzes facial skin.
-    __skin_brightness_detection(coordinates, sizes, gray_image_name):
-        Detects facial skin brightness.
-    __skin_type_detection(result): Determines the type of facial skin.
-    __remove_double_detection(rectangles): Removes rectangles containing
-    others.
+    annotated_image(): Returns a copy of the image with the faces framed.
+    skin_plane(rotation): Returns the plane the skin is sampled on.
+    original_boxes(): Returns the rectangles of the faces in the image.
+    encode_annotated_image(extension): Encodes the annotated image.
+    preprocessed_image(rotation, full_resolution): Returns the equalized
+    grayscale image rotated by an angle.
+    detect_rotation(rotation, budget): Runs the cascade passes at an angle.
+    __search(angles, budget): Tries the angles one after another.
+    redetect_faces(rotation, faces, budget, padding, parameters): Searches
+    known faces again around their rectangles.
+    __refine_faces(rotation, faces, budget): Re-detects faces at full
+    resolution.
+    __verify_faces(rotation, faces, votes, budget): Keeps the faces
+    confirmed by a fine-grained pass.
+    __detect_faces(image, budget): Runs the detector on a preprocessed
+    image.
     """
 
-    PATH = 'face/classifiers/'
-    CASCADE_PATHS = [
-        os.path.abspath(PATH + 'haarcascade_frontalface_default.xml'),
-        os.path.abspath(PATH + 'haarcascade_profileface.xml'),
-    ]
-    ALGORITHM_PARAMETERS = [
-        {'scale_factor': 1.45, 'min_neighbors': 5},
-        {'scale_factor': 1.48, 'min_neighbors': 6},
-        {'scale_factor': 1.55, 'min_neighbors': 6},
-        {'scale_factor': 1.60, 'min_neighbors': 6},
-        {'scale_factor': 1.70, 'min_neighbors': 6}
-    ]
-    MIN_SIZE_RATIO = 13
+    PATH = CLASSIFIERS_DIRECTORY
+    # Haar cascades of the default detector, also used by the refinement.
+    CASCADE_PATHS = HAAR_CASCADE_PATHS
+    ALGORITHM_PARAMETERS = HAAR_PARAMETERS
+    MIN_SIZE_RATIO = MIN_SIZE_RATIO
+    REFINEMENT_PARAMETERS = {'scale_factor': 1.1, 'min_neighbors': 3}
+    REFINEMENT_PADDING = 0.25
+    VERIFICATION_PARAMETERS = {'scale_factor': 1.05, 'min_neighbors': 4}
+    VERIFICATION_PADDING = 0.2
+    PREPROCESSING_CACHE_SIZE = 4
+    # Bytes allocated per decoded pixel: the BGR image, the equalized
+    # grayscale image, the cached rotated buffers and the one being rotated,
+    # each canvas holding up to twice the pixels of a square image.
+    BYTES_PER_PIXEL = 3 + 1 + 2 * (PREPROCESSING_CACHE_SIZE + 1)
     ROTATIONS = [0, 2, -2, 4, -4, 6, -6, 8, -8, 10, -10, 20, -20, 30, -30, 40,
-                 -40, 50, -50, 60, -60, 70, -70, 80, -80, 180, -180, 175, -175,
-                 170, -170, 160, -160, 150, -150, 140, -140, 130, -130, 120,
-                 -120, 110, -110, 100, -100, 0]
+                 -40, 50, -50, 60, -60, 70, -70, 80, -80, 90, -90, 180, -180,
+                 175, -175, 170, -170, 160, -160, 150, -150, 140, -140, 130,
+                 -130, 120, -120, 110, -110, 100, -100]
 
-    def __init__(self, image_name):
+    def __init__(self, image_name=None, pool=None, image=None,
+                 strategy=None, executor=None, max_dimension=None,
+                 refine=False, verify=False, rectangle_filter='compat',
+                 skin_patch_radius=0, rotation_prior=None,
+                 orientation_angle=None, timer=None, detector=None):
         """
         Initializes a Face object.
 
         Keyword arguments::
-        image_name (str): The file path of the image to be analyzed.
+        image_name (str): The file path of the image to be analyzed, not
+        read when an image is also given.
+        pool (ClassifierPool): Pool lending the cascade classifiers, the
+        process-wide pool by default.
+        image (numpy.ndarray): The decoded BGR image to be analyzed.
+        strategy (SearchStrategy): Rotation search strategy, every rotation
+        is tried without budget by default.
+        executor (ParallelRotationExecutor): Worker pool evaluating the
+        angles concurrently, the angles are tried one after another in the
+        calling thread when None.
+        max_dimension (int): The cascades run on a copy of the image
+        downscaled so that its largest side does not exceed max_dimension,
+        the detected rectangles being mapped back to the original
+        resolution. The full resolution is used when None.
+        refine (bool): Re-detect each face at full resolution in a region
+        around its downscaled detection to tighten the rectangle.
+        verify (bool): Search each merged face again with
+        VERIFICATION_PARAMETERS, a finer scale factor, in a region padded by
+        VERIFICATION_PADDING around it, the faces not found again being
+        dropped and the others tightened. Combined with the 'nms' rectangle
+        filter, adjacent faces are kept and the false detections removed.
+        rectangle_filter (str): Mode merging the rectangles detected by the
+        cascade passes, 'compat' or 'nms'.
+        skin_patch_radius (int): Radius of the patch averaged around each
+        skin sample, single pixels are sampled when 0.
+        rotation_prior (RotationPrior): Statistics of the winning angles,
+        ordering the angles of the strategy by likelihood and recording the
+        winning angle of the analysis.
+        orientation_angle (int): Angle tried before any other, such as the
+        angle given by the EXIF orientation.
+        timer (StageTimer): Timer measuring the stages of the analysis,
+        nothing is measured when None.
+        detector (DetectorBackend): Backend detecting the faces at each
+        angle, the Haar cascades by default.
         """
+        if image_name is None and image is None:
+            raise ValueError('An image name or a decoded image is required')
         self.image_name = image_name
+        self.image = image
+        self.classifier_pool = pool or classifier_pool
+        self.strategy = strategy or ExhaustiveSearch()
+        self.executor = executor
+        self.max_dimension = max_dimension
+        self.refine = refine
+        self.verify = verify
+        self.rectangle_filter = rectangle_filter
+        self.skin_patch_radius = skin_patch_radius
+        self.rotation_prior = rotation_prior
+        self.orientation_angle = orientation_angle
+        self.timer = timer or NULL_TIMER
+        self.detector = detector or HaarDetector(
+            self.CASCADE_PATHS, self.ALGORITHM_PARAMETERS,
+            min_size_ratio=self.MIN_SIZE_RATIO
+        )
+        self.detection_scale = 1.0
+        self.decode_reduction = 1
+        self.faces = None
+        self.votes = None
+        self.rotation = None
+        self._detection_image = None
+        self._equalized = {}
+        self._preprocessed = OrderedDict()
+        self._preprocessing_lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data, image_name=None, memory_budget=None,
+                   plan=None, **kwargs):
+        """
+        Method that creates a facial analysis of an encoded image.
+
+        The image is decoded once with cv2.imdecode, the decoded buffer is
+        then shared by the rotations, the detections and the skin sampling.
+        With a memory budget, an image whose analysis would allocate more is
+        decoded at a half, a quarter or an eighth of its size, as chosen
+        from its header before decoding.
+        cv2.imdecode applies the EXIF orientation, so an image with an EXIF
+        orientation is expected upright: unless given, its orientation angle
+        is 0 whatever the rotation prior.
+
+        Keyword arguments:
+        data (bytes): The encoded image, any buffer-like object is accepted.
+        image_name (str): Optional file path of the image.
+        memory_budget (int): Bytes the analysis may allocate, about
+        BYTES_PER_PIXEL per decoded pixel, unbounded when None.
+        plan (DecodePlan): Decoding already planned by plan_decode() from
+        the memory budget.
+        kwargs: Other options of the constructor.
+
+        Returns:
+        FaceAnalysisAlgorithm -- The facial analysis of the image.
+        """
+        if plan is None:
+            plan = plan_decode(data, memory_budget, cls.BYTES_PER_PIXEL)
+        with (kwargs.get('timer') or NULL_TIMER).stage('decode'):
+            image = cv2.imdecode(
+                np.frombuffer(data, dtype=np.uint8), plan.flags()
+            )
+        if image is None:
+            raise ValueError('Unable to decode the image')
+        if 'orientation_angle' not in kwargs and plan.orientation is not None:
+            kwargs['orientation_angle'] = 0
+        analysis = cls(image_name, image=image, **kwargs)
+        analysis.decode_reduction = plan.reduction
+        return analysis
+
+    @classmethod
+    def from_array(cls, image, image_name=None, **kwargs):
+        """
+        Method that creates a facial analysis of a decoded image.
+
+        Keyword arguments:
+        image (numpy.ndarray): The decoded BGR image, or a grayscale image.
+        image_name (str): Optional file path of the image.
+        kwargs: Other options of the constructor.
+
+        Returns:
+        FaceAnalysisAlgorithm -- The facial analysis of the image.
+        """
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return cls(image_name, image=image, **kwargs)
+
+    @classmethod
+    def configuration(cls, options):
+        """
+        Method that describes the settings determining the results.
+
+        Keyword arguments:
+        options (dict): Keyword arguments of the constructor, the options
+        not given having their default value.
+
+        Returns:
+        dict -- JSON-serializable configuration: the cascades, the parameter
+        sets, the rotations, the size ratio and the options.
+        """
+        options = {
+            name: (value.configuration()
+                   if name in ('strategy', 'detector') and value is not None
+                   else value)
+            for name, value in options.items()
+            if name not in ('image_name', 'image', 'pool', 'executor',
+                            'rotation_prior', 'orientation_angle', 'timer')
+        }
+        return {
+            'cascades': [os.path.basename(cascade_path)
+                         for cascade_path in cls.CASCADE_PATHS],
+            'algorithm_parameters': cls.ALGORITHM_PARAMETERS,
+            'rotations': cls.ROTATIONS,
+            'min_size_ratio': cls.MIN_SIZE_RATIO,
+            'refinement_parameters': cls.REFINEMENT_PARAMETERS,
+            'refinement_padding': cls.REFINEMENT_PADDING,
+            'verification_parameters': cls.VERIFICATION_PARAMETERS,
+            'verification_padding': cls.VERIFICATION_PADDING,
+            'options': options,
+        }
 
     def face_detection(self):
         """
         Method that detects faces in an image.
 
-        This method utilizes a Haar Cascade classifier to detect faces in the
-        provided image.
-        Detected faces are processed to remove rectangles containing others,
-        and the remaining rectangles are analyzed for facial skin brightness.
+        This method utilizes the detector backend, the Haar cascades by
+        default, to detect faces in the provided image.
+        Detected faces are processed by filter_rectangles to remove
+        rectangles containing others or overlapping larger ones, and the
+        remaining rectangles are analyzed for facial skin brightness.
+        The rectangles are found in the image rotated onto a canvas holding
+        all of its pixels, where the skin is sampled; each face reports its
+        box (x, y, w, h) mapped back to the image, bounding the rotated
+        rectangle. The number of detection passes that voted for each face
+        is reported with its skin as votes, a confidence score. With verify,
+        only the faces found again by the fine-grained pass are kept.
+        The angles of the strategy are tried in order of likelihood when a
+        rotation prior is set, after the orientation angle if any, and the
+        winning angle is reported as rotation_angle.
+        Nothing is written to disk, the annotated image being only produced
+        on demand by annotated_image().
 
         Returns:
         dict -- Dictionary containing the number of faces detected and
         information about the facial skin.
-        Example: {'Nnmber_of_faces_detected': 2, 'facial_skin': [...]}
-        """
-        gray = None
-        faces_detected_results = None
-        img = None
-        for rotation in self.ROTATIONS:
-            faces_detected_results = []
-            img = cv2.imread(self.image_name)
-            img = self.__rotate_image(img, rotation)
-            for cascade_path in self.CASCADE_PATHS:
-                face_cascade = cv2.CascadeClassifier(cascade_path)
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                black_and_white = cv2.equalizeHist(gray)
-                height, width, channels = img.shape
-                min_size_height = int(height / self.MIN_SIZE_RATIO)
-                min_size_width = int(width / self.MIN_SIZE_RATIO)
-                size = min([min_size_height, min_size_width])
-                for algorithm_parameters in self.ALGORITHM_PARAMETERS:
-                    faces_detected = face_cascade.detectMultiScale(
-                        black_and_white,
-                        scaleFactor=algorithm_parameters['scale_factor'],
-                        minNeighbors=algorithm_parameters['min_neighbors'],
-                        minSize=(size, size),
-                        flags=cv2.CASCADE_SCALE_IMAGE
-                    )
-                    if len(faces_detected) > 0:
-                        faces_detected_results.append(np.array(faces_detected))
-            if len(faces_detected_results) > 0:
-                break
-        first_iteration = True
-        results = []
-        for faces_detected_result in faces_detected_results:
-            if first_iteration:
-                results = faces_detected_result
-                first_iteration = False
-            else:
-                if len(faces_detected_result) > 0:
-                    results = np.concatenate((results, faces_detected_result))
-        sorted_faces = sorted(results, key=lambda x: x[2] * x[3], reverse=True)
-        faces = self.__remove_double_detection(sorted_faces)
-        faces = self.__remove_containing_rectangles(faces)
-        skin_brightness = []
-        _, img_extension = os.path.splitext(self.image_name)
-        gray_image_name = "images/" + str(uuid.uuid4()) + img_extension.lower()
-        if gray is not None:
-            cv2.imwrite(gray_image_name, gray)
-        for x, y, w, h in faces:
-            coordinates = {'x': x, 'y': y}
-            sizes = {'w': w, 'h': h}
-            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            skin_brightness_result = self.__skin_brightness_detection(
-                coordinates, sizes, self.image_name
+        Example: {'Nnmber_of_faces_detected': 2,
+        'facial_skin': [{'skin_brightness': 0.75, 'skin_info': 'light skin',
+        'votes': 6, 'box': [120, 80, 64, 64]}, ...],
+        'rotation_angle': 0,
+        'search': {'strategy': 'exhaustive', 'detector': 'haar',
+        'cascade_calls': 10, ...}}
+        """
+        self.detection_image()
+        budget = self.strategy.budget()
+        angles = self.strategy.angles(self.ROTATIONS)
+        if self.rotation_prior is not None:
+            angles = self.rotation_prior.order(angles)
+        if self.orientation_angle is not None:
+            angles = [self.orientation_angle] + [
+                angle for angle in angles if angle != self.orientation_angle
+            ]
+        search = self.__search if self.executor is None else partial(
+            self.executor.search, self
+        )
+        rotation, faces_detected_results, rotations_tried = search(
+            angles, budget
+        )
+        if self.detection_scale != 1:
+            faces_detected_results = [
+                np.round(faces_detected / self.detection_scale)
+                for faces_detected in faces_detected_results
+            ]
+        rectangles = np.concatenate(
+            faces_detected_results or [np.empty((0, 4), dtype=int)]
+        )
+        with self.timer.stage('dedupe'):
+            faces = filter_rectangles(rectangles, mode=self.rectangle_filter)
+            votes = count_votes(faces, faces_detected_results)
+        if self.refine and self.detection_scale != 1 and len(faces) > 0:
+            faces = self.__refine_faces(rotation, faces, budget)
+        if self.verify and len(faces) > 0:
+            faces, votes = self.__verify_faces(rotation, faces, votes, budget)
+            if len(faces) == 0:
+                rotation = None
+        with self.timer.stage('skin'):
+            skin_brightness = skin_analysis(
+                faces, self.skin_plane(rotation), self.skin_patch_radius
             )
-            skin_brightness.append(skin_brightness_result)
-        cv2.imwrite(self.image_name, img)
+        self.faces = faces
+        self.votes = votes
+        self.rotation = rotation
+        for skin, face_votes, box in zip(
+                skin_brightness, votes, self.original_boxes()):
+            skin['votes'] = int(face_votes)
+            skin['box'] = box
+        if rotation is not None and self.rotation_prior is not None:
+            self.rotation_prior.record(rotation)
         return {"number_of_faces_detected": len(faces),
-                "facial_skin": skin_brightness}
+                "facial_skin": skin_brightness,
+                "rotation_angle": rotation,
+                "search": dict(self.strategy.report(budget, rotations_tried),
+                               detector=self.detector.name)}
+
+    def detection_record(self):
+        """
+        Method that records the faces found by face_detection(), so that
+        they can be reused on a near-duplicate of the image.
+
+        The shape and the rectangles are those of the encoded image, scaled
+        back up when it was decoded reduced.
+
+        Returns:
+        dict -- JSON-serializable shape of the image, rotation angle, face
+        rectangles and votes.
+        Example: {'shape': [480, 640], 'rotation': 0,
+        'faces': [[120, 80, 64, 64]], 'votes': [6]}
+        """
+        if self.faces is None:
+            raise ValueError('face_detection() must be called first')
+        reduction = self.decode_reduction
+        faces = np.asarray(self.faces, dtype=int).reshape(-1, 4) * reduction
+        return {
+            'shape': [side * reduction
+                      for side in self.load_image().shape[:2]],
+            'rotation': self.rotation,
+            'faces': faces.tolist(),
+            'votes': np.asarray(self.votes, dtype=int).tolist(),
+        }
 
-    @staticmethod
-    def __skin_brightness_detection(coordinates, sizes, gray_image_name):
+    def reuse_detection(self, record, near_duplicate_of=None):
         """
-        Method that detects facial skin brightness.
+        Method that analyzes the faces found on a near-duplicate of the
+        image instead of detecting them.
 
-        This method analyzes the brightness of facial skin in the specified
-        region of the grayscale image.
+        The rectangles of the record are rescaled to the image and only the
+        facial skin is sampled, no rotation being searched. The votes of the
+        faces are copied from the record when it has them.
 
         Keyword arguments:
-        coordinates (dict): Dictionary containing the 'x' and 'y' coordinates
-        of the region.
-        sizes (dict): Dictionary containing the width ('w') and height ('h') of
-        the region.
-        gray_image_name (str): The file path of the grayscale image to be
-        analyzed.
+        record (dict): The detection_record() of the near-duplicate.
+        near_duplicate_of (int): Identifier of the near-duplicate, reported
+        in the search summary.
 
         Returns:
-        dict: A dictionary containing the brightness of the facial skin in the
-        specified region rounded to two decimal places and skin information.
-        Example: {'skin_brightness': 0.75, 'skin_info': 'light skin'}
-       """
-        img = cv2.imread(gray_image_name)
-        distance = int(sizes['h'] / 2)
-        ordinate = [
-            coordinates['y'] + distance,
-            coordinates['y'] + distance + int((distance/6)),
-            coordinates['y'] + distance + int((distance/3))
-        ]
-        brightness_data = []
-        for y in ordinate:
-            sampling_distance = int((sizes['w'] / 1.5) / 3)
-            x = coordinates['x'] + int(sizes['w'] / 3)
-            coords_pixels = [
-                {'x': x, 'y': y},
-                {'x': x + sampling_distance, 'y': y},
-                {'x': x + int(sampling_distance * 2), 'y': y}
-            ]
-            for coords_pixel in coords_pixels:
-                brightness_data.append(
-                    int(img[coords_pixel['y'], coords_pixel['x']][0])
-                )
-        result = round(((100 / 255) * median(brightness_data)) / 100, 2)
-        skin_info = FaceAnalysisAlgorithm.__skin_type_detection(result)
-        return {"skin_brightness": result, "skin_info": skin_info}
+        dict -- The results in the format of face_detection(), with no
+        cascade call nor rotation tried.
+        """
+        original = self.load_image()
+        faces = rescale_faces(
+            record['faces'], record['shape'], original.shape[:2]
+        )
+        with self.timer.stage('skin'):
+            skin_brightness = skin_analysis(
+                faces, self.skin_plane(record['rotation']),
+                self.skin_patch_radius
+            )
+        self.faces = faces
+        self.votes = record.get('votes')
+        self.rotation = record['rotation']
+        for skin, box in zip(skin_brightness, self.original_boxes()):
+            skin['box'] = box
+        if self.votes is not None:
+            for skin, face_votes in zip(skin_brightness, self.votes):
+                skin['votes'] = face_votes
+        return {"number_of_faces_detected": len(faces),
+                "facial_skin": skin_brightness,
+                "rotation_angle": self.rotation,
+                "search": dict(self.strategy.report(self.strategy.budget(), 0),
+                               detector=self.detector.name,
+                               near_duplicate_of=near_duplicate_of)}
+
+    def annotated_image(self):
+        """
+        Method that draws the faces found by face_detection() on a copy of
+        the image, each rectangle being drawn at the angle of the
+        detections.
+
+        Returns:
+        numpy.ndarray -- The annotated BGR image.
+        """
+        if self.faces is None:
+            raise ValueError('face_detection() must be called first')
+        with self.timer.stage('annotate'):
+            img = self.load_image().copy()
+            corners = back_project_corners(
+                self.faces, img.shape, self.rotation
+            )
+            cv2.polylines(img, np.round(corners).astype(np.int32), True,
+                          (0, 255, 0), 2)
+        return img
+
+    def skin_plane(self, rotation):
+        """
+        Method that returns the plane the facial skin is sampled on.
+
+        The brightness has always been measured on the first channel of the
+        decoded image, here rotated like the image the faces were found in.
+
+        Keyword arguments:
+        rotation (int): Angle of the detections in degrees, None when no
+        face was found.
+
+        Returns:
+        numpy.ndarray -- The rotated first channel of the image.
+        """
+        plane = self.load_image()[:, :, 0]
+        return plane if rotation is None else rotate(plane, rotation)
+
+    def original_boxes(self):
+        """
+        Method that maps the faces found by face_detection() back to the
+        image, each box bounding the rotated rectangle of a face.
+
+        The boxes are scaled back up to the encoded image when it was
+        decoded reduced.
+
+        Returns:
+        list -- The boxes [x, y, w, h] of the faces in the encoded image.
+        """
+        if self.faces is None:
+            raise ValueError('face_detection() must be called first')
+        return (back_project(
+            self.faces, self.load_image().shape, self.rotation
+        ) * self.decode_reduction).tolist()
 
-    @staticmethod
-    def __skin_type_detection(result):
+    def encode_annotated_image(self, extension='.jpg'):
         """
-        Method that detects the type of facial skin based on brightness result.
+        Method that encodes the annotated image.
 
         Keyword arguments:
-        result (float): The brightness result of the facial skin in the
-        specified region.
+        extension (str): Extension of the image format, such as '.png'.
 
         Returns:
-        str: String indicating the detected type of facial skin.
-        Possible values: 'dark skin', 'matte skin', 'light skin', 'no skin'.
+        bytes -- The encoded annotated image.
         """
-        if 0 < result < 0.42:
-            return "dark skin"
-        elif 0.42 <= result <= 0.60:
-            return "matte skin"
-        elif 0.60 < result:
-            return "light skin"
-        return "no skin"
+        image = self.annotated_image()
+        with self.timer.stage('encode'):
+            encoded, buffer = cv2.imencode(extension, image)
+        if not encoded:
+            raise ValueError('Unable to encode the image as ' + extension)
+        return buffer.tobytes()
 
-    @staticmethod
-    def __remove_double_detection(rectangles):
+    def detect_rotation(self, rotation, budget):
         """
-        Method that removes double detection, the method that removes
-        rectangles containing others from the list.
+        Method that runs the cascade passes on the image rotated by an angle.
 
-        This method takes a list of rectangles represented as tuples
-        (x, y, w, h).
-        It removes rectangles that contain other rectangles.
+        The detectors of color images are given the rotated detection image,
+        the others the equalized grayscale image.
 
         Keyword arguments:
-        rectangles -- List of rectangles to be processed.
-                      Represented as tuples (x, y, w, h).
+        rotation (int): Angle in degrees.
+        budget (SearchBudget): Budget charged for each cascade call.
 
         Returns:
-        List -- List of rectangles that do not contain any other rectangles.
-        """
-        retained_rectangles = []
-        for i in range(len(rectangles)):
-            x_i, y_i, w_i, h_i = rectangles[i]
-            is_contained = False
-            for j in range(len(rectangles)):
-                if i != j:
-                    x_j, y_j, w_j, h_j = rectangles[j]
-                    if (x_i <= x_j and y_i <= y_j and x_i + w_i >= x_j + w_j
-                            and y_i + h_i >= y_j + h_j):
-                        is_contained = True
-                        break
-            if not is_contained:
-                retained_rectangles.append((x_i, y_i, w_i, h_i))
-        return retained_rectangles
-
-    @staticmethod
-    def __remove_containing_rectangles(rectangles):
-        """
-        Method that removes rectangles containing others from the list.
-
-        This method takes a list of rectangles represented as tuples (x, y, w,
-        h).
-        It removes rectangles that contain other rectangles, even if there is
-        partial overlap.
+        list -- The detection arrays of the passes that found faces.
+        """
+        if self.detector.color:
+            with self.timer.stage('rotate'):
+                image = rotate(self.detection_image(), rotation)
+        else:
+            image = self.preprocessed_image(rotation)
+        return self.__detect_faces(image, budget)
+
+    def preprocessed_image(self, rotation, full_resolution=False):
+        """
+        Method that returns the equalized grayscale image rotated by an
+        angle.
+
+        The color conversion and the histogram equalization are done once
+        per resolution and kept, only the single-channel result is rotated,
+        onto a canvas holding all of its pixels.
+        The PREPROCESSING_CACHE_SIZE most recently used rotated buffers are
+        kept for the following passes, refinements or re-analyses. Each
+        rotation is done into a new buffer, a buffer evicted from the cache
+        being possibly still used by a caller.
 
         Keyword arguments:
-        rectangles -- List of rectangles to be processed. Represented as
-        tuples (x, y, w, h).
+        rotation (int): Angle in degrees.
+        full_resolution (bool): Rotate the original image instead of the
+        detection image.
 
         Returns:
-        List -- List of rectangles that do not contain any other rectangles.
-        """
-        retained_rectangles = []
-        for i in range(len(rectangles)):
-            x_i, y_i, w_i, h_i = rectangles[i]
-            is_contained_by_other = any(
-                (x_i < x_r + w_r and x_i + w_i > x_r and y_i < y_r + h_r
-                 and y_i + h_i > y_r)
-                for (x_r, y_r, w_r, h_r) in retained_rectangles
+        numpy.ndarray -- The rotated single-channel image.
+        """
+        key = (rotation, full_resolution)
+        with self._preprocessing_lock:
+            black_and_white = self._preprocessed.get(key)
+            if black_and_white is not None:
+                self._preprocessed.move_to_end(key)
+                return black_and_white
+            equalized = self._equalized.get(full_resolution)
+        if equalized is None:
+            image = self.load_image() if full_resolution else (
+                self.detection_image()
             )
-            if not is_contained_by_other:
-                retained_rectangles.append((x_i, y_i, w_i, h_i))
-        return retained_rectangles
+            with self.timer.stage('preprocess'):
+                equalized = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                cv2.equalizeHist(equalized, dst=equalized)
+            with self._preprocessing_lock:
+                self._equalized[full_resolution] = equalized
+        if rotation == 0:
+            return equalized
+        with self.timer.stage('rotate'):
+            black_and_white = rotate(equalized, rotation)
+        with self._preprocessing_lock:
+            self._preprocessed[key] = black_and_white
+            while len(self._preprocessed) > self.PREPROCESSING_CACHE_SIZE:
+                self._preprocessed.popitem(last=False)
+        return black_and_white
 
-    @staticmethod
-    def __rotate_image(img, angle):
+    def __search(self, angles, budget):
         """
-        Method that rotates an image.
+        Method that tries the angles one after another until one of them
+        produces detections.
 
-        This method rotates an image by the specified angle.
+        Keyword arguments:
+        angles (list): Angles to try, in order.
+        budget (SearchBudget): Budget of the search.
+
+        Returns:
+        tuple -- The winning angle or None, the detection arrays of the
+        winning angle and the number of angles tried.
+        """
+        faces_detected_results = []
+        rotations_tried = 0
+        for rotation in angles:
+            if budget.exhausted():
+                break
+            rotations_tried += 1
+            faces_detected_results = self.detect_rotation(rotation, budget)
+            if len(faces_detected_results) > 0:
+                return rotation, faces_detected_results, rotations_tried
+        return None, faces_detected_results, rotations_tried
+
+    def __refine_faces(self, rotation, faces, budget):
+        """
+        Method that re-detects faces at full resolution.
+
+        Each face is searched again with redetect_faces() in a region padded
+        by REFINEMENT_PADDING around the rectangle found on the downscaled
+        image, the rectangle is kept when nothing is found.
+
+        Keyword arguments:
+        rotation (int): Angle of the detections in degrees.
+        faces (list): Rectangles (x, y, w, h) mapped to full resolution.
+        budget (SearchBudget): Budget charged for each cascade call.
+
+        Returns:
+        list -- The refined rectangles.
+        """
+        refined_faces = self.redetect_faces(
+            rotation, faces, budget, self.REFINEMENT_PADDING
+        )
+        return [tuple(face) if refined is None else refined
+                for face, refined in zip(faces, refined_faces)]
+
+    def __verify_faces(self, rotation, faces, votes, budget):
+        """
+        Method that keeps the faces confirmed by a fine-grained pass.
+
+        Each face is searched again with redetect_faces() and
+        VERIFICATION_PARAMETERS in a region padded by VERIFICATION_PADDING
+        around it, so that the expensive pass only runs on a small part of
+        the image. The faces found again are tightened to the new
+        rectangles, the others are dropped.
 
         Keyword arguments:
-        img -- Image to be rotated.
-        angle -- Angle in degrees.
+        rotation (int): Angle of the detections in degrees.
+        faces (list): Rectangles (x, y, w, h) at full resolution.
+        votes (numpy.ndarray): Votes of the faces.
+        budget (SearchBudget): Budget charged for each cascade call.
+
+        Returns:
+        tuple -- The confirmed rectangles and their votes.
+        """
+        verified_faces = self.redetect_faces(
+            rotation, faces, budget, self.VERIFICATION_PADDING,
+            self.VERIFICATION_PARAMETERS
+        )
+        confirmed = [index for index, face in enumerate(verified_faces)
+                     if face is not None]
+        return ([verified_faces[index] for index in confirmed],
+                np.asarray(votes)[confirmed])
+
+    def redetect_faces(self, rotation, faces, budget, padding,
+                       parameters=None):
+        """
+        Method that searches known faces again at full resolution, only in
+        the regions around their rectangles.
+
+        Each cascade runs with the parameters in the region padded by
+        padding times the size of the rectangle, looking for faces of a
+        similar size, until one of them finds a face. The detection closest
+        to the rectangle is retained.
+
+        Keyword arguments:
+        rotation (int): Angle of the rectangles in degrees.
+        faces (list): Rectangles (x, y, w, h) in the image rotated by
+        rotation.
+        budget (SearchBudget): Budget charged for each cascade call.
+        padding (float): Margin of the regions, relative to the rectangles.
+        parameters (dict): scale_factor and min_neighbors of the cascades,
+        REFINEMENT_PARAMETERS by default.
+
+        Returns:
+        list -- The rectangle found for each face, None when it was not
+        found.
+        """
+        black_and_white = self.preprocessed_image(
+            rotation, full_resolution=True
+        )
+        height, width = black_and_white.shape
+        parameters = parameters or self.REFINEMENT_PARAMETERS
+        found_faces = []
+        for x, y, w, h in faces:
+            padding_x = int(w * padding)
+            padding_y = int(h * padding)
+            left, top = max(0, x - padding_x), max(0, y - padding_y)
+            right = min(width, x + w + padding_x)
+            bottom = min(height, y + h + padding_y)
+            region = black_and_white[top:bottom, left:right]
+            min_size = int(min(w, h) * 0.6)
+            max_size = int(max(w, h) * 1.5)
+            face = None
+            for cascade_path in self.CASCADE_PATHS:
+                if region.size == 0:
+                    break
+                budget.charge()
+                with self.classifier_pool.acquire(
+                        cascade_path) as face_cascade:
+                    with self.timer.stage('cascades'):
+                        candidates = face_cascade.detectMultiScale(
+                            region,
+                            scaleFactor=parameters['scale_factor'],
+                            minNeighbors=parameters['min_neighbors'],
+                            minSize=(min_size, min_size),
+                            maxSize=(max_size, max_size),
+                            flags=cv2.CASCADE_SCALE_IMAGE
+                        )
+                if len(candidates) > 0:
+                    centers = candidates[:, :2] + candidates[:, 2:] / 2
+                    distances = np.hypot(
+                        *(centers - (x - left + w / 2, y - top + h / 2)).T
+                    )
+                    cx, cy, cw, ch = candidates[np.argmin(distances)]
+                    face = (left + cx, top + cy, cw, ch)
+                    break
+            found_faces.append(face)
+        return found_faces
+
+    def __detect_faces(self, image, budget):
+        """
+        Method that runs the detector on a preprocessed image.
+
+        The Haar cascades run every cascade with every parameter set, unless
+        the budget is exhausted or the strategy is confident enough in the
+        detections.
+
+        Keyword arguments:
+        image (numpy.ndarray): The rotated equalized grayscale image, or the
+        rotated BGR detection image for the detectors of color images.
+        budget (SearchBudget): Budget charged for each detector call.
+
+        Returns:
+        list -- The detection arrays of the passes that found faces.
+        """
+        return self.detector.detect(
+            image, budget, self.strategy, self.classifier_pool, self.timer
+        )
+
+    def detection_image(self):
+        """
+        Method that returns the image the cascades run on, the decoded image
+        downscaled to max_dimension when it is larger.
+
+        Returns:
+        numpy.ndarray -- The BGR detection image.
+        """
+        if self._detection_image is None:
+            image = self.load_image()
+            largest_side = max(image.shape[:2])
+            if self.max_dimension and largest_side > self.max_dimension:
+                self.detection_scale = self.max_dimension / largest_side
+                with self.timer.stage('resize'):
+                    image = cv2.resize(
+                        image, None, fx=self.detection_scale,
+                        fy=self.detection_scale, interpolation=cv2.INTER_AREA
+                    )
+            self._detection_image = image
+        return self._detection_image
+
+    def load_image(self):
+        """
+        Method that returns the decoded image, reading image_name once.
 
         Returns:
-        Image -- Rotated image.
+        numpy.ndarray -- The decoded BGR image.
         """
-        height, width = img.shape[:2]
-        center = (width // 2, height // 2)
-        rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-        rotated_image = cv2.warpAffine(img, rotation_matrix, (width, height))
-        return rotated_image
+        if self.image is None:
+            with self.timer.stage('decode'):
+                self.image = cv2.imread(self.image_name)
+            if self.image is None:
+                raise ValueError('Unable to read the image ' + self.image_name)
+        return self.image
@@ -0,0 +1,172 @@
+import logging
+import threading
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Image
+
+
+logger = logging.getLogger(__name__)
+
+
+def claim_next_job():
+    """
+    Function that claims the oldest pending image.
+
+    The image is marked as running with a conditional update, so a job is
+    only claimed once even when several threads or processes drain the
+    queue.
+
+    Returns:
+    Image -- The claimed image, or None when no image is pending.
+    """
+    while True:
+        image_id = Image.objects.filter(status=Image.PENDING).order_by(
+            'id'
+        ).values_list('id', flat=True).first()
+        if image_id is None:
+            return None
+        claimed = Image.objects.filter(
+            id=image_id, status=Image.PENDING
+        ).update(status=Image.RUNNING, started_at=timezone.now())
+        if claimed:
+            return Image.objects.get(id=image_id)
+
+
+def process_next_job():
+    """
+    Function that analyzes the oldest pending image.
+
+    Returns:
+    bool -- True when an image was processed.
+    """
+    image = claim_next_job()
+    if image is None:
+        return False
+    image.run_analysis()
+    return True
+
+
+def requeue_stale_jobs(stale_seconds):
+    """
+    Function that puts back in the queue the images left running by a
+    worker that stopped.
+
+    Keyword arguments:
+    stale_seconds (float): Age after which a running job is considered
+    abandoned.
+
+    Returns:
+    int -- Number of images put back in the queue.
+    """
+    return Image.objects.filter(
+        status=Image.RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=stale_seconds)
+    ).update(status=Image.PENDING, started_at=None)
+
+
+class AnalysisWorkerPool:
+    """
+    Class running worker threads that drain the queue of pending images.
+
+    The queue is persisted in the database, so jobs survive a restart and
+    several processes can run a pool on the same queue. Workers sleep until
+    they are notified of a new job or until the poll interval elapses.
+
+    Attributes:
+    workers (int): Number of worker threads.
+    poll_interval (float): Seconds between two checks of an idle worker.
+
+    Methods:
+    start(): Starts the worker threads.
+    submit(): Starts the workers if needed and wakes one of them.
+    stop(timeout): Stops the worker threads.
+    """
+
+    def __init__(self, workers, poll_interval=2.0):
+        """
+        Initializes an AnalysisWorkerPool object.
+
+        Keyword arguments:
+        workers (int): Number of worker threads.
+        poll_interval (float): Seconds between two checks of an idle worker.
+        """
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def start(self):
+        """
+        Method that starts the worker threads, once.
+        """
+        with self._condition:
+            if self._threads:
+                return
+            self._stopping = False
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self.__work, name='face-job-{}'.format(index),
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self):
+        """
+        Method that signals a new pending job.
+        """
+        self.start()
+        with self._condition:
+            self._condition.notify()
+
+    def stop(self, timeout=None):
+        """
+        Method that stops the worker threads once their current job is done.
+
+        Keyword arguments:
+        timeout (float): Seconds to wait for each thread.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def __work(self):
+        while not self._stopping:
+            processed = False
+            try:
+                processed = process_next_job()
+            except Exception:
+                logger.exception('Face analysis worker error')
+            finally:
+                close_old_connections()
+            if not processed:
+                with self._condition:
+                    if not self._stopping:
+                        self._condition.wait(self.poll_interval)
+
+
+@lru_cache(maxsize=None)
+def worker_pool():
+    """
+    Function returning the worker pool of the process, configured by the
+    FACE_JOB_WORKERS and FACE_JOB_POLL_SECONDS settings.
+
+    Returns:
+    AnalysisWorkerPool -- The pool, None when FACE_JOB_WORKERS is 0 and the
+    queue is drained by the face_worker management command.
+    """
+    workers = getattr(settings, 'FACE_JOB_WORKERS', 2)
+    if not workers:
+        return None
+    return AnalysisWorkerPool(
+        workers, getattr(settings, 'FACE_JOB_POLL_SECONDS', 2.0)
+    )
@@ -0,0 +1,163 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from face.batch import IMAGE_EXTENSIONS
+from face.bulk import WRITERS, Checkpoint, analyze_images, find_images
+from face.face_analysis_algorithm import FaceAnalysisAlgorithm
+from face.models import Image, analysis_options, store_faces
+from face.result_cache import ResultCache
+
+
+class Command(BaseCommand):
+    help = ('Analyzes the images of directories or of a file list on a pool '
+            'of worker processes, writing the results as JSON lines or '
+            'Parquet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Directories, walked recursively, or image files.'
+        )
+        parser.add_argument(
+            '--file-list', metavar='FILE',
+            help='File listing one image path per line, - for the standard '
+                 'input.'
+        )
+        parser.add_argument(
+            '--output', required=True,
+            help='JSON lines file, or directory of the Parquet dataset, '
+                 'appended to when it exists.'
+        )
+        parser.add_argument(
+            '--format', choices=sorted(WRITERS), default='jsonl',
+            help='Format of the output, parquet requiring pyarrow.'
+        )
+        parser.add_argument(
+            '--checkpoint', metavar='FILE',
+            help='File listing the images already analyzed, skipped when '
+                 'the command is run again, OUTPUT.checkpoint by default.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of worker processes, one per CPU by default.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=256,
+            help='Number of images written and checkpointed at once.'
+        )
+        parser.add_argument(
+            '--strategy', default=None,
+            help='Rotation search strategy, FACE_SEARCH_STRATEGY by default.'
+        )
+        parser.add_argument(
+            '--detector', default=None,
+            help='Face detector backend, FACE_DETECTOR by default.'
+        )
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Also insert an Image row per analyzed image, one bulk '
+                 'insert per chunk.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['paths'] and options['file_list'] is None:
+            raise CommandError('Give directories, images or --file-list')
+        try:
+            analysis = analysis_options(options['strategy'],
+                                        options['detector'])
+            writer = WRITERS[options['format']](options['output'])
+        except ValueError as error:
+            raise CommandError(error)
+        # Each worker process learns its own rotation prior.
+        del analysis['rotation_prior']
+        half_life = (
+            getattr(settings, 'FACE_ROTATION_PRIOR_HALF_LIFE', 1000)
+            if getattr(settings, 'FACE_ROTATION_PRIOR', True) else None
+        )
+        digest = ResultCache.configuration_digest(
+            FaceAnalysisAlgorithm.configuration(analysis)
+        )
+        checkpoint = Checkpoint(
+            options['checkpoint'] or options['output'] + '.checkpoint'
+        )
+        if len(checkpoint):
+            self.stdout.write('Resuming after {} image(s)'.format(
+                len(checkpoint)
+            ))
+        paths = (
+            path for path in find_images(
+                options['paths'], IMAGE_EXTENSIONS, options['file_list']
+            ) if path not in checkpoint
+        )
+        analyzed = failed = 0
+        start = time.perf_counter()
+        try:
+            for records in analyze_images(
+                paths, analysis, options['workers'], options['chunk_size'],
+                half_life
+            ):
+                if options['save']:
+                    self.save_rows(records, options, digest)
+                for record in records:
+                    record.pop('detections', None)
+                writer.write(records)
+                checkpoint.record(record['path'] for record in records)
+                analyzed += len(records)
+                failed += sum(record['status'] == Image.FAILED
+                              for record in records)
+                self.stderr.write(self.progress(analyzed, failed, start))
+        finally:
+            writer.close()
+            checkpoint.close()
+        self.stdout.write('Done: ' + self.progress(analyzed, failed, start))
+
+    def save_rows(self, records, options, digest):
+        """
+        Method that inserts the Image rows of the records of a chunk, then
+        their faces, with one bulk insert each, before the records are
+        checkpointed.
+
+        The images under MEDIA_ROOT are referenced by the rows, the others
+        being only identified by the output.
+        """
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        finished_at = timezone.now()
+        rows = []
+        for record in records:
+            path = os.path.abspath(record['path'])
+            detections = record.get('detections')
+            results = record.get('analysis_results')
+            rows.append(Image(
+                image=(os.path.relpath(path, media_root)
+                       if path.startswith(media_root + os.sep) else ''),
+                status=record['status'],
+                strategy=options['strategy'] or '',
+                detector=options['detector'] or '',
+                analysis_results=results,
+                error=record.get('error', ''),
+                started_at=finished_at - timedelta(
+                    seconds=record['seconds']
+                ),
+                finished_at=finished_at,
+                perceptual_hash=record.get('perceptual_hash'),
+                detections=(None if detections is None
+                            else dict(detections, configuration=digest)),
+                number_of_faces=(None if results is None
+                                 else results['number_of_faces_detected']),
+            ))
+        rows = Image.objects.bulk_create(rows)
+        store_faces(rows)
+        for row in rows:
+            row.index_detections()
+
+    @staticmethod
+    def progress(analyzed, failed, start):
+        elapsed = time.perf_counter() - start
+        return '{} image(s) analyzed, {} failed, {:.1f} images/s'.format(
+            analyzed, failed, analyzed / elapsed if elapsed else 0.0
+        )
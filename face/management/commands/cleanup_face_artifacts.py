@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from face.artifacts import (delete_expired_annotations,
+                            delete_legacy_gray_images)
+
+
+class Command(BaseCommand):
+    help = ('Deletes the annotated images older than the retention period '
+            'and the grayscale copies left by former versions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float,
+            default=getattr(settings, 'FACE_ARTIFACT_RETENTION_DAYS', None),
+            help='Retention period of the annotated images, the '
+                 'FACE_ARTIFACT_RETENTION_DAYS setting by default.'
+        )
+        parser.add_argument(
+            '--legacy', action='store_true',
+            help='Also delete the grayscale copies written next to the '
+                 'uploads by former versions.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the files without deleting them.'
+        )
+
+    def handle(self, *args, **options):
+        deleted = []
+        if options['days'] is not None:
+            deleted += delete_expired_annotations(
+                options['days'], options['dry_run']
+            )
+        if options['legacy']:
+            deleted += delete_legacy_gray_images(options['dry_run'])
+        for name in deleted:
+            self.stdout.write(name)
+        self.stdout.write('{} file(s) {}'.format(
+            len(deleted), 'to delete' if options['dry_run'] else 'deleted'
+        ))
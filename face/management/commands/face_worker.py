@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from face.jobs import AnalysisWorkerPool, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Analyzes the images submitted with ?async=1 until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker threads.'
+        )
+        parser.add_argument(
+            '--poll', type=float, default=2.0,
+            help='Seconds between two checks of an idle worker.'
+        )
+        parser.add_argument(
+            '--requeue-stale', type=float, default=None, metavar='SECONDS',
+            help='Put back in the queue the jobs running for longer than '
+                 'SECONDS, left by a worker that stopped.'
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_stale'] is not None:
+            requeued = requeue_stale_jobs(options['requeue_stale'])
+            self.stdout.write('{} stale job(s) requeued'.format(requeued))
+        pool = AnalysisWorkerPool(options['workers'], options['poll'])
+        pool.start()
+        self.stdout.write('Face worker started with {} thread(s)'.format(
+            options['workers']
+        ))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the current jobs')
+            pool.stop()
@@ -0,0 +1,201 @@
+import io
+import sys
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+from PIL import Image, UnidentifiedImageError
+
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class DecodePlan(namedtuple('DecodePlan',
+                            'width height orientation reduction')):
+    """
+    Class describing how an encoded image is decoded.
+
+    Attributes:
+    width (int): Width given by the header, None when it is unreadable or
+    the image is too large for Pillow.
+    height (int): Height given by the header, None when it is unreadable or
+    the image is too large for Pillow.
+    orientation (int): EXIF orientation, None when the image has none.
+    reduction (int): Factor dividing each side at decoding, 1, 2, 4 or 8.
+
+    Methods:
+    pixels(): Returns the number of decoded pixels.
+    flags(): Returns the cv2.imdecode flags.
+    """
+
+    __slots__ = ()
+
+    def pixels(self):
+        """
+        Method that returns the number of decoded pixels.
+
+        Returns:
+        int -- The number of pixels, 0 when the header is unreadable and
+        None when the size of a reduced image is unknown.
+        """
+        if self.width is None:
+            return None if self.reduction > 1 else 0
+        return (-(-self.width // self.reduction)
+                * -(-self.height // self.reduction))
+
+    def flags(self):
+        """
+        Method that returns the cv2.imdecode flags of the plan.
+
+        Returns:
+        int -- IMREAD_COLOR or one of the IMREAD_REDUCED_COLOR flags.
+        """
+        return REDUCED_COLOR_FLAGS[self.reduction]
+
+
+def plan_decode(data, memory_budget=None, bytes_per_pixel=1):
+    """
+    Function that chooses how to decode an image from its header, without
+    decoding the pixels.
+
+    The smallest reduction keeping the decoded pixels within the memory
+    budget is chosen, the JPEG decoder then skipping the discarded DCT
+    coefficients. Beyond a reduction of 8, the image is decoded at one
+    eighth of its size whatever the budget. So are the images refused by
+    Pillow as decompression bombs, larger than Image.MAX_IMAGE_PIXELS twice
+    over, whose size is then unknown: the process-wide limit is left
+    untouched.
+
+    Keyword arguments:
+    data (bytes): The encoded image, any buffer-like object is accepted.
+    memory_budget (int): Bytes the analysis may allocate, unbounded when
+    None.
+    bytes_per_pixel (float): Bytes allocated by the analysis per decoded
+    pixel.
+
+    Returns:
+    DecodePlan -- The dimensions, the orientation and the reduction.
+    """
+    try:
+        width, height, orientation = read_header(data)
+    except Image.DecompressionBombError:
+        return DecodePlan(None, None, None, 8)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return DecodePlan(None, None, None, 1)
+    if orientation not in range(1, 9):
+        orientation = None
+    reduction = 1
+    if memory_budget is not None:
+        while (reduction < 8 and width * height * bytes_per_pixel
+               > memory_budget * reduction ** 2):
+            reduction *= 2
+    return DecodePlan(width, height, orientation, reduction)
+
+
+def read_header(data):
+    """
+    Function that reads the size and the EXIF orientation of an encoded
+    image from its header.
+
+    Keyword arguments:
+    data (bytes): The encoded image, any buffer-like object is accepted.
+
+    Returns:
+    tuple -- The width, the height and the EXIF orientation, None when the
+    image has none.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return (image.size[0], image.size[1],
+                image.getexif().get(EXIF_ORIENTATION_TAG))
+
+
+class LargeAnalysisLimiter:
+    """
+    Class capping the number of concurrent analyses of large images in the
+    process, the analyses of smaller images never waiting.
+
+    Attributes:
+    large_pixels (int): Number of decoded pixels from which an image is
+    large, None to never limit.
+    max_concurrent (int): Number of large images analyzed at once.
+
+    Methods:
+    slot(pixels): Context manager holding a slot for a large image.
+    """
+
+    def __init__(self, large_pixels, max_concurrent=1):
+        """
+        Initializes a LargeAnalysisLimiter object.
+
+        Keyword arguments:
+        large_pixels (int): Number of decoded pixels from which an image is
+        large.
+        max_concurrent (int): Number of large images analyzed at once.
+        """
+        self.large_pixels = large_pixels
+        self.max_concurrent = max_concurrent
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    @contextmanager
+    def slot(self, pixels):
+        """
+        Method that waits for a slot when an image is large.
+
+        Keyword arguments:
+        pixels (int): Number of decoded pixels of the image, None when it
+        is unknown, the image being then treated as large.
+
+        Returns:
+        contextmanager -- Context holding the slot.
+        """
+        if self.large_pixels is None or (
+                pixels is not None and pixels < self.large_pixels):
+            yield
+            return
+        with self._semaphore:
+            yield
+
+
+def peak_rss_bytes():
+    """
+    Function that returns the peak resident set size of the process.
+
+    Returns:
+    int -- The VmHWM of the process on Linux, the maximum resident set size
+    reported by getrusage elsewhere.
+    """
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """
+    Function that resets the peak resident set size of the process to its
+    current resident set size.
+
+    Returns:
+    bool -- True when the peak was reset, which requires Linux.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+    return True
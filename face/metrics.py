@@ -0,0 +1,266 @@
+import threading
+from bisect import bisect_left
+
+
+class Counter:
+    """
+    Class counting events, optionally by label values.
+
+    Attributes:
+    name (str): Name of the metric.
+    documentation (str): Help text of the metric.
+    labels (tuple): Names of the labels.
+
+    Methods:
+    inc(amount, **labels): Increments the counter.
+    samples(): Returns the exposed samples.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Initializes a Counter object.
+
+        Keyword arguments:
+        name (str): Name of the metric.
+        documentation (str): Help text of the metric.
+        labels (tuple): Names of the labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Method that increments the counter.
+
+        Keyword arguments:
+        amount (float): Increment.
+        labels: Value of each label.
+        """
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        Method that returns the exposed samples.
+
+        Returns:
+        list -- (name, labels, value) tuples.
+        """
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(Counter):
+    """
+    Class counting observations in cumulative buckets, optionally by label
+    values.
+
+    Attributes:
+    buckets (tuple): Upper bounds of the buckets, in increasing order.
+
+    Methods:
+    observe(value, **labels): Records an observation.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        """
+        Initializes a Histogram object.
+
+        Keyword arguments:
+        name (str): Name of the metric.
+        documentation (str): Help text of the metric.
+        buckets (tuple): Upper bounds of the buckets.
+        labels (tuple): Names of the labels.
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Method that records an observation.
+
+        Keyword arguments:
+        value (float): The observed value.
+        labels: Value of each label.
+        """
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0)
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+        samples = []
+        for key, (counts, total) in values:
+            labels = dict(zip(self.labels, key))
+            cumulated = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulated += count
+                samples.append((self.name + '_bucket',
+                                dict(labels, le=_format(bound)), cumulated))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulated))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Class holding the metrics of the process and rendering them in the
+    Prometheus text exposition format.
+
+    Methods:
+    counter(name, documentation, labels): Registers a counter.
+    histogram(name, documentation, buckets, labels): Registers a histogram.
+    render(): Returns the metrics as text.
+    clear(): Resets every metric.
+    """
+
+    def __init__(self):
+        """
+        Initializes a MetricsRegistry object.
+        """
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Method that registers a counter.
+
+        Returns:
+        Counter -- The new counter.
+        """
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets, labels=()):
+        """
+        Method that registers a histogram.
+
+        Returns:
+        Histogram -- The new histogram.
+        """
+        metric = Histogram(name, documentation, buckets, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Method that renders the metrics in the Prometheus text format.
+
+        Returns:
+        str -- The exposition text.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(
+                metric.name, metric.documentation
+            ))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += '{' + ','.join(
+                        '{}="{}"'.format(label, _escape(label_value))
+                        for label, label_value in labels.items()
+                    ) + '}'
+                lines.append('{} {}'.format(name, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """
+        Method that resets every metric.
+        """
+        for metric in self._metrics:
+            with metric._lock:
+                metric._values.clear()
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+registry = MetricsRegistry()
+requests_total = registry.counter(
+    'face_http_requests_total', 'Requests answered by the face views.',
+    ('view', 'status')
+)
+analyses_total = registry.counter(
+    'face_analyses_total', 'Analyses by origin of the results.', ('cache',)
+)
+analysis_seconds = registry.histogram(
+    'face_analysis_seconds', 'Duration of the analyses.', SECONDS_BUCKETS,
+    ('cache',)
+)
+stage_seconds = registry.histogram(
+    'face_analysis_stage_seconds', 'Duration of each stage of the analyses.',
+    SECONDS_BUCKETS, ('stage',)
+)
+rotations_tried = registry.histogram(
+    'face_analysis_rotations_tried', 'Angles evaluated per analysis.',
+    COUNT_BUCKETS
+)
+cascade_calls = registry.histogram(
+    'face_analysis_cascade_calls', 'detectMultiScale calls per analysis.',
+    COUNT_BUCKETS + (1000,)
+)
+faces_found = registry.histogram(
+    'face_analysis_faces', 'Faces found per analysis.', (0, 1, 2, 3, 5, 10)
+)
+image_megapixels = registry.histogram(
+    'face_analysis_image_megapixels', 'Size of the analyzed images.',
+    (0.1, 0.3, 1, 2, 5, 10, 20, 50)
+)
+
+
+def observe_analysis(seconds, analysis_results, cached, timer=None,
+                     shape=None):
+    """
+    Function that records the metrics of an analysis.
+
+    Keyword arguments:
+    seconds (float): Duration of the analysis.
+    analysis_results (dict): Results of face_detection().
+    cached (bool): Whether the results came from the result cache.
+    timer (StageTimer): Timer of the stages, for an analysis that ran.
+    shape (tuple): Shape of the decoded image, for an analysis that ran.
+    """
+    cache = 'hit' if cached else 'miss'
+    analyses_total.inc(cache=cache)
+    analysis_seconds.observe(seconds, cache=cache)
+    if cached:
+        return
+    for stage, stage_duration in (timer.timings() if timer else {}).items():
+        stage_seconds.observe(stage_duration, stage=stage)
+    search = analysis_results['search']
+    rotations_tried.observe(search['rotations_tried'])
+    cascade_calls.observe(search['cascade_calls'])
+    faces_found.observe(analysis_results['number_of_faces_detected'])
+    if shape is not None:
+        image_megapixels.observe(shape[0] * shape[1] / 1e6)
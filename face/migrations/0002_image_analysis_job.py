@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-16 20:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_existing_images_done(apps, schema_editor):
+    # Images stored before the job queue were analyzed synchronously.
+    Image = apps.get_model('face', 'Image')
+    Image.objects.update(status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='analysis_results',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='strategy',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.RunPython(
+            mark_existing_images_done, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face', '0002_image_analysis_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='annotate',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='annotated_image',
+            field=models.ImageField(blank=True, upload_to='annotated/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face', '0003_image_annotated_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='detector',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face', '0005_image_optional_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='detections',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
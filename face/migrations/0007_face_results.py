@@ -0,0 +1,72 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:30
+
+import struct
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SKIN_INFO = ['no skin', 'dark skin', 'matte skin', 'light skin']
+
+
+def store_recorded_faces(apps, schema_editor):
+    """
+    Function that fills the Face table and the number of faces from the
+    results already recorded, in chunks of bulk inserts.
+    """
+    Image = apps.get_model('face', 'Image')
+    Face = apps.get_model('face', 'Face')
+    images = Image.objects.filter(
+        status='done', analysis_results__isnull=False
+    ).only('analysis_results')
+    faces = []
+    for image in images.iterator(chunk_size=1000):
+        results = image.analysis_results
+        Image.objects.filter(pk=image.pk).update(
+            number_of_faces=results['number_of_faces_detected']
+        )
+        for skin in results['facial_skin']:
+            box = skin.get('box')
+            faces.append(Face(
+                image_id=image.pk,
+                box=None if box is None else struct.unpack(
+                    '>q', struct.pack('>4H', *box)
+                )[0],
+                brightness=round(skin['skin_brightness'] * 100),
+                skin_info=SKIN_INFO.index(skin['skin_info']),
+                votes=skin.get('votes'),
+            ))
+        if len(faces) >= 1000:
+            Face.objects.bulk_create(faces)
+            faces = []
+    Face.objects.bulk_create(faces)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face', '0006_image_near_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='number_of_faces',
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Face',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('box', models.BigIntegerField(blank=True, null=True)),
+                ('brightness', models.PositiveSmallIntegerField()),
+                ('skin_info', models.PositiveSmallIntegerField(choices=[(0, 'no skin'), (1, 'dark skin'), (2, 'matte skin'), (3, 'light skin')])),
+                ('votes', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='faces', to='face.image')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['skin_info', 'image'], name='face_skin_info_image_idx')],
+            },
+        ),
+        migrations.RunPython(store_recorded_faces, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,615 @@
-from django.db import models
+import logging
+import os
+import struct
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, models
+from django.utils import timezone
+from . import metrics
+from .detectors import get_detector
 from .face_analysis_algorithm import FaceAnalysisAlgorithm
+from .memory import LargeAnalysisLimiter, plan_decode
+from .near_duplicates import (
+    HammingIndex, hamming_distance, perceptual_hash, same_aspect
+)
+from .parallel import get_executor
+from .profiling import NULL_TIMER, StageTimer
+from .result_cache import ResultCache
+from .rotation_prior import RotationPrior
+from .search_strategies import get_strategy
+
+
+logger = logging.getLogger(__name__)
 
 
 class Image(models.Model):
-    image = models.ImageField(upload_to='images/')
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    JOB_FIELDS = [
+        'status', 'analysis_results', 'annotated_image', 'error',
+        'started_at', 'finished_at', 'perceptual_hash', 'detections',
+        'number_of_faces'
+    ]
+    # Near-duplicates whose rows are read to find the closest one.
+    MAX_NEAR_DUPLICATES = 16
+
+    image = models.ImageField(upload_to='images/', blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    strategy = models.CharField(max_length=20, blank=True)
+    detector = models.CharField(max_length=20, blank=True)
+    annotate = models.BooleanField(default=False)
+    annotated_image = models.ImageField(upload_to='annotated/', blank=True)
+    analysis_results = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    perceptual_hash = models.BigIntegerField(null=True, blank=True)
+    detections = models.JSONField(null=True, blank=True)
+    number_of_faces = models.PositiveIntegerField(
+        null=True, blank=True, db_index=True
+    )
 
     def __str__(self):
-        return {"image_name": self.image.name}
+        return self.image.name or 'Image {}'.format(self.pk)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.index_detections()
+        if getattr(self, '_faces_pending', False):
+            store_faces([self])
+
+    def index_detections(self):
+        """
+        Method that adds the saved image to the near-duplicate index of the
+        process once its detections are recorded.
+        """
+        if self.perceptual_hash is None or self.detections is None:
+            return
+        index = near_duplicate_index()
+        if index is not None:
+            index.add(self.perceptual_hash, self.pk)
+
+    def run_analysis(self, image_data=None, timer=None):
+        """
+        Method that analyzes the image and saves the outcome on the row.
+
+        Keyword arguments:
+        image_data (bytes): Optional encoded content of the image.
+        timer (StageTimer): Optional timer of the stages of the analysis.
+
+        Returns:
+        dict -- The facial analysis results, None when the analysis failed.
+        """
+        self.record_analysis(image_data, timer)
+        self.save(update_fields=self.JOB_FIELDS)
+        return self.analysis_results
+
+    def record_analysis(self, image_data=None, timer=None, deadline=None):
+        """
+        Method that analyzes the image and records the outcome without
+        saving it, so that many images can be saved with one bulk update of
+        the JOB_FIELDS.
+
+        The status, the results or the error and the start and end times are
+        recorded. The faces of the results are stored in the Face table once
+        the row is saved, or by store_faces() after a bulk update.
+
+        Keyword arguments:
+        image_data (bytes): Optional encoded content of the image.
+        timer (StageTimer): Optional timer of the stages of the analysis.
+        deadline (float): Optional time.perf_counter() value stopping the
+        rotation search.
+
+        Returns:
+        dict -- The facial analysis results, None when the analysis failed.
+        """
+        self.status = self.RUNNING
+        self.started_at = timezone.now()
+        try:
+            self.analysis_results = self.analyze(
+                image_data, strategy=self.strategy or None,
+                detector=self.detector or None, annotate=self.annotate,
+                timer=timer, deadline=deadline
+            )
+            self.status = self.DONE
+        except Exception as exception:
+            self.status = self.FAILED
+            self.error = str(exception) or exception.__class__.__name__
+        self.finished_at = timezone.now()
+        self.number_of_faces = (
+            self.analysis_results['number_of_faces_detected']
+            if self.status == self.DONE else None
+        )
+        self._faces_pending = True
+        return self.analysis_results
+
+    def analyze(self, image_data=None, strategy=None, detector=None,
+                annotate=False, timer=None, deadline=None):
+        """
+        Method that runs the facial analysis of the image.
+
+        The image is decoded once from memory: image_data when the caller
+        already holds the uploaded bytes, otherwise a single read through the
+        storage. The results of an image already analyzed with the same
+        configuration are returned from the result cache without decoding.
+        No file is written unless annotate is set: the image with the faces
+        framed is then stored in annotated_image, which requires running the
+        detection even when the results are cached.
+        The image is decoded within FACE_ANALYSIS_MEMORY_BYTES, reduced when
+        needed, and the analyses of images larger than
+        FACE_LARGE_IMAGE_PIXELS once decoded wait for one of the
+        FACE_MAX_LARGE_ANALYSES slots of the process.
+        With FACE_NEAR_DUPLICATE_DISTANCE, the perceptual hash of the decoded
+        image is looked up among the analyzed images: the faces of a
+        near-duplicate analyzed with the same configuration are rescaled
+        and only their skin is sampled, the rotation search being skipped.
+        With FACE_METRICS, the duration, the stages, the search and the
+        image size of the analysis are recorded in the process metrics.
+
+        Keyword arguments:
+        image_data (bytes): Optional encoded content of the image.
+        strategy (str): Name of the rotation search strategy, the
+        FACE_SEARCH_STRATEGY setting by default.
+        detector (str): Name of the detector backend, the FACE_DETECTOR
+        setting by default.
+        annotate (bool): Store the annotated image, without saving the row.
+        timer (StageTimer): Optional timer of the stages of the analysis.
+        deadline (float): Optional time.perf_counter() value after which the
+        rotation search stops, the results being then reported with an
+        exhausted budget.
+
+        Returns:
+        dict -- The facial analysis results.
+        """
+        start = time.perf_counter()
+        metrics_enabled = getattr(settings, 'FACE_METRICS', True)
+        if timer is None and metrics_enabled:
+            timer = StageTimer()
+        stages = timer or NULL_TIMER
+        if image_data is None:
+            with stages.stage('read'):
+                with self.image.open('rb') as image_file:
+                    image_data = image_file.read()
+        options = analysis_options(strategy, detector)
+        cache = result_cache()
+        configuration = FaceAnalysisAlgorithm.configuration(options)
+        with stages.stage('cache'):
+            key = cache.key(image_data, configuration)
+            analysis_results = None if annotate else cache.get(key)
+        cached = analysis_results is not None
+        shape = None
+        if not cached:
+            with stages.stage('decode'):
+                plan = plan_decode(
+                    image_data, options['memory_budget'],
+                    FaceAnalysisAlgorithm.BYTES_PER_PIXEL
+                )
+            if deadline is not None:
+                # The key stays the one of the configured strategy, the
+                # results of a search stopped by the deadline not being
+                # cached.
+                options['strategy'] = options['strategy'].with_time_limit(
+                    deadline - time.perf_counter()
+                )
+            with large_analysis_limiter().slot(plan.pixels()):
+                face_analysis_algorithm = FaceAnalysisAlgorithm.from_bytes(
+                    image_data, plan=plan, executor=rotation_executor(),
+                    timer=timer, **options
+                )
+                digest = ResultCache.configuration_digest(configuration)
+                near_duplicates = getattr(
+                    settings, 'FACE_NEAR_DUPLICATE_DISTANCE', None
+                ) is not None
+                near_duplicate = None
+                if near_duplicates:
+                    with stages.stage('near_duplicate'):
+                        self.perceptual_hash = perceptual_hash(
+                            face_analysis_algorithm.load_image()
+                        )
+                        near_duplicate = self.find_near_duplicate(
+                            digest, face_analysis_algorithm.load_image().shape
+                        )
+                if near_duplicate is None:
+                    analysis_results = face_analysis_algorithm.face_detection()
+                else:
+                    analysis_results = face_analysis_algorithm.reuse_detection(
+                        near_duplicate.detections, near_duplicate.pk
+                    )
+                # A search stopped by its budget may find more with more
+                # time.
+                if not analysis_results['search']['budget_exhausted']:
+                    cache.set(key, analysis_results)
+                    if near_duplicates:
+                        self.detections = dict(
+                            face_analysis_algorithm.detection_record(),
+                            configuration=digest
+                        )
+                if annotate:
+                    name, extension = os.path.splitext(
+                        os.path.basename(self.image.name)
+                    )
+                    self.annotated_image.save(
+                        name + extension.lower(), ContentFile(
+                            face_analysis_algorithm.encode_annotated_image(
+                                extension.lower() or '.jpg'
+                            )
+                        ), save=False
+                    )
+                shape = face_analysis_algorithm.load_image().shape
+        if metrics_enabled:
+            metrics.observe_analysis(
+                time.perf_counter() - start, analysis_results, cached, timer,
+                shape
+            )
+        return analysis_results
+
+    def find_near_duplicate(self, configuration_digest, shape):
+        """
+        Method that finds the closest near-duplicate of the image analyzed
+        with the same configuration.
+
+        The candidates of the near-duplicate index are checked against
+        their rows, the index of the process possibly holding rows since
+        deleted. A database error is logged and no near-duplicate is
+        returned, the image being then analyzed in full.
+
+        Keyword arguments:
+        configuration_digest (str): Digest of the configuration of the
+        analysis.
+        shape (tuple): Shape of the decoded image.
+
+        Returns:
+        Image -- The near-duplicate holding its detections, None when there
+        is none.
+        """
+        try:
+            index = near_duplicate_index()
+            matches = index.search(self.perceptual_hash)
+            if not matches:
+                return None
+            candidates = list(Image.objects.filter(
+                pk__in=[key for _, key in matches[:self.MAX_NEAR_DUPLICATES]],
+                status=self.DONE, perceptual_hash__isnull=False,
+                detections__isnull=False
+            ).exclude(pk=self.pk).only('perceptual_hash', 'detections'))
+        except DatabaseError:
+            logger.warning('Unable to look up the near-duplicates',
+                           exc_info=True)
+            return None
+        near_duplicate = None
+        best_distance = index.max_distance + 1
+        for candidate in candidates:
+            record = candidate.detections
+            distance = hamming_distance(
+                self.perceptual_hash, candidate.perceptual_hash
+            )
+            if (distance < best_distance
+                    and record.get('configuration') == configuration_digest
+                    and same_aspect(shape, record['shape'])):
+                near_duplicate = candidate
+                best_distance = distance
+        return near_duplicate
+
+
+class Face(models.Model):
+    """
+    Model storing each face found by an analysis in a compact row, so that
+    the results can be queried without reading their JSON.
+
+    The box (x, y, width, height) in the image is packed in one 64-bit
+    integer, 16 bits per value, the brightness is stored in hundredths and
+    the skin type as a small integer.
+    """
+
+    class SkinInfo(models.IntegerChoices):
+        NO_SKIN = 0, 'no skin'
+        DARK_SKIN = 1, 'dark skin'
+        MATTE_SKIN = 2, 'matte skin'
+        LIGHT_SKIN = 3, 'light skin'
+
+    # Rows of a bulk insert sent in one query.
+    BATCH_SIZE = 1000
+
+    image = models.ForeignKey(
+        Image, on_delete=models.CASCADE, related_name='faces'
+    )
+    # Null for the results recorded before the boxes were reported.
+    box = models.BigIntegerField(null=True, blank=True)
+    brightness = models.PositiveSmallIntegerField()
+    skin_info = models.PositiveSmallIntegerField(choices=SkinInfo.choices)
+    votes = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['skin_info', 'image'],
+                         name='face_skin_info_image_idx'),
+        ]
+
+    def __str__(self):
+        return '{} of {}'.format(self.get_skin_info_display(), self.image_id)
+
+    @classmethod
+    def from_skin(cls, image, skin):
+        """
+        Method that creates the row of a face from its facial skin result.
+
+        Keyword arguments:
+        image (Image): The analyzed image.
+        skin (dict): Entry of the facial_skin of the results.
+
+        Returns:
+        Face -- The unsaved row.
+        """
+        box = skin.get('box')
+        return cls(
+            image=image,
+            box=None if box is None else pack_box(box),
+            brightness=round(skin['skin_brightness'] * 100),
+            skin_info=cls.skin_info_value(skin['skin_info']),
+            votes=skin.get('votes'),
+        )
+
+    @classmethod
+    def skin_info_value(cls, label):
+        """
+        Method that returns the stored value of a skin type.
+
+        Keyword arguments:
+        label (str): Skin type of the results, such as 'dark skin'.
+
+        Returns:
+        int -- The value of the skin_info field.
+        """
+        return cls.SkinInfo.values[cls.SkinInfo.labels.index(label)]
+
+    @property
+    def skin_brightness(self):
+        return self.brightness / 100
+
+    def unpacked_box(self):
+        """
+        Method that returns the box of the face.
+
+        Returns:
+        list -- [x, y, width, height], None when it was not recorded.
+        """
+        return None if self.box is None else unpack_box(self.box)
+
+
+def pack_box(box):
+    """
+    Function that packs a box in a signed 64-bit integer, 16 bits per value.
+
+    Keyword arguments:
+    box (list): x, y, width and height, clipped between 0 and 65535.
+
+    Returns:
+    int -- The packed box.
+    """
+    return struct.unpack('>q', struct.pack(
+        '>4H', *(min(max(int(value), 0), 0xFFFF) for value in box)
+    ))[0]
+
+
+def unpack_box(value):
+    """
+    Function that unpacks a box packed by pack_box().
+
+    Keyword arguments:
+    value (int): The packed box.
+
+    Returns:
+    list -- x, y, width and height.
+    """
+    return list(struct.unpack('>4H', struct.pack('>q', value)))
+
+
+def store_faces(images):
+    """
+    Function that replaces the faces of analyzed images in the Face table,
+    with a single bulk insert for all of them.
+
+    Keyword arguments:
+    images (list): Saved Image objects, the faces of the failed analyses
+    being only removed.
+    """
+    images = [image for image in images if image.pk is not None]
+    if not images:
+        return
+    Face.objects.filter(image__in=images).delete()
+    Face.objects.bulk_create([
+        Face.from_skin(image, skin)
+        for image in images if image.status == Image.DONE
+        for skin in image.analysis_results['facial_skin']
+    ], batch_size=Face.BATCH_SIZE)
+    for image in images:
+        image._faces_pending = False
+
+
+def analysis_options(strategy=None, detector=None):
+    """
+    Function that returns the FaceAnalysisAlgorithm options determining the
+    results, from the settings.
+
+    Keyword arguments:
+    strategy (str): Name of the rotation search strategy, the
+    FACE_SEARCH_STRATEGY setting by default.
+    detector (str): Name of the detector backend, the FACE_DETECTOR
+    setting by default.
+
+    Returns:
+    dict -- Keyword arguments of FaceAnalysisAlgorithm.
+    """
+    return {
+        'strategy': search_strategy(strategy),
+        'detector': detector_backend(detector),
+        'max_dimension': getattr(
+            settings, 'FACE_DETECTION_MAX_DIMENSION', None
+        ),
+        'refine': getattr(settings, 'FACE_DETECTION_REFINE', False),
+        'verify': getattr(settings, 'FACE_DETECTION_VERIFY', False),
+        'rectangle_filter': getattr(
+            settings, 'FACE_RECTANGLE_FILTER', 'compat'
+        ),
+        'skin_patch_radius': getattr(settings, 'FACE_SKIN_PATCH_RADIUS', 0),
+        'rotation_prior': rotation_prior(),
+        'memory_budget': getattr(settings, 'FACE_ANALYSIS_MEMORY_BYTES', None),
+    }
+
+
+def search_strategy(name=None):
+    """
+    Function that creates the rotation search strategy from the settings.
+
+    Keyword arguments:
+    name (str): Name of the strategy, the FACE_SEARCH_STRATEGY setting by
+    default.
+
+    Returns:
+    SearchStrategy -- Strategy bounded by the FACE_SEARCH_MAX_CALLS and
+    FACE_SEARCH_MAX_SECONDS settings.
+    """
+    return get_strategy(
+        name or getattr(settings, 'FACE_SEARCH_STRATEGY', 'exhaustive'),
+        max_calls=getattr(settings, 'FACE_SEARCH_MAX_CALLS', None),
+        max_seconds=getattr(settings, 'FACE_SEARCH_MAX_SECONDS', None),
+        min_votes=getattr(settings, 'FACE_SEARCH_MIN_VOTES', None),
+    )
+
+
+def detector_backend(name=None):
+    """
+    Function that creates the detector backend from the settings.
+
+    The LBP cascade is read from the FACE_LBP_CASCADE_PATH setting and the
+    network of the DNN backend from the FACE_DNN_MODEL_PATH and
+    FACE_DNN_CONFIG_PATH settings, its detections being kept above
+    FACE_DNN_CONFIDENCE. A ValueError is raised when the backend is
+    unknown or its files are missing.
+
+    Keyword arguments:
+    name (str): Name of the backend, the FACE_DETECTOR setting by default.
+
+    Returns:
+    DetectorBackend -- The configured backend.
+    """
+    name = name or getattr(settings, 'FACE_DETECTOR', 'haar')
+    options = {}
+    if name == 'lbp':
+        cascade_path = getattr(settings, 'FACE_LBP_CASCADE_PATH', None)
+        if cascade_path:
+            options['cascade_path'] = cascade_path
+    elif name == 'dnn':
+        model_path = getattr(settings, 'FACE_DNN_MODEL_PATH', None)
+        if not model_path:
+            raise ValueError('The dnn detector requires FACE_DNN_MODEL_PATH')
+        options = {
+            'model_path': model_path,
+            'config_path': getattr(settings, 'FACE_DNN_CONFIG_PATH', None),
+            'input_size': getattr(settings, 'FACE_DNN_INPUT_SIZE', 300),
+            'confidence': getattr(settings, 'FACE_DNN_CONFIDENCE', 0.5),
+        }
+    return get_detector(name, **options)
+
+
+def rotation_executor():
+    """
+    Function returning the worker pool of the rotation search configured by
+    the FACE_PARALLEL_MODE and FACE_PARALLEL_WORKERS settings.
+
+    Returns:
+    ParallelRotationExecutor -- The shared executor, or None when the
+    angles are tried sequentially.
+    """
+    mode = getattr(settings, 'FACE_PARALLEL_MODE', None)
+    if mode is None:
+        return None
+    return get_executor(mode, getattr(settings, 'FACE_PARALLEL_WORKERS', None))
+
+
+@lru_cache(maxsize=None)
+def result_cache():
+    """
+    Function returning the result cache configured by the
+    FACE_RESULT_CACHE_SIZE, FACE_RESULT_CACHE_TTL and FACE_RESULT_CACHE_ALIAS
+    settings.
+
+    Returns:
+    ResultCache -- The cache shared by the analyses of the process.
+    """
+    return ResultCache(
+        max_size=getattr(settings, 'FACE_RESULT_CACHE_SIZE', 1024),
+        ttl=getattr(settings, 'FACE_RESULT_CACHE_TTL', 3600),
+        cache_alias=getattr(settings, 'FACE_RESULT_CACHE_ALIAS', None),
+    )
+
+
+@lru_cache(maxsize=None)
+def near_duplicate_index():
+    """
+    Function returning the index of the perceptual hashes of the analyzed
+    images, loaded from the database on first use, with matches within
+    FACE_NEAR_DUPLICATE_DISTANCE bits.
+
+    Returns:
+    HammingIndex -- The index shared by the analyses of the process, None
+    when the near-duplicates are not looked up.
+    """
+    max_distance = getattr(settings, 'FACE_NEAR_DUPLICATE_DISTANCE', None)
+    if max_distance is None:
+        return None
+    index = HammingIndex(max_distance)
+    index.extend(Image.objects.filter(
+        perceptual_hash__isnull=False, detections__isnull=False
+    ).values_list('id', 'perceptual_hash').iterator(chunk_size=10000))
+    return index
+
+
+@lru_cache(maxsize=None)
+def large_analysis_limiter():
+    """
+    Function returning the limiter of the concurrent analyses of large
+    images configured by the FACE_LARGE_IMAGE_PIXELS and
+    FACE_MAX_LARGE_ANALYSES settings.
+
+    Returns:
+    LargeAnalysisLimiter -- The limiter shared by the analyses of the
+    process.
+    """
+    return LargeAnalysisLimiter(
+        getattr(settings, 'FACE_LARGE_IMAGE_PIXELS', None),
+        getattr(settings, 'FACE_MAX_LARGE_ANALYSES', 1),
+    )
+
+
+@lru_cache(maxsize=None)
+def rotation_prior():
+    """
+    Function returning the rotation prior configured by the
+    FACE_ROTATION_PRIOR, FACE_ROTATION_PRIOR_HALF_LIFE and
+    FACE_ROTATION_PRIOR_PATH settings.
 
-    def analyze(self):
-        face_analysis_algorithm = FaceAnalysisAlgorithm(self.image.name)
-        return face_analysis_algorithm.face_detection()
+    Returns:
+    RotationPrior -- The prior shared by the analyses of the process, None
+    when the angles are tried in their configured order.
+    """
+    if not getattr(settings, 'FACE_ROTATION_PRIOR', True):
+        return None
+    return RotationPrior(
+        half_life=getattr(settings, 'FACE_ROTATION_PRIOR_HALF_LIFE', 1000),
+        path=getattr(settings, 'FACE_ROTATION_PRIOR_PATH', None),
+    )
@@ -0,0 +1,226 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+# Relative difference of aspect ratio from which an image is not a resized
+# copy of another.
+ASPECT_TOLERANCE = 0.02
+
+
+def perceptual_hash(image):
+    """
+    Function that computes the difference hash of an image.
+
+    The image is reduced to a 9x8 grayscale thumbnail, each of the 64 bits
+    telling whether a pixel is brighter than its left neighbour. The hash
+    survives a recompression, a resizing or the loss of the metadata, the
+    hashes of such copies differing by a few bits.
+
+    Keyword arguments:
+    image (numpy.ndarray): The decoded BGR image, or a grayscale image.
+
+    Returns:
+    int -- The hash as a signed 64-bit integer, as stored by the database.
+    """
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    if thumbnail.ndim == 3:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    value = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def hamming_distance(first, second):
+    """
+    Function that returns the number of bits differing between two hashes.
+    """
+    return ((first ^ second) & HASH_MASK).bit_count()
+
+
+def same_aspect(shape, other_shape):
+    """
+    Function that tells whether two images have the same aspect ratio.
+
+    Keyword arguments:
+    shape (tuple): Height and width of the first image.
+    other_shape (tuple): Height and width of the second image.
+
+    Returns:
+    bool -- True when the ratios differ by less than ASPECT_TOLERANCE.
+    """
+    ratio = shape[1] / shape[0]
+    other_ratio = other_shape[1] / other_shape[0]
+    return abs(ratio - other_ratio) <= ASPECT_TOLERANCE * other_ratio
+
+
+def rescale_faces(faces, shape, other_shape):
+    """
+    Function that maps face rectangles found on an image to a resized copy.
+
+    Keyword arguments:
+    faces (list): Rectangles (x, y, w, h) found on the first image.
+    shape (tuple): Height and width of the first image.
+    other_shape (tuple): Height and width of the resized copy.
+
+    Returns:
+    numpy.ndarray -- Array of shape (N, 4) of the rectangles on the copy.
+    """
+    faces = np.asarray(faces, dtype=float).reshape(-1, 4)
+    scale_y = other_shape[0] / shape[0]
+    scale_x = other_shape[1] / shape[1]
+    return np.round(
+        faces * (scale_x, scale_y, scale_x, scale_y)
+    ).astype(np.int64)
+
+
+def _popcount(values):
+    values = values - ((values >> np.uint64(1))
+                       & np.uint64(0x5555555555555555))
+    values = ((values & np.uint64(0x3333333333333333))
+              + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333)))
+    values = (values + (values >> np.uint64(4))) & np.uint64(
+        0x0F0F0F0F0F0F0F0F
+    )
+    return (values * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+class HammingIndex:
+    """
+    Class finding the 64-bit hashes within a Hamming distance of a hash.
+
+    The hashes are split in max_distance + 1 blocks of contiguous bits: two
+    hashes within max_distance bits share at least one block exactly. Each
+    block has a sorted array of its values, a lookup being one binary
+    search per block followed by the distance check of the few hashes
+    sharing a block, so a million hashes take a few dozen megabytes and
+    are searched in well under a millisecond. The hashes added since the
+    last merge are checked one by one, then merged in the sorted arrays
+    once MERGE_SIZE of them are waiting.
+
+    Attributes:
+    max_distance (int): Maximum number of differing bits of a match.
+
+    Methods:
+    add(value, key): Adds a hash.
+    extend(items): Adds (key, hash) pairs.
+    search(value): Returns the keys of the hashes matching a hash.
+    """
+
+    MERGE_SIZE = 256
+
+    def __init__(self, max_distance=4):
+        """
+        Initializes a HammingIndex object.
+
+        Keyword arguments:
+        max_distance (int): Maximum number of differing bits of a match,
+        from 0 to 15.
+        """
+        if not 0 <= max_distance < 16:
+            raise ValueError('max_distance must be between 0 and 15')
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        widths = [HASH_BITS // blocks + (block < HASH_BITS % blocks)
+                  for block in range(blocks)]
+        self._blocks = []
+        shift = 0
+        for width in widths:
+            self._blocks.append(
+                (np.uint64(shift), np.uint64((1 << width) - 1))
+            )
+            shift += width
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._sorted = [(np.empty(0, dtype=np.uint64),
+                         np.empty(0, dtype=np.int64)) for _ in widths]
+        self._waiting = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._hashes) + len(self._waiting)
+
+    def add(self, value, key):
+        """
+        Method that adds a hash.
+
+        Keyword arguments:
+        value (int): The hash, signed or unsigned.
+        key (int): The key returned by search(), such as a row identifier.
+        """
+        with self._lock:
+            self._waiting.append((value & HASH_MASK, key))
+            if len(self._waiting) >= self.MERGE_SIZE:
+                self.__merge(self._waiting)
+                self._waiting = []
+
+    def extend(self, items):
+        """
+        Method that adds many hashes with a single merge.
+
+        Keyword arguments:
+        items (iterable): (key, hash) pairs.
+        """
+        pairs = [(value & HASH_MASK, key) for key, value in items]
+        if pairs:
+            with self._lock:
+                self.__merge(pairs)
+
+    def search(self, value):
+        """
+        Method that returns the keys of the hashes within max_distance bits
+        of a hash.
+
+        Keyword arguments:
+        value (int): The hash, signed or unsigned.
+
+        Returns:
+        list -- (distance, key) tuples sorted by distance, each key once.
+        """
+        value &= HASH_MASK
+        target = np.uint64(value)
+        with self._lock:
+            positions = []
+            for (shift, mask), (values, rows) in zip(self._blocks,
+                                                      self._sorted):
+                block = (target >> shift) & mask
+                start, end = np.searchsorted(
+                    values, np.array((block, block + 1), dtype=np.uint64)
+                )
+                positions.append(rows[start:end])
+            rows = np.unique(np.concatenate(positions))
+            distances = _popcount(self._hashes[rows] ^ target)
+            close = distances <= self.max_distance
+            matches = {}
+            for distance, key in zip(distances[close].tolist(),
+                                     self._keys[rows[close]].tolist()):
+                matches[key] = min(distance, matches.get(key, distance))
+            for waiting_value, key in self._waiting:
+                distance = (value ^ waiting_value).bit_count()
+                if distance <= self.max_distance:
+                    matches[key] = min(distance, matches.get(key, distance))
+        return sorted((distance, key) for key, distance in matches.items())
+
+    def __merge(self, pairs):
+        offset = len(self._hashes)
+        hashes = np.fromiter((value for value, _ in pairs), dtype=np.uint64,
+                             count=len(pairs))
+        self._hashes = np.concatenate((self._hashes, hashes))
+        self._keys = np.concatenate((self._keys, np.fromiter(
+            (key for _, key in pairs), dtype=np.int64, count=len(pairs)
+        )))
+        rows = np.arange(offset, offset + len(pairs), dtype=np.int64)
+        for block, (shift, mask) in enumerate(self._blocks):
+            values, sorted_rows = self._sorted[block]
+            new_values = (hashes >> shift) & mask
+            order = np.argsort(new_values, kind='stable')
+            new_values = new_values[order]
+            insertion = np.searchsorted(values, new_values, side='right')
+            self._sorted[block] = (
+                np.insert(values, insertion, new_values),
+                np.insert(sorted_rows, insertion, rows[order]),
+            )
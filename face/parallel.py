@@ -0,0 +1,307 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from .search_strategies import SearchBudget
+
+
+class ParallelRotationExecutor:
+    """
+    Class evaluating the rotation angles of a search on a worker pool.
+
+    Each angle is an independent task running every cascade pass on the
+    rotated image. The results are consumed in the order of the angles, so
+    the first angle with detections wins exactly as in the sequential
+    search. Once the winner is known or the deadline has passed, the
+    waiting tasks are cancelled and a stop flag shared with the running
+    ones exhausts their budgets before their next cascade call; the search
+    returns after they have stopped, charging their calls to its budget.
+
+    In thread mode the tasks share the decoded image, OpenCV releasing the
+    GIL during the detections. In process mode the image is copied once in a
+    shared memory block attached by the worker processes, each of them
+    running OpenCV on a single thread. As many angles as workers are
+    evaluated at the same time, so little work is wasted once the winner is
+    known.
+
+    Attributes:
+    mode (str): 'thread' or 'process'.
+    workers (int): Number of workers of the pool.
+
+    Methods:
+    search(algorithm, angles, budget): Searches the first angle with
+    detections.
+    shutdown(): Stops the worker pool.
+    """
+
+    MODES = ('thread', 'process')
+
+    def __init__(self, mode='thread', workers=None):
+        """
+        Initializes a ParallelRotationExecutor object.
+
+        Keyword arguments:
+        mode (str): 'thread' or 'process'.
+        workers (int): Number of workers, the number of CPUs by default.
+        """
+        if mode not in self.MODES:
+            raise ValueError(
+                'Unknown parallel mode "{}", expected one of: {}'.format(
+                    mode, ', '.join(self.MODES)
+                )
+            )
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def search(self, algorithm, angles, budget):
+        """
+        Method that searches the first angle producing detections.
+
+        With a call budget, each task is only allowed the calls that are not
+        already reserved by the running tasks, so the budget is never
+        exceeded. With a time budget, the search stops waiting at the
+        deadline. The calls of the tasks stopped once the search is decided
+        are charged to the budget as well.
+
+        Keyword arguments:
+        algorithm (FaceAnalysisAlgorithm): The analysis of the image.
+        angles (list): Angles to try, in order.
+        budget (SearchBudget): Budget of the search.
+
+        Returns:
+        tuple -- The winning angle or None, the detection arrays of the
+        winning angle and the number of angles evaluated.
+        """
+        calls_per_angle = algorithm.detector.calls_per_image()
+        image = algorithm.detection_image()
+        shared_image = None
+        if self.mode == 'process':
+            # The byte following the image holds the stop flag.
+            shared_image = shared_memory.SharedMemory(
+                create=True, size=image.nbytes + 1
+            )
+            np.ndarray(image.shape, image.dtype,
+                       buffer=shared_image.buf)[:] = image
+            stop = SharedFlag(shared_image.buf, image.nbytes)
+        else:
+            stop = threading.Event()
+        pending = {}
+        results = {}
+        reserved = 0
+        submitted = 0
+        next_index = 0
+        rotations_tried = 0
+        try:
+            while next_index < len(angles):
+                while (submitted < len(angles)
+                       and len(pending) < self.workers
+                       and not budget.exhausted()):
+                    allowance = calls_per_angle
+                    if budget.max_calls is not None:
+                        allowance = min(
+                            allowance,
+                            budget.max_calls - budget.cascade_calls - reserved
+                        )
+                        if allowance <= 0:
+                            break
+                    future = self.__submit(
+                        algorithm, image, shared_image, angles[submitted],
+                        allowance, budget, stop
+                    )
+                    pending[future] = (submitted, allowance)
+                    reserved += allowance
+                    submitted += 1
+                if not pending:
+                    budget.is_exhausted = True
+                    break
+                timeout = None
+                if budget.deadline is not None:
+                    timeout = max(0, budget.deadline - time.perf_counter())
+                done, _ = wait(pending, timeout, FIRST_COMPLETED)
+                if not done:
+                    budget.exhausted()
+                    break
+                for future in done:
+                    index, allowance = pending.pop(future)
+                    reserved -= allowance
+                    faces_detected_results, calls, exhausted = future.result()
+                    budget.charge(calls)
+                    rotations_tried += 1
+                    results[index] = (faces_detected_results, exhausted)
+                while next_index in results:
+                    faces_detected_results, exhausted = results.pop(
+                        next_index
+                    )
+                    if len(faces_detected_results) > 0:
+                        return (angles[next_index], faces_detected_results,
+                                rotations_tried)
+                    next_index += 1
+                    if exhausted:
+                        budget.is_exhausted = True
+                        return None, [], rotations_tried
+            return None, [], rotations_tried
+        finally:
+            stop.set()
+            for future in pending:
+                # The running tasks stop before their next cascade call.
+                if not future.cancel() and future.exception() is None:
+                    budget.charge(future.result()[1])
+            if shared_image is not None:
+                stop = None
+                shared_image.close()
+                shared_image.unlink()
+
+    def shutdown(self):
+        """
+        Method that stops the worker pool, pending tasks are cancelled.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def __pool(self):
+        with self._lock:
+            if self._executor is None:
+                if self.mode == 'thread':
+                    self._executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='face-rotation'
+                    )
+                else:
+                    self._executor = ProcessPoolExecutor(
+                        self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_initialize_worker_process
+                    )
+            return self._executor
+
+    def __submit(self, algorithm, image, shared_image, angle, allowance,
+                 budget, stop):
+        max_seconds = None
+        if budget.deadline is not None:
+            max_seconds = budget.deadline - time.perf_counter()
+        if shared_image is None:
+            return self.__pool().submit(
+                _detect_rotation, algorithm, angle, allowance, max_seconds,
+                stop
+            )
+        return self.__pool().submit(
+            _detect_shared_rotation, type(algorithm), algorithm.strategy,
+            algorithm.detector, shared_image.name, image.shape,
+            image.dtype.str, angle, allowance, max_seconds
+        )
+
+
+class SharedFlag:
+    """
+    Class of a flag stored in a byte of a shared memory block, set by the
+    search and read by the worker processes, with the is_set() and set()
+    methods of threading.Event.
+
+    Attributes:
+    buffer (memoryview): Buffer of the shared memory block.
+    index (int): Offset of the byte of the flag.
+    """
+
+    def __init__(self, buffer, index):
+        """
+        Initializes a SharedFlag object.
+
+        Keyword arguments:
+        buffer (memoryview): Buffer of the shared memory block.
+        index (int): Offset of the byte of the flag.
+        """
+        self.buffer = buffer
+        self.index = index
+
+    def is_set(self):
+        return self.buffer[self.index] != 0
+
+    def set(self):
+        self.buffer[self.index] = 1
+
+
+def _initialize_worker_process():
+    """
+    Function limiting OpenCV to one thread in a worker process, the
+    parallelism coming from the pool itself.
+    """
+    cv2.setNumThreads(1)
+
+
+def _detect_rotation(algorithm, angle, max_calls, max_seconds, stop=None):
+    """
+    Function running the cascade passes of an angle in a worker.
+
+    Keyword arguments:
+    algorithm (FaceAnalysisAlgorithm): The analysis of the image.
+    angle (int): Angle in degrees.
+    max_calls (int): Cascade calls allowed to the task.
+    max_seconds (float): Time left before the deadline of the search.
+    stop (threading.Event): Flag set once the search is decided.
+
+    Returns:
+    tuple -- The detection arrays, the number of cascade calls and whether
+    the task ran out of budget.
+    """
+    budget = SearchBudget(max_calls, max_seconds, stop)
+    if budget.exhausted():
+        return [], 0, True
+    faces_detected_results = algorithm.detect_rotation(angle, budget)
+    return (faces_detected_results, budget.cascade_calls,
+            budget.is_exhausted)
+
+
+def _detect_shared_rotation(algorithm_class, strategy, detector, name,
+                            shape, dtype, angle, max_calls, max_seconds):
+    """
+    Function running the cascade passes of an angle in a worker process,
+    on an image stored in a shared memory block.
+    """
+    shared_image = shared_memory.SharedMemory(name=name)
+    image = algorithm = None
+    try:
+        image = np.ndarray(shape, np.dtype(dtype), buffer=shared_image.buf)
+        algorithm = algorithm_class.from_array(
+            image, strategy=strategy, detector=detector
+        )
+        return _detect_rotation(
+            algorithm, angle, max_calls, max_seconds,
+            SharedFlag(shared_image.buf, image.nbytes)
+        )
+    finally:
+        # The views on the block must be released before closing it.
+        image = algorithm = None
+        shared_image.close()
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(mode, workers=None):
+    """
+    Function returning the process-wide executor of a configuration.
+
+    Keyword arguments:
+    mode (str): 'thread' or 'process'.
+    workers (int): Number of workers, the number of CPUs by default.
+
+    Returns:
+    ParallelRotationExecutor -- Executor shared by the analyses.
+    """
+    with _executors_lock:
+        executor = _executors.get((mode, workers))
+        if executor is None:
+            executor = ParallelRotationExecutor(mode, workers)
+            _executors[(mode, workers)] = executor
+        return executor
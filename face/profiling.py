@@ -0,0 +1,114 @@
+import threading
+import time
+from contextlib import nullcontext
+
+
+class StageTimer:
+    """
+    Class measuring the time spent in each stage of an analysis.
+
+    Each stage accumulates its duration and its number of executions, so
+    that the cascade stage also counts the detectMultiScale calls. The
+    stages may run concurrently in several threads.
+
+    Methods:
+    stage(name): Context manager timing one execution of a stage.
+    add(name, seconds, count): Records executions of a stage.
+    timings(): Returns the accumulated seconds of each stage.
+    counts(): Returns the number of executions of each stage.
+    """
+
+    def __init__(self):
+        """
+        Initializes a StageTimer object.
+        """
+        self._seconds = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Method that times one execution of a stage.
+
+        Keyword arguments:
+        name (str): Name of the stage.
+
+        Returns:
+        contextmanager -- Context timing its block.
+        """
+        return _Stage(self, name)
+
+    def add(self, name, seconds, count=1):
+        """
+        Method that records executions of a stage.
+
+        Keyword arguments:
+        name (str): Name of the stage.
+        seconds (float): Duration of the executions.
+        count (int): Number of executions.
+        """
+        with self._lock:
+            self._seconds[name] = self._seconds.get(name, 0) + seconds
+            self._counts[name] = self._counts.get(name, 0) + count
+
+    def timings(self):
+        """
+        Method that returns the accumulated seconds of each stage.
+
+        Returns:
+        dict -- Seconds by stage name.
+        """
+        with self._lock:
+            return dict(self._seconds)
+
+    def counts(self):
+        """
+        Method that returns the number of executions of each stage.
+
+        Returns:
+        dict -- Executions by stage name.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+
+class NullTimer:
+    """
+    Class with the interface of StageTimer measuring nothing, used when the
+    analysis is not profiled so that timing a stage costs a method call.
+    """
+
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def add(self, name, seconds, count=1):
+        pass
+
+    def timings(self):
+        return {}
+
+    def counts(self):
+        return {}
+
+
+NULL_TIMER = NullTimer()
+
+
+class _Stage:
+    """
+    Context manager adding the duration of its block to a StageTimer.
+    """
+
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self.timer.add(self.name, time.perf_counter() - self.start)
@@ -0,0 +1,160 @@
+import numpy as np
+
+
+MODES = ('compat', 'nms')
+
+
+def filter_rectangles(rectangles, mode='compat', iou_threshold=0.3,
+                      scores=None, weighted=False):
+    """
+    Function that merges the rectangles detected by the cascade passes.
+
+    In 'compat' mode, the rectangles are sorted by decreasing area, the
+    rectangles containing another one are removed, then each rectangle
+    overlapping a larger retained one is removed. In 'nms' mode, the
+    rectangles are sorted by decreasing score and each rectangle whose
+    intersection over union with a retained one exceeds iou_threshold is
+    suppressed; with weighted, a retained rectangle becomes the
+    score-weighted average of the rectangles it suppressed.
+
+    Keyword arguments:
+    rectangles -- Array-like of shape (N, 4) of rectangles (x, y, w, h).
+    mode (str): 'compat' or 'nms'.
+    iou_threshold (float): Suppression threshold of the 'nms' mode.
+    scores -- Optional array-like of N scores of the 'nms' mode, the areas
+    by default.
+    weighted (bool): Average the suppressed rectangles in 'nms' mode.
+
+    Returns:
+    numpy.ndarray -- Array of shape (M, 4) of the retained rectangles.
+    """
+    if mode not in MODES:
+        raise ValueError(
+            'Unknown rectangle filter "{}", expected one of: {}'.format(
+                mode, ', '.join(MODES)
+            )
+        )
+    rectangles = np.asarray(rectangles, dtype=np.int64).reshape(-1, 4)
+    if len(rectangles) == 0:
+        return rectangles
+    areas = rectangles[:, 2] * rectangles[:, 3]
+    if mode == 'compat':
+        rectangles = rectangles[np.argsort(-areas, kind='stable')]
+        rectangles = rectangles[~containment_matrix(rectangles).any(axis=1)]
+        return rectangles[_greedy(overlap_matrix(rectangles))]
+    scores = areas if scores is None else np.asarray(scores, dtype=float)
+    order = np.argsort(-scores, kind='stable')
+    rectangles, scores = rectangles[order], scores[order]
+    suppressed = iou_matrix(rectangles) > iou_threshold
+    retained = _greedy(suppressed)
+    if not weighted:
+        return rectangles[retained]
+    # Each rectangle is fused into the first retained rectangle it overlaps.
+    owners = np.argmax(suppressed[:, retained] | np.eye(
+        len(rectangles), dtype=bool
+    )[:, retained], axis=1)
+    weights = np.zeros((retained.sum(), len(rectangles)))
+    weights[owners, np.arange(len(rectangles))] = scores
+    corners = np.hstack((rectangles[:, :2], rectangles[:, :2]
+                         + rectangles[:, 2:]))
+    fused = weights @ corners / weights.sum(axis=1, keepdims=True)
+    fused = np.round(fused).astype(np.int64)
+    return np.hstack((fused[:, :2], fused[:, 2:] - fused[:, :2]))
+
+
+def count_votes(rectangles, passes):
+    """
+    Function that counts the detection passes voting for each rectangle, a
+    pass voting for a rectangle when the center of one of its detections
+    lies inside it.
+
+    Keyword arguments:
+    rectangles -- Array-like of shape (N, 4) of rectangles (x, y, w, h).
+    passes (list): Array-likes of shape (K, 4) of the detections of each
+    pass.
+
+    Returns:
+    numpy.ndarray -- Array of N vote counts.
+    """
+    rectangles = np.asarray(rectangles, dtype=np.int64).reshape(-1, 4)
+    left, top, right, bottom = _corners(rectangles)
+    votes = np.zeros(len(rectangles), dtype=np.int64)
+    for detections in passes:
+        detections = np.asarray(detections, dtype=float).reshape(-1, 4)
+        x, y = (detections[:, :2] + detections[:, 2:] / 2).T
+        votes += ((left[:, None] <= x) & (x < right[:, None])
+                  & (top[:, None] <= y) & (y < bottom[:, None])).any(axis=1)
+    return votes
+
+
+def containment_matrix(rectangles):
+    """
+    Function that tells which rectangles contain which others.
+
+    Keyword arguments:
+    rectangles (numpy.ndarray): Array of shape (N, 4) of rectangles.
+
+    Returns:
+    numpy.ndarray -- Boolean array of shape (N, N), True at (i, j) when the
+    rectangle i contains the rectangle j, i and j being different.
+    """
+    left, top, right, bottom = _corners(rectangles)
+    contains = ((left[:, None] <= left) & (top[:, None] <= top)
+                & (right[:, None] >= right) & (bottom[:, None] >= bottom))
+    np.fill_diagonal(contains, False)
+    return contains
+
+
+def overlap_matrix(rectangles):
+    """
+    Function that tells which rectangles strictly overlap which others.
+
+    Keyword arguments:
+    rectangles (numpy.ndarray): Array of shape (N, 4) of rectangles.
+
+    Returns:
+    numpy.ndarray -- Symmetric boolean array of shape (N, N).
+    """
+    left, top, right, bottom = _corners(rectangles)
+    return ((left[:, None] < right) & (right[:, None] > left)
+            & (top[:, None] < bottom) & (bottom[:, None] > top))
+
+
+def iou_matrix(rectangles):
+    """
+    Function that computes the intersection over union of the rectangles.
+
+    Keyword arguments:
+    rectangles (numpy.ndarray): Array of shape (N, 4) of rectangles.
+
+    Returns:
+    numpy.ndarray -- Symmetric float array of shape (N, N).
+    """
+    left, top, right, bottom = _corners(rectangles)
+    widths = np.clip(np.minimum(right[:, None], right)
+                     - np.maximum(left[:, None], left), 0, None)
+    heights = np.clip(np.minimum(bottom[:, None], bottom)
+                      - np.maximum(top[:, None], top), 0, None)
+    intersections = widths * heights
+    areas = rectangles[:, 2] * rectangles[:, 3]
+    unions = areas[:, None] + areas - intersections
+    return intersections / np.maximum(unions, 1)
+
+
+def _corners(rectangles):
+    left, top = rectangles[:, 0], rectangles[:, 1]
+    return left, top, left + rectangles[:, 2], top + rectangles[:, 3]
+
+
+def _greedy(conflicts):
+    """
+    Function that retains, in order, each rectangle in conflict with no
+    previously retained rectangle.
+    """
+    retained = []
+    for i in range(len(conflicts)):
+        if not conflicts[i, retained].any():
+            retained.append(i)
+    mask = np.zeros(len(conflicts), dtype=bool)
+    mask[retained] = True
+    return mask
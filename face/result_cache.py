@@ -0,0 +1,171 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# Bump when a change of the algorithm alters the results, so that the
+# entries stored in a shared cache backend are not reused.
+CACHE_VERSION = 2
+
+
+class ResultCache:
+    """
+    Class caching analysis results by image content and configuration.
+
+    The results are kept in an in-process LRU bounded in size and age, and
+    optionally in a Django cache backend shared by the worker processes.
+    A result found in the backend is copied in the in-process tier.
+
+    Attributes:
+    max_size (int): Maximum number of in-process entries, 0 disables the
+    in-process tier.
+    ttl (float): Lifetime of an entry in seconds, unlimited when None.
+    cache_alias (str): Alias of the Django cache backend, None to only use
+    the in-process tier.
+
+    Methods:
+    key(data, configuration): Returns the cache key of an image.
+    configuration_digest(configuration): Identifies a configuration.
+    get(key): Returns a cached result or None.
+    set(key, result): Stores a result.
+    stats(): Returns the hit and miss counters.
+    clear(): Drops the in-process entries and the counters.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600, cache_alias=None):
+        """
+        Initializes a ResultCache object.
+
+        Keyword arguments:
+        max_size (int): Maximum number of in-process entries.
+        ttl (float): Lifetime of an entry in seconds.
+        cache_alias (str): Alias of the Django cache backend.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('hits', 'backend_hits', 'misses', 'evictions'), 0
+        )
+
+    @staticmethod
+    def key(data, configuration):
+        """
+        Method that returns the cache key of an image.
+
+        Keyword arguments:
+        data (bytes): The encoded image, any buffer-like object is accepted.
+        configuration (dict): JSON-serializable settings determining the
+        results.
+
+        Returns:
+        str -- Key made of the SHA-256 digests of the content and of the
+        configuration.
+        """
+        return 'face:{}:{}'.format(
+            hashlib.sha256(data).hexdigest(),
+            ResultCache.configuration_digest(configuration)
+        )
+
+    @staticmethod
+    def configuration_digest(configuration):
+        """
+        Method that returns the part of the cache keys identifying a
+        configuration.
+
+        Keyword arguments:
+        configuration (dict): JSON-serializable settings determining the
+        results.
+
+        Returns:
+        str -- The first 16 hexadecimal digits of the SHA-256 digest of the
+        configuration.
+        """
+        return hashlib.sha256(json.dumps(
+            [CACHE_VERSION, configuration], sort_keys=True, default=str
+        ).encode()).hexdigest()[:16]
+
+    def get(self, key):
+        """
+        Method that returns a cached result.
+
+        Keyword arguments:
+        key (str): Key returned by key().
+
+        Returns:
+        dict -- A copy of the cached result, or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return copy.deepcopy(result)
+                del self._entries[key]
+        result = None
+        if self.cache_alias is not None:
+            result = self.__backend().get(key)
+        with self._lock:
+            if result is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['backend_hits'] += 1
+        self.__store(key, result)
+        return copy.deepcopy(result)
+
+    def set(self, key, result):
+        """
+        Method that stores a result.
+
+        Keyword arguments:
+        key (str): Key returned by key().
+        result (dict): JSON-serializable analysis result.
+        """
+        result = copy.deepcopy(result)
+        self.__store(key, result)
+        if self.cache_alias is not None:
+            self.__backend().set(key, result, self.ttl)
+
+    def stats(self):
+        """
+        Method that returns the cache counters.
+
+        Returns:
+        dict -- In-process hits, backend hits, misses, evictions and number
+        of in-process entries.
+        """
+        with self._lock:
+            return dict(self._counters, size=len(self._entries))
+
+    def clear(self):
+        """
+        Method that drops the in-process entries and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._counters = dict.fromkeys(self._counters, 0)
+
+    def __store(self, key, result):
+        if self.max_size <= 0:
+            return
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def __backend(self):
+        from django.core.cache import caches
+        return caches[self.cache_alias]
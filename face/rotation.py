@@ -0,0 +1,154 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+
+# cv2.rotate codes of the quarter turns, the angles being counterclockwise
+# as for cv2.getRotationMatrix2D.
+QUARTER_TURNS = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+
+
+class RotationGeometry(namedtuple('RotationGeometry',
+                                  'matrix inverse size quarter_turn')):
+    """
+    Class describing the rotation of an image by an angle.
+
+    Attributes:
+    matrix (numpy.ndarray): Affine matrix mapping the pixels of the image to
+    the canvas.
+    inverse (numpy.ndarray): Affine matrix mapping the canvas back to the
+    image.
+    size (tuple): Width and height of the canvas, large enough for the
+    corners of the image.
+    quarter_turn (int): cv2.rotate code of an angle multiple of 90 degrees,
+    None otherwise.
+    """
+
+    __slots__ = ()
+
+
+@lru_cache(maxsize=1024)
+def rotation_geometry(height, width, angle):
+    """
+    Function that computes the geometry of a rotation, once per image shape
+    and angle.
+
+    The image is rotated around its center onto a canvas holding the whole
+    rotated image, so that no pixel is lost at large angles. The pixel
+    centers are used as coordinates, which makes the matrices of the
+    quarter turns exact.
+
+    Keyword arguments:
+    height (int): Height of the image.
+    width (int): Width of the image.
+    angle (float): Counterclockwise angle in degrees.
+
+    Returns:
+    RotationGeometry -- The cached geometry, its matrices being read-only.
+    """
+    radians = np.deg2rad(angle)
+    cosine, sine = abs(np.cos(radians)), abs(np.sin(radians))
+    # The epsilon keeps the sides of the quarter turns exact.
+    canvas_width = int(np.ceil(width * cosine + height * sine - 1e-6))
+    canvas_height = int(np.ceil(width * sine + height * cosine - 1e-6))
+    matrix = cv2.getRotationMatrix2D(
+        ((width - 1) / 2, (height - 1) / 2), angle, 1.0
+    )
+    matrix[0, 2] += (canvas_width - width) / 2
+    matrix[1, 2] += (canvas_height - height) / 2
+    inverse = cv2.invertAffineTransform(matrix)
+    matrix.setflags(write=False)
+    inverse.setflags(write=False)
+    return RotationGeometry(
+        matrix, inverse, (canvas_width, canvas_height),
+        QUARTER_TURNS.get(angle % 360)
+    )
+
+
+def rotate(image, angle):
+    """
+    Function that rotates an image around its center onto a canvas holding
+    the whole rotated image.
+
+    The quarter turns are done with cv2.rotate, without interpolation, the
+    other angles with cv2.warpAffine.
+
+    Keyword arguments:
+    image (numpy.ndarray): Image to be rotated.
+    angle (float): Counterclockwise angle in degrees.
+
+    Returns:
+    numpy.ndarray -- The rotated image, the image itself when the angle is a
+    multiple of 360 degrees.
+    """
+    if angle % 360 == 0:
+        return image
+    geometry = rotation_geometry(image.shape[0], image.shape[1], angle)
+    if geometry.quarter_turn is not None:
+        return cv2.rotate(image, geometry.quarter_turn)
+    return cv2.warpAffine(image, geometry.matrix, geometry.size)
+
+
+def back_project_corners(rectangles, shape, angle):
+    """
+    Function that maps the corners of rectangles found in a rotated image
+    back to the image.
+
+    Keyword arguments:
+    rectangles -- Array-like of shape (N, 4) of rectangles (x, y, w, h) in
+    the rotated image.
+    shape (tuple): Shape of the image before the rotation.
+    angle (float): Counterclockwise angle of the rotation in degrees, None
+    or 0 when the image was not rotated.
+
+    Returns:
+    numpy.ndarray -- Array of shape (N, 4, 2) of the top left, top right,
+    bottom right and bottom left corners in the image, the corners being
+    the outer edges of the pixels.
+    """
+    rectangles = np.asarray(rectangles, dtype=np.int64).reshape(-1, 4)
+    x, y, w, h = rectangles.T.astype(float) - [[0.5], [0.5], [0], [0]]
+    corners = np.stack((
+        np.column_stack((x, y)), np.column_stack((x + w, y)),
+        np.column_stack((x + w, y + h)), np.column_stack((x, y + h)),
+    ), axis=1)
+    if angle and angle % 360 != 0:
+        inverse = rotation_geometry(shape[0], shape[1], angle).inverse
+        corners = corners @ inverse[:, :2].T + inverse[:, 2]
+    return corners + 0.5
+
+
+def back_project(rectangles, shape, angle):
+    """
+    Function that maps rectangles found in a rotated image back to the
+    image.
+
+    The corners of each rectangle are mapped with the inverse rotation and
+    the rectangle bounding them is clipped to the image.
+
+    Keyword arguments:
+    rectangles -- Array-like of shape (N, 4) of rectangles (x, y, w, h) in
+    the rotated image.
+    shape (tuple): Shape of the image before the rotation.
+    angle (float): Counterclockwise angle of the rotation in degrees, None
+    or 0 when the image was not rotated.
+
+    Returns:
+    numpy.ndarray -- Array of shape (N, 4) of the rectangles in the image.
+    """
+    rectangles = np.asarray(rectangles, dtype=np.int64).reshape(-1, 4)
+    if not angle or angle % 360 == 0:
+        return rectangles
+    corners = np.round(back_project_corners(rectangles, shape, angle))
+    height, width = shape[:2]
+    left, top = np.clip(corners.min(axis=1), 0, (width, height)).T
+    right, bottom = np.clip(corners.max(axis=1), 0, (width, height)).T
+    return np.column_stack(
+        (left, top, right - left, bottom - top)
+    ).astype(np.int64)
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+
+
+class RotationPrior:
+    """
+    Class learning which rotation angles produce detections.
+
+    Every winning angle adds a hit to its weight while the weights of all
+    the angles decay, so that the recent traffic dominates. The angles are
+    then tried in decreasing order of weight, the angles never seen keeping
+    their configured order. The weights can be persisted to a JSON file
+    shared by the worker processes.
+
+    Attributes:
+    half_life (float): Number of recorded analyses after which a hit
+    weighs half as much.
+    path (str): JSON file persisting the weights, None to keep them in
+    memory only.
+    save_interval (int): Number of recorded analyses between two saves.
+
+    Methods:
+    order(angles): Sorts angles by decreasing likelihood.
+    record(angle): Records the winning angle of an analysis.
+    weights(): Returns the weight of each angle.
+    load(): Reads the persisted weights.
+    save(): Persists the weights.
+    clear(): Forgets every hit.
+    """
+
+    def __init__(self, half_life=1000, path=None, save_interval=50):
+        """
+        Initializes a RotationPrior object, loading the persisted weights.
+
+        Keyword arguments:
+        half_life (float): Number of recorded analyses after which a hit
+        weighs half as much.
+        path (str): JSON file persisting the weights.
+        save_interval (int): Number of recorded analyses between two saves.
+        """
+        self.half_life = half_life
+        self.path = path
+        self.save_interval = save_interval
+        self._decay = 0.5 ** (1 / half_life)
+        self._weights = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def order(self, angles):
+        """
+        Method that sorts angles by decreasing likelihood.
+
+        Keyword arguments:
+        angles (list): Angles in degrees, in their configured order.
+
+        Returns:
+        list -- The same angles, the most frequent winners first.
+        """
+        with self._lock:
+            weights = dict(self._weights)
+        return sorted(angles, key=lambda angle: -weights.get(angle, 0))
+
+    def record(self, angle):
+        """
+        Method that records the winning angle of an analysis.
+
+        Keyword arguments:
+        angle (int): Angle in degrees of the detections.
+        """
+        with self._lock:
+            for known_angle in self._weights:
+                self._weights[known_angle] *= self._decay
+            self._weights[angle] = self._weights.get(angle, 0) + 1
+            self._unsaved += 1
+            save = (self.path is not None
+                    and self._unsaved >= self.save_interval)
+        if save:
+            self.save()
+
+    def weights(self):
+        """
+        Method that returns the weight of each angle.
+
+        Returns:
+        dict -- Decayed number of hits by angle.
+        """
+        with self._lock:
+            return dict(self._weights)
+
+    def load(self):
+        """
+        Method that reads the weights persisted in path, if any.
+        """
+        try:
+            with open(self.path) as prior_file:
+                weights = json.load(prior_file)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._weights = {
+                int(angle): float(weight) for angle, weight in weights.items()
+            }
+
+    def save(self):
+        """
+        Method that persists the weights to path, atomically replacing the
+        previous file.
+        """
+        with self._lock:
+            weights = {str(angle): weight
+                       for angle, weight in self._weights.items()}
+            self._unsaved = 0
+        temporary_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporary_path, 'w') as prior_file:
+            json.dump(weights, prior_file)
+        os.replace(temporary_path, self.path)
+
+    def clear(self):
+        """
+        Method that forgets every hit.
+        """
+        with self._lock:
+            self._weights.clear()
+            self._unsaved = 0
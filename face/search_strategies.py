@@ -0,0 +1,290 @@
+import copy
+import time
+
+
+class SearchBudget:
+    """
+    Class limiting the work of a single rotation search.
+
+    Attributes:
+    max_calls (int): Maximum number of cascade calls, unlimited when None.
+    deadline (float): perf_counter value after which the search stops,
+    unlimited when None.
+    cascade_calls (int): Number of cascade calls charged so far.
+    is_exhausted (bool): True once a limit has been reached.
+    stop (threading.Event): Flag set when the search is decided elsewhere,
+    any object with an is_set() method, never set when None.
+
+    Methods:
+    charge(calls): Records cascade calls.
+    exhausted(): Returns True when the search must stop.
+    """
+
+    def __init__(self, max_calls=None, max_seconds=None, stop=None):
+        """
+        Initializes a SearchBudget object, the clock starts immediately.
+
+        Keyword arguments:
+        max_calls (int): Maximum number of cascade calls.
+        max_seconds (float): Maximum wall-clock duration of the search.
+        stop (threading.Event): Flag exhausting the budget once set.
+        """
+        self.max_calls = max_calls
+        self.stop = stop
+        self.deadline = None
+        if max_seconds is not None:
+            self.deadline = time.perf_counter() + max_seconds
+        self.cascade_calls = 0
+        self.is_exhausted = False
+
+    def charge(self, calls=1):
+        """
+        Method that records cascade calls.
+
+        Keyword arguments:
+        calls (int): Number of cascade calls executed.
+        """
+        self.cascade_calls += calls
+
+    def exhausted(self):
+        """
+        Method that tells whether the budget allows another cascade call.
+
+        Returns:
+        bool -- True when the call or time limit has been reached or the
+        stop flag is set.
+        """
+        if not self.is_exhausted:
+            self.is_exhausted = (
+                (self.max_calls is not None
+                 and self.cascade_calls >= self.max_calls)
+                or (self.deadline is not None
+                    and time.perf_counter() >= self.deadline)
+                or (self.stop is not None and self.stop.is_set())
+            )
+        return self.is_exhausted
+
+
+class SearchStrategy:
+    """
+    Base class for the rotation search strategies.
+
+    A strategy decides in which order the rotation angles are tried, how
+    much work a single search may do and when the cascade/parameter passes
+    of an angle can stop early. The first angle producing detections wins.
+
+    Attributes:
+    name (str): Name reported in the analysis results.
+    max_calls (int): Cascade call budget of a search, unlimited when None.
+    max_seconds (float): Wall-clock budget of a search, unlimited when None.
+    min_votes (int): Number of cascade/parameter passes with detections
+    after which the remaining passes of the angle are skipped. Every pass
+    runs when None.
+
+    Methods:
+    angles(rotations): Returns the angles to try, in order.
+    budget(): Returns a new budget for a search.
+    configuration(): Describes the strategy.
+    is_confident(votes): Tells whether an angle can stop early.
+    report(budget, rotations_tried): Returns the search summary.
+    with_time_limit(max_seconds): Returns a copy bounded in time.
+    """
+
+    name = None
+
+    def __init__(self, max_calls=None, max_seconds=None, min_votes=None):
+        """
+        Initializes a SearchStrategy object.
+
+        Keyword arguments:
+        max_calls (int): Cascade call budget of a search.
+        max_seconds (float): Wall-clock budget of a search.
+        min_votes (int): Passes with detections needed to stop an angle
+        early.
+        """
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.min_votes = min_votes
+
+    def angles(self, rotations):
+        """
+        Method that returns the angles to try.
+
+        Keyword arguments:
+        rotations (list): Candidate angles in degrees, in their preferred
+        order.
+
+        Returns:
+        list -- Angles to try, in order, without duplicates.
+        """
+        raise NotImplementedError
+
+    def budget(self):
+        """
+        Method that returns a new budget for a search.
+
+        Returns:
+        SearchBudget -- Budget started now.
+        """
+        return SearchBudget(self.max_calls, self.max_seconds)
+
+    def configuration(self):
+        """
+        Method that describes the strategy.
+
+        Returns:
+        dict -- The name and the options of the strategy.
+        """
+        return dict(vars(self), name=self.name)
+
+    def is_confident(self, votes):
+        """
+        Method that tells whether the passes of an angle can stop.
+
+        Keyword arguments:
+        votes (int): Number of passes that produced detections at the angle.
+
+        Returns:
+        bool -- True when enough passes agree.
+        """
+        return self.min_votes is not None and votes >= self.min_votes
+
+    def report(self, budget, rotations_tried):
+        """
+        Method that returns the search summary included in the results.
+
+        Keyword arguments:
+        budget (SearchBudget): Budget of the finished search.
+        rotations_tried (int): Number of angles evaluated.
+
+        Returns:
+        dict -- Strategy name, cascade calls, rotations tried and whether
+        the budget stopped the search.
+        """
+        return {
+            'strategy': self.name,
+            'cascade_calls': budget.cascade_calls,
+            'rotations_tried': rotations_tried,
+            'budget_exhausted': budget.is_exhausted,
+        }
+
+    def with_time_limit(self, max_seconds):
+        """
+        Method that returns a copy of the strategy whose searches stop after
+        max_seconds at the latest, such as the time left before the
+        deadline of a request.
+
+        Keyword arguments:
+        max_seconds (float): Wall-clock budget of a search.
+
+        Returns:
+        SearchStrategy -- The bounded copy.
+        """
+        strategy = copy.copy(self)
+        max_seconds = max(0, max_seconds)
+        if self.max_seconds is None or max_seconds < self.max_seconds:
+            strategy.max_seconds = max_seconds
+        return strategy
+
+    @staticmethod
+    def _unique(angles):
+        """
+        Method that removes the duplicated angles, 180 and -180 being the
+        same rotation.
+        """
+        return list(dict.fromkeys((angle + 180) % 360 - 180
+                                  for angle in angles))
+
+
+class ExhaustiveSearch(SearchStrategy):
+    """
+    Strategy trying every rotation in its configured order.
+    """
+
+    name = 'exhaustive'
+
+    def angles(self, rotations):
+        return self._unique(rotations)
+
+
+class CoarseToFineSearch(SearchStrategy):
+    """
+    Strategy trying the coarse angles before the fine ones.
+
+    The cascades tolerate a few degrees of tilt, so a face is usually found
+    at the closest coarse angle. The fine angles are only tried when no
+    coarse angle produced detections.
+
+    Attributes:
+    step (int): Angles multiple of step are coarse.
+    """
+
+    name = 'coarse_to_fine'
+
+    def __init__(self, step=30, **kwargs):
+        """
+        Initializes a CoarseToFineSearch object.
+
+        Keyword arguments:
+        step (int): Angles multiple of step, in degrees, are tried first.
+        """
+        super().__init__(**kwargs)
+        self.step = step
+
+    def angles(self, rotations):
+        rotations = self._unique(rotations)
+        coarse = [angle for angle in rotations if angle % self.step == 0]
+        fine = [angle for angle in rotations if angle % self.step != 0]
+        return coarse + fine
+
+
+class FastSearch(SearchStrategy):
+    """
+    Strategy trying the upright image and small tilts only.
+
+    Attributes:
+    max_angle (int): Largest tilt tried, in degrees.
+    """
+
+    name = 'fast'
+
+    def __init__(self, max_angle=8, **kwargs):
+        """
+        Initializes a FastSearch object.
+
+        Keyword arguments:
+        max_angle (int): Largest tilt tried, in degrees.
+        """
+        super().__init__(**kwargs)
+        self.max_angle = max_angle
+
+    def angles(self, rotations):
+        return self._unique([0, self.max_angle, -self.max_angle])
+
+
+STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (ExhaustiveSearch, CoarseToFineSearch, FastSearch)
+}
+
+
+def get_strategy(name, **kwargs):
+    """
+    Function that creates a search strategy from its name.
+
+    Keyword arguments:
+    name (str): Name of the strategy, a key of STRATEGIES.
+    kwargs: Options given to the strategy constructor.
+
+    Returns:
+    SearchStrategy -- The configured strategy.
+    """
+    try:
+        strategy_class = STRATEGIES[name]
+    except KeyError:
+        raise ValueError(
+            'Unknown search strategy "{}", expected one of: {}'.format(
+                name, ', '.join(sorted(STRATEGIES))
+            )
+        )
+    return strategy_class(**kwargs)
@@ -1,8 +1,40 @@
 from rest_framework import serializers
-from .models import Image
+from .models import Face, Image
 
 
 class ImageSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Image
-        fields = ['image']
\ No newline at end of file
+        fields = ['image']
+
+
+class ImageJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Image
+        fields = [
+            'id', 'image', 'status', 'strategy', 'detector',
+            'analysis_results', 'annotated_image', 'error', 'created_at',
+            'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class FaceSerializer(serializers.ModelSerializer):
+    box = serializers.ListField(source='unpacked_box', read_only=True)
+    skin_brightness = serializers.FloatField(read_only=True)
+    skin_info = serializers.CharField(source='get_skin_info_display',
+                                      read_only=True)
+
+    class Meta:
+        model = Face
+        fields = ['box', 'skin_brightness', 'skin_info', 'votes']
+        read_only_fields = fields
+
+
+class ImageResultSerializer(serializers.ModelSerializer):
+    faces = FaceSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Image
+        fields = ['id', 'image', 'number_of_faces', 'faces', 'finished_at']
+        read_only_fields = fields
@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+
+
+def skin_analysis(faces, plane, patch_radius=0):
+    """
+    Function that analyzes the facial skin of every face at once.
+
+    Keyword arguments:
+    faces -- Array-like of shape (N, 4) of face rectangles (x, y, w, h).
+    plane (numpy.ndarray): Single-channel image the faces were found in.
+    patch_radius (int): Radius of the patch averaged around each sample,
+    single pixels are sampled when 0.
+
+    Returns:
+    list -- One dictionary per face with the brightness of the facial skin
+    rounded to two decimal places and the skin information.
+    Example: [{'skin_brightness': 0.75, 'skin_info': 'light skin'}]
+    """
+    results = []
+    for brightness in skin_brightness(faces, plane, patch_radius):
+        result = round(float(brightness), 2)
+        results.append(
+            {"skin_brightness": result, "skin_info": skin_type(result)}
+        )
+    return results
+
+
+def skin_brightness(faces, plane, patch_radius=0):
+    """
+    Function that measures the facial skin brightness of every face.
+
+    Nine points are sampled in each face: three rows starting at the middle
+    of the face height, one sixth and one third of the half height lower,
+    and three columns starting at one third of the face width, spaced by
+    two ninths of the width. The brightness of a face is the median of its
+    samples, between 0 and 1. With a patch radius, each sample is the mean
+    of the square patch around the point, which is less sensitive to noise
+    and skin texture.
+
+    Keyword arguments:
+    faces -- Array-like of shape (N, 4) of face rectangles (x, y, w, h).
+    plane (numpy.ndarray): Single-channel image the faces were found in.
+    patch_radius (int): Radius of the patch averaged around each sample.
+
+    Returns:
+    numpy.ndarray -- Array of N brightness values.
+    """
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 4)
+    if len(faces) == 0:
+        return np.empty(0)
+    x, y, w, h = faces.T
+    distance = h // 2
+    rows = (y + distance)[:, None] + np.column_stack(
+        (np.zeros_like(distance), distance // 6, distance // 3)
+    )
+    sampling_distance = (w / 1.5 / 3).astype(np.int64)
+    columns = (x + w // 3)[:, None] + np.column_stack(
+        (np.zeros_like(sampling_distance), sampling_distance,
+         sampling_distance * 2)
+    )
+    height, width = plane.shape[:2]
+    rows = np.clip(rows, 0, height - 1)[:, :, None]
+    columns = np.clip(columns, 0, width - 1)[:, None, :]
+    if patch_radius > 0:
+        samples = _patch_means(plane, rows, columns, patch_radius)
+    else:
+        samples = plane[rows, columns]
+    return (100 / 255) * np.median(
+        samples.reshape(len(faces), -1), axis=1
+    ) / 100
+
+
+def skin_type(result):
+    """
+    Function that determines the type of facial skin from its brightness.
+
+    Keyword arguments:
+    result (float): The brightness of the facial skin.
+
+    Returns:
+    str: String indicating the detected type of facial skin.
+    Possible values: 'dark skin', 'matte skin', 'light skin', 'no skin'.
+    """
+    if 0 < result < 0.42:
+        return "dark skin"
+    elif 0.42 <= result <= 0.60:
+        return "matte skin"
+    elif 0.60 < result:
+        return "light skin"
+    return "no skin"
+
+
+def _patch_means(plane, rows, columns, radius):
+    """
+    Function that averages the square patches centered on the samples with
+    an integral image, the patches being clipped to the image.
+    """
+    height, width = plane.shape[:2]
+    integral = cv2.integral(plane)
+    top = np.clip(rows - radius, 0, height)
+    bottom = np.clip(rows + radius + 1, 0, height)
+    left = np.clip(columns - radius, 0, width)
+    right = np.clip(columns + radius + 1, 0, width)
+    sums = (integral[bottom, right] - integral[top, right]
+            - integral[bottom, left] + integral[top, left])
+    return sums / ((bottom - top) * (right - left))
@@ -1,57 +1,1297 @@
+import io
+import json
 import os
+import tempfile
+import threading
+import zipfile
+from statistics import median
 
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+from django.core.management import call_command
+from django.test import (AsyncClient, SimpleTestCase, TestCase,
+                         override_settings)
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from .admission import BoundedAnalysisExecutor, QueueFull, analysis_executor
+from .benchmarks.pipeline import compare, run_case
+from .benchmarks.rectangles import random_rectangles, reference_filter
+from .classifier_pool import ClassifierPool
+from .detectors import DNNDetector, get_detector
+from .face_analysis_algorithm import FaceAnalysisAlgorithm
+from .jobs import process_next_job, worker_pool
+from .memory import LargeAnalysisLimiter, plan_decode
+from .metrics import MetricsRegistry
+from .models import (Face, Image, detector_backend, near_duplicate_index,
+                     pack_box, result_cache, unpack_box)
+from .near_duplicates import HammingIndex, perceptual_hash
+from .parallel import ParallelRotationExecutor
+from .profiling import StageTimer
+from .rectangles import count_votes, filter_rectangles
+from .result_cache import ResultCache
+from .rotation import back_project, rotate, rotation_geometry
+from .rotation_prior import RotationPrior
+from .uploads import upload_executor
+from .search_strategies import SearchBudget, get_strategy
+from .skin_analysis import skin_analysis, skin_brightness
+from .video import VideoFaceAnalyzer
 
 
 class FaceViewTests(APITestCase):
-    def test_image_with_1_face(self):
-        url = reverse('face_analysis')
-        image_data = {
-            'image': open(
-                os.path.abspath('face/test_images/image_with_1_face.jpg'), 'rb'
-            ),
-        }
-        result = self.client.post(url, data=image_data, format='multipart')
-        content = result.data
+    def post_image(self, name, query=''):
+        url = reverse('face_analysis') + query
+        image_path = os.path.abspath(os.path.join('face/test_images', name))
+        with open(image_path, 'rb') as image_file:
+            result = self.client.post(
+                url, data={'image': image_file}, format='multipart'
+            )
         self.assertEqual(result.status_code, status.HTTP_201_CREATED)
-        self.assertGreater(len(content['image']), 0)
+        self.assertGreater(len(result.data['image']), 0)
+        return result.data['analysis_results']
+
+    def test_image_with_1_face(self):
+        analysis_results = self.post_image('image_with_1_face.jpg')
+        self.assertEqual(analysis_results['number_of_faces_detected'], 1)
         self.assertEqual(
-            content['analysis_results'],
-            {"Number of faces detected": 1}
+            analysis_results['facial_skin'],
+            [{'skin_brightness': 0.22, 'skin_info': 'dark skin', 'votes': 3,
+              'box': [530, 297, 469, 469]}]
         )
+        self.assertEqual(analysis_results['rotation_angle'], 0)
 
     def test_image_with_2_faces(self):
+        analysis_results = self.post_image('image_with_2_faces.jpg')
+        self.assertEqual(analysis_results['number_of_faces_detected'], 2)
+        self.assertEqual(
+            [skin['skin_info'] for skin in analysis_results['facial_skin']],
+            ['dark skin', 'light skin']
+        )
+
+    def test_image_without_face(self):
+        # The exhaustive search finds a false positive at -60 degrees in
+        # this image, the upright search finds nothing.
+        analysis_results = self.post_image(
+            'image_without_face.jpg', '?strategy=fast'
+        )
+        self.assertEqual(analysis_results['number_of_faces_detected'], 0)
+        self.assertEqual(analysis_results['facial_skin'], [])
+        self.assertIsNone(analysis_results['rotation_angle'])
+
+
+class ClassifierPoolTests(SimpleTestCase):
+    def test_classifiers_are_loaded_once_and_reused(self):
+        pool = ClassifierPool()
+        cascade_path = FaceAnalysisAlgorithm.CASCADE_PATHS[0]
+        pool.preload([cascade_path])
+        for _ in range(3):
+            with pool.acquire(cascade_path) as classifier:
+                self.assertFalse(classifier.empty())
+        stats = pool.stats()[os.path.basename(cascade_path)]
+        self.assertEqual(stats['instances'], 1)
+        self.assertEqual(stats['reuses'], 3)
+        self.assertGreater(stats['load_seconds'], 0)
+
+    def test_busy_classifier_is_not_shared(self):
+        pool = ClassifierPool()
+        cascade_path = FaceAnalysisAlgorithm.CASCADE_PATHS[0]
+        with pool.acquire(cascade_path) as first:
+            with pool.acquire(cascade_path) as second:
+                self.assertIsNot(first, second)
+        self.assertEqual(
+            pool.stats()[os.path.basename(cascade_path)]['instances'], 2
+        )
+
+
+class FaceAnalysisAlgorithmTests(SimpleTestCase):
+    def test_from_bytes_detects_face(self):
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            image_data = image_file.read()
+        result = FaceAnalysisAlgorithm.from_bytes(image_data).face_detection()
+        self.assertEqual(result['number_of_faces_detected'], 1)
+        self.assertEqual(len(result['facial_skin']), 1)
+
+    def test_downscaled_detection_finds_the_same_faces(self):
+        image_path = os.path.abspath('face/test_images/image_with_2_faces.jpg')
+        with open(image_path, 'rb') as image_file:
+            algorithm = FaceAnalysisAlgorithm.from_bytes(
+                image_file.read(), max_dimension=640, refine=True
+            )
+        result = algorithm.face_detection()
+        self.assertEqual(result['number_of_faces_detected'], 2)
+        self.assertEqual(max(algorithm.detection_image().shape), 640)
+        self.assertEqual(
+            [skin['skin_info'] for skin in result['facial_skin']],
+            ['dark skin', 'light skin']
+        )
+
+    def test_verified_faces_report_their_votes(self):
+        image_path = os.path.abspath('face/test_images/image_with_2_faces.jpg')
+        with open(image_path, 'rb') as image_file:
+            algorithm = FaceAnalysisAlgorithm.from_bytes(
+                image_file.read(), verify=True, rectangle_filter='nms'
+            )
+        result = algorithm.face_detection()
+        self.assertEqual(result['number_of_faces_detected'], 2)
+        for skin in result['facial_skin']:
+            self.assertGreater(skin['votes'], 0)
+        self.assertEqual(algorithm.detection_record()['votes'],
+                         [skin['votes'] for skin in result['facial_skin']])
+
+    def test_preprocessed_images_are_single_channel_and_cached(self):
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        algorithm = FaceAnalysisAlgorithm(image_path)
+        rotated = algorithm.preprocessed_image(30)
+        self.assertEqual(rotated.ndim, 2)
+        self.assertIs(algorithm.preprocessed_image(30), rotated)
+        self.assertIs(
+            algorithm.preprocessed_image(0), algorithm.preprocessed_image(0)
+        )
+
+    def test_from_bytes_rejects_undecodable_data(self):
+        with self.assertRaises(ValueError):
+            FaceAnalysisAlgorithm.from_bytes(b'not an image')
+
+
+class SearchStrategyTests(SimpleTestCase):
+    def test_exhaustive_search_tries_each_rotation_once(self):
+        rotations = FaceAnalysisAlgorithm.ROTATIONS
+        self.assertEqual(len(rotations), len(set(rotations)))
+        angles = get_strategy('exhaustive').angles(rotations)
+        self.assertEqual(angles[0], 0)
+        self.assertEqual(len(angles), len(set(angles)))
+        self.assertEqual(angles.count(-180), 1)
+
+    def test_coarse_to_fine_search_tries_coarse_angles_first(self):
+        angles = get_strategy('coarse_to_fine', step=30).angles(
+            FaceAnalysisAlgorithm.ROTATIONS
+        )
+        self.assertEqual(angles[:5], [0, 30, -30, 60, -60])
+        self.assertEqual(
+            sorted(angles),
+            sorted(get_strategy('exhaustive').angles(
+                FaceAnalysisAlgorithm.ROTATIONS
+            ))
+        )
+
+    def test_fast_search_tries_small_angles_only(self):
+        self.assertEqual(
+            get_strategy('fast').angles(FaceAnalysisAlgorithm.ROTATIONS),
+            [0, 8, -8]
+        )
+
+    def test_budget_stops_after_max_calls(self):
+        budget = SearchBudget(max_calls=2)
+        budget.charge()
+        self.assertFalse(budget.exhausted())
+        budget.charge()
+        self.assertTrue(budget.exhausted())
+
+    def test_budgeted_search_is_reported(self):
+        image_path = os.path.abspath('face/test_images/image_without_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            result = FaceAnalysisAlgorithm.from_bytes(
+                image_file.read(),
+                strategy=get_strategy('exhaustive', max_calls=15)
+            ).face_detection()
+        self.assertEqual(result['search']['strategy'], 'exhaustive')
+        self.assertEqual(result['search']['cascade_calls'], 15)
+        self.assertTrue(result['search']['budget_exhausted'])
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_strategy('random')
+
+
+class ParallelRotationExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ParallelRotationExecutor('thread', workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_thread_pool_finds_the_same_faces(self):
+        image_path = os.path.abspath('face/test_images/image_with_2_faces.jpg')
+        with open(image_path, 'rb') as image_file:
+            image_data = image_file.read()
+        sequential = FaceAnalysisAlgorithm.from_bytes(
+            image_data
+        ).face_detection()
+        parallel = FaceAnalysisAlgorithm.from_bytes(
+            image_data, executor=self.executor
+        ).face_detection()
+        self.assertEqual(parallel['facial_skin'], sequential['facial_skin'])
+
+    def test_thread_pool_respects_the_call_budget(self):
+        image_path = os.path.abspath('face/test_images/image_without_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            result = FaceAnalysisAlgorithm.from_bytes(
+                image_file.read(),
+                strategy=get_strategy('exhaustive', max_calls=25),
+                executor=self.executor
+            ).face_detection()
+        self.assertEqual(result['search']['cascade_calls'], 25)
+        self.assertTrue(result['search']['budget_exhausted'])
+
+    def test_losing_angles_stop_with_the_search(self):
+        image_path = os.path.abspath('face/test_images/image_with_2_faces.jpg')
+        with open(image_path, 'rb') as image_file:
+            image_data = image_file.read()
+        executor = ParallelRotationExecutor('thread', workers=4)
+        self.addCleanup(executor.shutdown)
+        timer = StageTimer()
+        result = FaceAnalysisAlgorithm.from_bytes(
+            image_data, executor=executor, timer=timer
+        ).face_detection()
+        # No task of a losing angle is left running, nor uncharged.
+        self.assertEqual(result['search']['cascade_calls'],
+                         timer.counts()['cascades'])
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ParallelRotationExecutor('gpu')
+
+
+class FilterRectanglesTests(SimpleTestCase):
+    def test_compat_mode_matches_the_reference_loops(self):
+        for seed in range(5):
+            rectangles = random_rectangles(300, seed=seed)
+            self.assertEqual(
+                filter_rectangles(rectangles).tolist(),
+                [list(rectangle)
+                 for rectangle in reference_filter(rectangles.tolist())]
+            )
+
+    def test_compat_mode_removes_identical_rectangles(self):
+        rectangles = [(10, 10, 50, 50), (10, 10, 50, 50), (200, 10, 40, 40)]
+        self.assertEqual(
+            filter_rectangles(rectangles).tolist(), [[200, 10, 40, 40]]
+        )
+
+    def test_nms_mode_keeps_adjacent_rectangles(self):
+        rectangles = [(0, 0, 100, 100), (90, 0, 100, 100), (5, 5, 100, 100)]
+        self.assertEqual(
+            filter_rectangles(rectangles, mode='nms').tolist(),
+            [[0, 0, 100, 100], [90, 0, 100, 100]]
+        )
+
+    def test_weighted_nms_averages_suppressed_rectangles(self):
+        rectangles = [(0, 0, 100, 100), (10, 10, 100, 100)]
+        self.assertEqual(
+            filter_rectangles(
+                rectangles, mode='nms', scores=[1, 1], weighted=True
+            ).tolist(),
+            [[5, 5, 100, 100]]
+        )
+
+
+    def test_votes_count_the_passes_centered_in_each_rectangle(self):
+        rectangles = [(0, 0, 100, 100), (200, 0, 100, 100)]
+        passes = [[(10, 10, 80, 80), (20, 20, 60, 60)], [(150, 0, 120, 90)],
+                  [(500, 500, 10, 10)]]
+        self.assertEqual(count_votes(rectangles, passes).tolist(), [1, 1])
+        self.assertEqual(count_votes(np.empty((0, 4)), passes).tolist(), [])
+
+
+class SkinAnalysisTests(SimpleTestCase):
+    def test_batched_sampling_matches_per_face_sampling(self):
+        generator = np.random.default_rng(0)
+        plane = generator.integers(0, 256, (400, 600), dtype=np.uint8)
+        faces = np.column_stack((
+            generator.integers(0, 400, 50), generator.integers(0, 250, 50),
+            generator.integers(24, 150, 50), generator.integers(24, 150, 50)
+        ))
+        expected = []
+        for x, y, w, h in faces.tolist():
+            distance = int(h / 2)
+            sampling_distance = int((w / 1.5) / 3)
+            samples = [
+                plane[y + distance + offset,
+                      x + int(w / 3) + column * sampling_distance]
+                for offset in (0, int(distance / 6), int(distance / 3))
+                for column in (0, 1, 2)
+            ]
+            expected.append(round(((100 / 255) * median(samples)) / 100, 2))
+        self.assertEqual(
+            [skin['skin_brightness']
+             for skin in skin_analysis(faces, plane)],
+            expected
+        )
+
+    def test_patch_sampling_averages_the_patches(self):
+        plane = np.zeros((100, 100), dtype=np.uint8)
+        plane[::2] = 255
+        faces = [(10, 10, 60, 60)]
+        self.assertIn(skin_brightness(faces, plane)[0], (0, 1))
+        self.assertAlmostEqual(
+            skin_brightness(faces, plane, patch_radius=5)[0], 0.5,
+            delta=1 / 11
+        )
+
+    def test_no_face_gives_no_result(self):
+        self.assertEqual(
+            skin_analysis(np.empty((0, 4)), np.zeros((10, 10), np.uint8)), []
+        )
+
+
+class ResultCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(max_size=2)
+        cache.set('a', {'value': 1})
+        cache.set('b', {'value': 2})
+        cache.get('a')
+        cache.set('c', {'value': 3})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'value': 1})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expired_entry_is_a_miss(self):
+        cache = ResultCache(ttl=0)
+        cache.set('a', {'value': 1})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_cached_results_are_copies(self):
+        cache = ResultCache()
+        cache.set('a', {'facial_skin': []})
+        cache.get('a')['facial_skin'].append('mutated')
+        self.assertEqual(cache.get('a'), {'facial_skin': []})
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_key_depends_on_content_and_configuration(self):
+        key = ResultCache.key(b'image', {'rotations': [0]})
+        self.assertEqual(key, ResultCache.key(b'image', {'rotations': [0]}))
+        self.assertNotEqual(key, ResultCache.key(b'other', {'rotations': [0]}))
+        self.assertNotEqual(key, ResultCache.key(b'image', {'rotations': [2]}))
+
+
+class ResultCacheViewTests(APITestCase):
+    def test_duplicate_upload_is_served_from_the_cache(self):
+        result_cache().clear()
         url = reverse('face_analysis')
-        image_data = {
-            'image': open(
-                os.path.abspath('face/test_images/image_with_2_faces.jpg'),
-                'rb'
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        results = []
+        for _ in range(2):
+            with open(image_path, 'rb') as image_file:
+                response = self.client.post(
+                    url, data={'image': image_file}, format='multipart'
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            results.append(response.data['analysis_results'])
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(result_cache().stats()['hits'], 1)
+        self.assertEqual(result_cache().stats()['misses'], 1)
+
+
+@override_settings(FACE_JOB_WORKERS=0)
+class AsyncJobViewTests(APITestCase):
+    def setUp(self):
+        worker_pool.cache_clear()
+        self.addCleanup(worker_pool.cache_clear)
+
+    def test_async_upload_is_queued_then_processed(self):
+        url = reverse('face_analysis') + '?async=1&strategy=fast'
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            response = self.client.post(
+                url, data={'image': image_file}, format='multipart'
             )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Image.PENDING)
+        job = self.client.get(response.data['url'])
+        self.assertEqual(job.data['status'], Image.PENDING)
+        self.assertIsNone(job.data['analysis_results'])
+
+        self.assertTrue(process_next_job())
+        self.assertFalse(process_next_job())
+        job = self.client.get(response.data['url'])
+        self.assertEqual(job.data['status'], Image.DONE)
+        self.assertEqual(job.data['strategy'], 'fast')
+        self.assertEqual(
+            job.data['analysis_results']['number_of_faces_detected'], 1
+        )
+        self.assertIsNotNone(job.data['finished_at'])
+
+    def test_unknown_job_is_not_found(self):
+        response = self.client.get(
+            reverse('face_analysis_detail', args=[12345])
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def resized_copy(path):
+    image = cv2.imread(path)
+    return cv2.imencode('.jpg', cv2.resize(
+        image, None, fx=0.6, fy=0.6, interpolation=cv2.INTER_AREA
+    ), [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()
+
+
+class BatchViewTests(APITransactionTestCase):
+    # The rows are committed so that the worker threads of the batches read
+    # them on their own connections.
+    IMAGES = ('image_with_1_face.jpg', 'image_with_2_faces.jpg')
+
+    def setUp(self):
+        near_duplicate_index.cache_clear()
+        self.addCleanup(near_duplicate_index.cache_clear)
+
+    def post(self, files):
+        url = reverse('face_analysis_batch') + '?strategy=fast'
+        return self.client.post(
+            url, data={'images': files}, format='multipart'
+        )
+
+    def test_files_are_analyzed_and_streamed(self):
+        files = [
+            open(os.path.join('face/test_images', name), 'rb')
+            for name in self.IMAGES
+        ]
+        try:
+            response = self.post(files)
+        finally:
+            for image_file in files:
+                image_file.close()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = [
+            json.loads(line) for line
+            in b''.join(response.streaming_content).splitlines()
+        ]
+        faces = {
+            line['name']: line['analysis_results']['number_of_faces_detected']
+            for line in lines
         }
-        result = self.client.post(url, data=image_data, format='multipart')
-        content = result.data
-        self.assertEqual(result.status_code, status.HTTP_201_CREATED)
-        self.assertGreater(len(content['image']), 0)
+        self.assertEqual(faces, dict(zip(self.IMAGES, (1, 2))))
         self.assertEqual(
-            content['analysis_results'],
-            {"Number of faces detected": 2}
+            Image.objects.filter(status=Image.DONE).count(), 2
         )
+        self.assertEqual(Face.objects.count(), 3)
 
-    def test_image_without_face(self):
-        url = reverse('face_analysis')
-        image_data = {
-            'image': open(
-                os.path.abspath('face/test_images/image_without_face.jpg'),
-                'rb'
+    @override_settings(FACE_NEAR_DUPLICATE_DISTANCE=4)
+    def test_near_duplicate_reuses_the_detections(self):
+        result_cache().clear()
+        path = os.path.abspath('face/test_images/image_with_2_faces.jpg')
+        with open(path, 'rb') as image_file:
+            response = self.client.post(
+                reverse('face_analysis') + '?strategy=fast',
+                data={'image': image_file}, format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload = io.BytesIO(resized_copy(path))
+        upload.name = 'copy.jpg'
+        line, = b''.join(self.post([upload]).streaming_content).splitlines()
+        search = json.loads(line)['analysis_results']['search']
+        self.assertEqual(search['near_duplicate_of'],
+                         Image.objects.earliest('id').id)
+        self.assertEqual(search['cascade_calls'], 0)
+
+    def test_archive_members_are_analyzed(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for name in self.IMAGES:
+                zip_file.write(os.path.join('face/test_images', name), name)
+            zip_file.writestr('notes.txt', 'skipped')
+        archive.seek(0)
+        archive.name = 'album.zip'
+        response = self.post([archive])
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(
+            sorted(json.loads(line)['name'] for line in lines),
+            list(self.IMAGES)
+        )
+
+    @override_settings(FACE_BATCH_MAX_FILES=1)
+    def test_too_many_files_are_rejected(self):
+        files = [
+            open(os.path.join('face/test_images', name), 'rb')
+            for name in self.IMAGES
+        ]
+        try:
+            response = self.post(files)
+        finally:
+            for image_file in files:
+                image_file.close()
+        self.assertEqual(
+            response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        self.assertFalse(Image.objects.exists())
+
+
+class OutputPolicyViewTests(APITestCase):
+    IMAGE_PATH = os.path.abspath('face/test_images/image_with_1_face.jpg')
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        result_cache().clear()
+
+    def post(self, query=''):
+        with open(self.IMAGE_PATH, 'rb') as image_file:
+            return self.client.post(
+                reverse('face_analysis') + query, data={'image': image_file},
+                format='multipart'
+            )
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, names in os.walk(self.media_root)
+            for name in names
+        )
+
+    def test_upload_is_kept_intact_without_artifacts(self):
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('annotated_image', response.data)
+        image = Image.objects.get()
+        self.assertEqual(self.stored_files(), [image.image.name])
+        with open(self.IMAGE_PATH, 'rb') as original:
+            with image.image.open('rb') as stored:
+                self.assertEqual(stored.read(), original.read())
+
+    def test_annotated_copy_is_stored_on_request(self):
+        response = self.post('?annotate=1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        self.assertTrue(image.annotated_image.name.startswith('annotated/'))
+        self.assertEqual(
+            response.data['annotated_image'], image.annotated_image.url
+        )
+        annotated = cv2.imread(image.annotated_image.path)
+        self.assertEqual(annotated.shape, cv2.imread(self.IMAGE_PATH).shape)
+
+    @override_settings(FACE_UPLOAD_PERSISTENCE='none')
+    def test_upload_is_analyzed_without_being_stored(self):
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data['analysis_results']['number_of_faces_detected'], 1
+        )
+        self.assertIsNone(response.data['image'])
+        self.assertEqual(Image.objects.get().status, Image.DONE)
+        self.assertEqual(self.stored_files(), [])
+
+    @override_settings(FACE_UPLOAD_PERSISTENCE='deferred')
+    def test_deferred_upload_is_stored_under_its_reserved_name(self):
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        self.assertEqual(response.data['image'], image.image.url)
+        upload_executor().submit(lambda: None).result()
+        self.assertEqual(self.stored_files(), [image.image.name])
+        with open(self.IMAGE_PATH, 'rb') as original:
+            with image.image.open('rb') as stored:
+                self.assertEqual(stored.read(), original.read())
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_upload_spooled_to_disk_is_analyzed_in_place(self):
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data['analysis_results']['number_of_faces_detected'], 1
+        )
+        image = Image.objects.get()
+        self.assertEqual(self.stored_files(), [image.image.name])
+
+
+def moving_face_frames(count):
+    image = cv2.resize(
+        cv2.imread('face/test_images/image_with_1_face.jpg'), (640, 640)
+    )
+    return [np.roll(image, 4 * index, axis=1) for index in range(count)]
+
+
+class VideoFaceAnalyzerTests(SimpleTestCase):
+    def test_faces_are_tracked_between_keyframes(self):
+        analyzer = VideoFaceAnalyzer(
+            keyframe_interval=3, strategy=get_strategy('fast')
+        )
+        results = list(analyzer.analyze(moving_face_frames(6)))
+        self.assertEqual(
+            [result['keyframe'] for result in results],
+            [True, False, False, True, False, False]
+        )
+        self.assertEqual(
+            [[face['track'] for face in result['faces']]
+             for result in results], [[0]] * 6
+        )
+        summary = analyzer.summary()
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary[0]['frames'], 6)
+        self.assertEqual(summary[0]['skin_info'], 'dark skin')
+
+
+class VideoViewTests(APITestCase):
+    def test_video_frames_and_tracks_are_streamed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'clip.avi')
+            writer = cv2.VideoWriter(
+                path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (640, 640)
             )
+            for frame in moving_face_frames(4):
+                writer.write(frame)
+            writer.release()
+            with open(path, 'rb') as video:
+                response = self.client.post(
+                    reverse('face_analysis_video'), data={'video': video},
+                    format='multipart'
+                )
+            lines = [
+                json.loads(line) for line
+                in b''.join(response.streaming_content).splitlines()
+            ]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([line['frame'] for line in lines[:-1]], [0, 1, 2, 3])
+        self.assertEqual(len(lines[-1]['tracks']), 1)
+
+    def test_unreadable_video_is_rejected(self):
+        video = io.BytesIO(b'not a video')
+        video.name = 'clip.avi'
+        response = self.client.post(
+            reverse('face_analysis_video'), data={'video': video},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('video', response.json())
+
+
+class RotationTests(SimpleTestCase):
+    def test_quarter_turns_match_the_affine_matrices(self):
+        image = np.random.default_rng(0).integers(
+            0, 256, (50, 80), dtype=np.uint8
+        )
+        for angle in (90, -90, 180, -180):
+            geometry = rotation_geometry(50, 80, angle)
+            np.testing.assert_array_equal(
+                rotate(image, angle), cv2.warpAffine(
+                    image, geometry.matrix, geometry.size,
+                    flags=cv2.INTER_NEAREST
+                )
+            )
+
+    def test_canvas_holds_the_corners(self):
+        image = np.full((50, 80), 255, dtype=np.uint8)
+        rotated = rotate(image, 30)
+        self.assertEqual(rotated.shape, (84, 95))
+        self.assertAlmostEqual(rotated.sum() / 255, image.size, delta=100)
+
+    def test_boxes_are_mapped_back_to_the_image(self):
+        self.assertEqual(
+            back_project([(10, 20, 5, 7)], (50, 80), 90).tolist(),
+            [[53, 10, 7, 5]]
+        )
+        self.assertEqual(
+            back_project([(0, 0, 95, 84)], (50, 80), 30).tolist(),
+            [[0, 0, 80, 50]]
+        )
+
+    def test_rotated_face_is_reported_in_the_image(self):
+        image = cv2.imread('face/test_images/image_with_1_face.jpg')
+        upright = FaceAnalysisAlgorithm.from_array(image).face_detection()
+        result = FaceAnalysisAlgorithm.from_array(
+            cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+        ).face_detection()
+        self.assertEqual(result['rotation_angle'], 90)
+        x, y, w, h = upright['facial_skin'][0]['box']
+        self.assertEqual(result['facial_skin'][0]['box'],
+                         [image.shape[0] - y - h, x, h, w])
+        self.assertEqual(result['facial_skin'][0]['skin_brightness'],
+                         upright['facial_skin'][0]['skin_brightness'])
+
+
+class RotationPriorTests(SimpleTestCase):
+    def test_frequent_winners_are_tried_first(self):
+        prior = RotationPrior(half_life=10)
+        for angle in (90, 90, -180):
+            prior.record(angle)
+        self.assertEqual(prior.order([0, 2, -180, 90]), [90, -180, 0, 2])
+
+    def test_old_wins_decay(self):
+        prior = RotationPrior(half_life=1)
+        prior.record(90)
+        prior.record(-90)
+        self.assertEqual(prior.weights(), {90: 0.5, -90: 1})
+
+    def test_weights_are_persisted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'prior.json')
+            prior = RotationPrior(path=path, save_interval=1)
+            prior.record(90)
+            self.assertEqual(RotationPrior(path=path).weights(), {90: 1})
+
+    def test_rotated_image_is_found_at_the_learned_angle(self):
+        image = cv2.rotate(
+            cv2.imread('face/test_images/image_with_1_face.jpg'),
+            cv2.ROTATE_90_CLOCKWISE
+        )
+        prior = RotationPrior()
+        prior.record(90)
+        result = FaceAnalysisAlgorithm.from_array(
+            image, rotation_prior=prior
+        ).face_detection()
+        self.assertEqual(result['number_of_faces_detected'], 1)
+        self.assertEqual(result['rotation_angle'], 90)
+        self.assertEqual(result['search']['rotations_tried'], 1)
+        self.assertEqual(prior.weights()[90], 1 + 0.5 ** (1 / 1000))
+
+    def test_exif_orientation_pins_the_upright_angle_first(self):
+        image = PILImage.new('RGB', (64, 32))
+        exif = image.getexif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        self.assertEqual(plan_decode(buffer.getvalue()).orientation, 6)
+        self.assertIsNone(plan_decode(b'not an image').orientation)
+        algorithm = FaceAnalysisAlgorithm.from_bytes(buffer.getvalue())
+        self.assertEqual(algorithm.orientation_angle, 0)
+        self.assertEqual(algorithm.load_image().shape[:2], (64, 32))
+
+
+class MemoryBudgetTests(SimpleTestCase):
+    def setUp(self):
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            self.image_data = image_file.read()
+
+    def test_reduction_is_chosen_from_the_header(self):
+        plan = plan_decode(self.image_data, None, 9)
+        self.assertEqual((plan.width, plan.height, plan.reduction),
+                         (1500, 1500, 1))
+        plan = plan_decode(self.image_data, 1500 * 1500 * 9 // 3, 9)
+        self.assertEqual(plan.reduction, 2)
+        self.assertEqual(plan.pixels(), 750 * 750)
+        self.assertEqual(plan_decode(self.image_data, 1, 9).reduction, 8)
+        self.assertEqual(plan_decode(b'not an image', 1, 9).pixels(), 0)
+
+    def test_header_above_the_pillow_limit_is_planned(self):
+        data = bytearray(
+            cv2.imencode('.jpg', np.zeros((8, 8, 3), np.uint8))[1]
+        )
+        # The height and width follow the marker, length and precision of
+        # the baseline frame header.
+        start = data.index(b'\xff\xc0') + 5
+        data[start:start + 4] = (13500).to_bytes(2, 'big') * 2
+        max_image_pixels = PILImage.MAX_IMAGE_PIXELS
+        self.assertGreater(13500 * 13500, 2 * max_image_pixels)
+        plan = plan_decode(bytes(data), 256 * 1024 * 1024, 14)
+        self.assertEqual((plan.width, plan.height, plan.reduction),
+                         (None, None, 8))
+        self.assertIsNone(plan.pixels())
+        self.assertEqual(PILImage.MAX_IMAGE_PIXELS, max_image_pixels)
+
+    def test_image_over_budget_is_decoded_reduced(self):
+        algorithm = FaceAnalysisAlgorithm.from_bytes(
+            self.image_data, memory_budget=8 * 1024 * 1024
+        )
+        self.assertEqual(algorithm.load_image().shape, (750, 750, 3))
+        result = algorithm.face_detection()
+        self.assertEqual(result['number_of_faces_detected'], 1)
+        # The boxes and the record describe the encoded image.
+        full = FaceAnalysisAlgorithm.from_bytes(self.image_data)
+        full_box = full.face_detection()['facial_skin'][0]['box']
+        box = result['facial_skin'][0]['box']
+        np.testing.assert_allclose(box, full_box, atol=0.1 * full_box[2])
+        record = algorithm.detection_record()
+        self.assertEqual(record['shape'], [1500, 1500])
+        self.assertEqual(record['faces'][0],
+                         (np.asarray(algorithm.faces[0]) * 2).tolist())
+
+    def test_evicted_rotation_buffers_are_kept_by_their_holders(self):
+        algorithm = FaceAnalysisAlgorithm.from_bytes(self.image_data)
+        held = algorithm.preprocessed_image(1)
+        held_copy = held.copy()
+        for angle in range(2, 30):
+            algorithm.preprocessed_image(angle)
+        self.assertIs(algorithm.preprocessed_image(29),
+                      algorithm.preprocessed_image(29))
+        np.testing.assert_array_equal(held, held_copy)
+
+    def test_large_analyses_wait_for_a_slot(self):
+        limiter = LargeAnalysisLimiter(large_pixels=1000, max_concurrent=1)
+        entered = threading.Event()
+
+        def analyze_large_image():
+            with limiter.slot(None):
+                entered.set()
+
+        with limiter.slot(5000):
+            with limiter.slot(10):
+                pass
+            thread = threading.Thread(target=analyze_large_image)
+            thread.start()
+            self.assertFalse(entered.wait(0.2))
+        self.assertTrue(entered.wait(5))
+        thread.join()
+
+
+class PipelineBenchmarkTests(SimpleTestCase):
+    def test_stages_and_cascade_calls_are_measured(self):
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            result = run_case(image_file.read(), repeat=1)
+        self.assertEqual(result['faces'], 1)
+        self.assertEqual(result['cascade_calls'], 10)
+        self.assertLessEqual(
+            {'decode', 'preprocess', 'cascades', 'dedupe', 'skin', 'encode'},
+            set(result['stages'])
+        )
+        self.assertGreater(result['peak_memory_bytes'], 0)
+        self.assertGreater(result['peak_rss_bytes'], 0)
+
+    def test_slower_case_is_a_regression(self):
+        def case(median, calls):
+            return {'cases': [{
+                'case': 'image', 'faces': 1, 'cascade_calls': calls,
+                'seconds': {'median': median, 'p90': median},
+                'peak_memory_bytes': 100,
+            }]}
+        self.assertFalse(
+            compare(case(1.05, 10), case(1, 10))[0]['regression']
+        )
+        self.assertTrue(compare(case(1.5, 10), case(1, 10))[0]['regression'])
+        self.assertTrue(compare(case(1, 20), case(1, 10))[0]['regression'])
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram(
+            'face_test_seconds', 'Test.', (0.1, 1), ('stage',)
+        )
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, stage='cascades')
+        lines = registry.render().splitlines()
+        self.assertIn(
+            'face_test_seconds_bucket{stage="cascades",le="0.1"} 2', lines
+        )
+        self.assertIn(
+            'face_test_seconds_bucket{stage="cascades",le="+Inf"} 4', lines
+        )
+        self.assertIn('face_test_seconds_count{stage="cascades"} 4', lines)
+
+
+class MetricsViewTests(APITestCase):
+    def test_timings_header_and_metrics_endpoint(self):
+        result_cache().clear()
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            response = self.client.post(
+                reverse('face_analysis'), data={'image': image_file},
+                format='multipart', HTTP_X_FACE_TIMINGS='1'
+            )
+        timings = response.data['timings']
+        self.assertGreater(timings['total'], 0)
+        self.assertLessEqual(
+            {'cache', 'decode', 'cascades', 'skin'},
+            set(timings['stages'])
+        )
+        with open(image_path, 'rb') as image_file:
+            response = self.client.post(
+                reverse('face_analysis'), data={'image': image_file},
+                format='multipart'
+            )
+        self.assertNotIn('timings', response.data)
+        text = self.client.get(reverse('face_metrics')).content.decode()
+        self.assertIn(
+            'face_http_requests_total{view="face_analysis",status="201"}',
+            text
+        )
+        self.assertIn('face_analyses_total{cache="hit"}', text)
+        self.assertIn('face_analysis_stage_seconds_count{stage="cascades"}',
+                      text)
+
+    @override_settings(FACE_METRICS=False)
+    def test_metrics_endpoint_is_disabled(self):
+        response = self.client.get(reverse('face_metrics'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FakeNet:
+    def __init__(self, output):
+        self.output = output
+        self.inputs = []
+
+    def setInput(self, blob):
+        self.inputs.append(blob)
+
+    def forward(self):
+        return self.output
+
+
+class FakeDNNDetector(DNNDetector):
+    output = np.array([[[
+        [0, 1, 0.9, 0.25, 0.25, 0.75, 0.75],
+        [0, 1, 0.2, 0.0, 0.0, 0.5, 0.5],
+        [0, 1, 0.8, 0.9, 0.9, 1.2, 1.2],
+    ]]], dtype=np.float32)
+
+    def load_net(self):
+        self.net = FakeNet(self.output)
+        return self.net
+
+
+class DetectorBackendTests(SimpleTestCase):
+    def setUp(self):
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            self.image_data = image_file.read()
+
+    def test_haar_detector_is_the_default(self):
+        algorithm = FaceAnalysisAlgorithm.from_bytes(
+            self.image_data, strategy=get_strategy('fast')
+        )
+        result = algorithm.face_detection()
+        self.assertEqual(result['search']['detector'], 'haar')
+        self.assertEqual(result['number_of_faces_detected'], 1)
+        self.assertEqual(algorithm.detector.calls_per_image(), 10)
+
+    def test_cascade_file_is_required(self):
+        with self.assertRaises(ValueError):
+            get_detector('lbp', cascade_path='/missing/lbpcascade.xml')
+        with self.assertRaises(ValueError):
+            get_detector('unknown')
+
+    def test_lbp_detector_loads_the_shipped_cascade(self):
+        detector = detector_backend('lbp')
+        self.assertEqual(detector.name, 'lbp')
+        result = FaceAnalysisAlgorithm.from_bytes(
+            self.image_data, strategy=get_strategy('fast'), detector=detector
+        ).face_detection()
+        self.assertEqual(result['search']['detector'], 'lbp')
+        self.assertEqual(result['number_of_faces_detected'], 1)
+
+    def test_single_cascade_detector_runs_one_pass(self):
+        detector = get_detector(
+            'lbp', cascade_path=FaceAnalysisAlgorithm.CASCADE_PATHS[0],
+            parameters=[{'scale_factor': 1.45, 'min_neighbors': 5}]
+        )
+        result = FaceAnalysisAlgorithm.from_bytes(
+            self.image_data, strategy=get_strategy('fast'), detector=detector
+        ).face_detection()
+        self.assertEqual(result['search']['detector'], 'lbp')
+        self.assertEqual(result['search']['cascade_calls'], 1)
+        self.assertEqual(result['number_of_faces_detected'], 1)
+
+    def test_dnn_detections_are_filtered_and_scaled(self):
+        with tempfile.NamedTemporaryFile(suffix='.onnx') as model_file:
+            detector = FakeDNNDetector(model_file.name, min_size_ratio=20)
+            budget = SearchBudget()
+            faces = detector.detect(
+                np.zeros((200, 400), dtype=np.uint8), budget,
+                get_strategy('exhaustive'), None, StageTimer()
+            )
+        self.assertEqual(budget.cascade_calls, 1)
+        self.assertEqual(len(faces), 1)
+        np.testing.assert_array_equal(
+            faces[0], [[100, 50, 200, 100], [360, 180, 40, 20]]
+        )
+        self.assertEqual(
+            detector.configuration()['model_path'],
+            os.path.basename(model_file.name)
+        )
+
+    def test_dnn_detector_is_given_the_color_image(self):
+        with tempfile.NamedTemporaryFile(suffix='.onnx') as model_file:
+            detector = FakeDNNDetector(model_file.name)
+            algorithm = FaceAnalysisAlgorithm.from_bytes(
+                self.image_data, strategy=get_strategy('fast'),
+                detector=detector
+            )
+            result = algorithm.face_detection()
+        expected = cv2.dnn.blobFromImage(
+            rotate(algorithm.detection_image(), result['rotation_angle']),
+            1.0, (300, 300), detector.mean
+        )
+        np.testing.assert_array_equal(detector.net.inputs[0], expected)
+
+
+class DetectorViewTests(APITestCase):
+    def post_image(self, query):
+        image_path = os.path.abspath('face/test_images/image_with_1_face.jpg')
+        with open(image_path, 'rb') as image_file:
+            return self.client.post(
+                reverse('face_analysis') + query, data={'image': image_file},
+                format='multipart'
+            )
+
+    def test_unknown_detector_is_rejected(self):
+        response = self.post_image('?detector=unknown')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('detector', response.data)
+
+    @override_settings(FACE_DNN_MODEL_PATH=None)
+    def test_unconfigured_detector_is_rejected(self):
+        response = self.post_image('?detector=dnn')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('FACE_DNN_MODEL_PATH', response.data['detector'][0])
+
+    def test_analysis_endpoints_check_the_same_parameters(self):
+        for name in ('face_analysis', 'face_analysis_batch',
+                     'face_analysis_video', 'face_analysis_realtime'):
+            for parameter in ('strategy', 'detector'):
+                response = self.client.post(
+                    reverse(name) + '?{}=unknown'.format(parameter)
+                )
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+                self.assertIn(parameter, response.json())
+
+
+class BoundedAnalysisExecutorTests(SimpleTestCase):
+    def test_full_queue_rejects_at_once(self):
+        executor = BoundedAnalysisExecutor(workers=1, max_queue=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        running = executor.submit(release.wait)
+        waiting = executor.submit(lambda: 'done')
+        with self.assertRaises(QueueFull) as raised:
+            executor.submit(lambda: 'rejected')
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(executor.pending(), 2)
+        release.set()
+        running.result(5)
+        self.assertEqual(waiting.result(5), 'done')
+
+    def test_time_limit_only_tightens_the_budget(self):
+        strategy = get_strategy('exhaustive', max_seconds=5)
+        self.assertEqual(strategy.with_time_limit(2).max_seconds, 2)
+        self.assertEqual(strategy.with_time_limit(9).max_seconds, 5)
+        self.assertEqual(strategy.with_time_limit(-1).max_seconds, 0)
+        self.assertEqual(strategy.max_seconds, 5)
+        self.assertTrue(strategy.with_time_limit(0).budget().exhausted())
+
+
+@override_settings(FACE_REALTIME_WORKERS=1, FACE_REALTIME_QUEUE_SIZE=0)
+class RealtimeViewTests(APITestCase):
+    IMAGE_PATH = os.path.abspath('face/test_images/image_with_1_face.jpg')
+
+    def setUp(self):
+        analysis_executor.cache_clear()
+        self.addCleanup(analysis_executor.cache_clear)
+        self.addCleanup(lambda: analysis_executor().shutdown())
+        with open(self.IMAGE_PATH, 'rb') as image_file:
+            self.image_data = image_file.read()
+
+    async def post(self, query=''):
+        upload = io.BytesIO(self.image_data)
+        upload.name = 'image_with_1_face.jpg'
+        return await self.async_client.post(
+            reverse('face_analysis_realtime') + query, {'image': upload}
+        )
+
+    async def test_image_is_analyzed_on_the_executor(self):
+        response = await self.post('?strategy=fast')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.json()
+        self.assertEqual(
+            data['analysis_results']['number_of_faces_detected'], 1
+        )
+        self.assertEqual(await Image.objects.acount(), 1)
+
+    async def test_api_clients_post_without_csrf_token(self):
+        client = AsyncClient(enforce_csrf_checks=True)
+        upload = io.BytesIO(self.image_data)
+        upload.name = 'image_with_1_face.jpg'
+        response = await client.post(
+            reverse('face_analysis_realtime') + '?strategy=fast',
+            {'image': upload}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    async def test_busy_executor_rejects_with_retry_after(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        analysis_executor().submit(release.wait)
+        response = await self.post()
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(await Image.objects.acount(), 0)
+
+    @override_settings(FACE_REALTIME_QUEUE_SIZE=1)
+    async def test_deadline_reached_in_the_queue_is_unavailable(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        analysis_executor().submit(release.wait)
+        threading.Timer(0.3, release.set).start()
+        response = await self.post('?deadline=0.1')
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertIn('Retry-After', response)
+
+    async def test_invalid_deadline_is_rejected(self):
+        response = await self.post('?deadline=-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HammingIndexTests(SimpleTestCase):
+    def test_hashes_within_the_distance_are_found(self):
+        rng = np.random.default_rng(0)
+        hashes = [int(value) for value in rng.integers(
+            -2 ** 63, 2 ** 63, size=2000, dtype=np.int64
+        )]
+        index = HammingIndex(max_distance=3)
+        index.extend(enumerate(hashes[:1500]))
+        for key, value in enumerate(hashes[1500:], 1500):
+            index.add(value, key)
+        self.assertEqual(len(index), 2000)
+        for key in (7, 1600, 1999):
+            self.assertEqual(index.search(hashes[key] ^ 0b1011)[0], (3, key))
+            self.assertNotIn(
+                key, [match for _, match in index.search(
+                    hashes[key] ^ 0b11110
+                )]
+            )
+
+    def test_copies_of_an_image_have_close_hashes(self):
+        image = cv2.imread('face/test_images/image_with_2_faces.jpg')
+        copy = cv2.imdecode(cv2.imencode(
+            '.jpg', cv2.resize(image, None, fx=0.5, fy=0.5),
+            [cv2.IMWRITE_JPEG_QUALITY, 60]
+        )[1], cv2.IMREAD_COLOR)
+        index = HammingIndex(max_distance=4)
+        index.add(perceptual_hash(image), 1)
+        self.assertEqual(len(index.search(perceptual_hash(copy))), 1)
+        other = cv2.imread('face/test_images/image_without_face.jpg')
+        self.assertEqual(index.search(perceptual_hash(other)), [])
+
+
+@override_settings(FACE_NEAR_DUPLICATE_DISTANCE=4)
+class NearDuplicateViewTests(APITestCase):
+    IMAGE_PATH = os.path.abspath('face/test_images/image_with_2_faces.jpg')
+
+    def setUp(self):
+        result_cache().clear()
+        near_duplicate_index.cache_clear()
+        self.addCleanup(near_duplicate_index.cache_clear)
+
+    def post(self, image_data, query=''):
+        upload = io.BytesIO(image_data)
+        upload.name = 'image.jpg'
+        response = self.client.post(
+            reverse('face_analysis') + query, data={'image': upload},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['analysis_results']
+
+    def test_resized_copy_reuses_the_detections(self):
+        with open(self.IMAGE_PATH, 'rb') as image_file:
+            original = self.post(image_file.read())
+        results = self.post(resized_copy(self.IMAGE_PATH))
+        self.assertEqual(results['number_of_faces_detected'],
+                         original['number_of_faces_detected'])
+        self.assertEqual(results['rotation_angle'], original['rotation_angle'])
+        self.assertEqual(results['search']['cascade_calls'], 0)
+        self.assertEqual(results['search']['near_duplicate_of'],
+                         Image.objects.earliest('id').id)
+        first, copy = Image.objects.order_by('id')
+        self.assertEqual(first.detections['shape'], [1344, 1854])
+        np.testing.assert_allclose(
+            np.array(copy.detections['faces']),
+            np.array(first.detections['faces']) * 0.6, atol=1
+        )
+
+    def test_other_configuration_searches_again(self):
+        with open(self.IMAGE_PATH, 'rb') as image_file:
+            self.post(image_file.read())
+        results = self.post(resized_copy(self.IMAGE_PATH), '?strategy=fast')
+        self.assertNotIn('near_duplicate_of', results['search'])
+        self.assertGreater(results['search']['cascade_calls'], 0)
+
+
+class AnalyzeFacesCommandTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'results.jsonl')
+
+    def analyze(self, *args):
+        call_command(
+            'analyze_faces', 'face/test_images', '--output', self.output,
+            '--workers', '2', '--chunk-size', '2', '--strategy', 'fast',
+            *args, stdout=io.StringIO(), stderr=io.StringIO()
+        )
+        with open(self.output) as output:
+            return [json.loads(line) for line in output]
+
+    def test_directory_is_analyzed_and_saved(self):
+        records = self.analyze('--save')
+        self.assertEqual(
+            sorted(os.path.basename(record['path']) for record in records),
+            sorted(os.listdir('face/test_images'))
+        )
+        faces = {
+            os.path.basename(record['path']):
+            record['analysis_results']['number_of_faces_detected']
+            for record in records
         }
-        result = self.client.post(url, data=image_data, format='multipart')
-        content = result.data
-        self.assertEqual(result.status_code, status.HTTP_201_CREATED)
-        self.assertGreater(len(content['image']), 0)
+        self.assertEqual(faces['image_without_face.jpg'], 0)
+        self.assertNotIn('detections', records[0])
+        self.assertEqual(Image.objects.filter(status=Image.DONE).count(), 3)
+        self.assertTrue(Image.objects.exclude(detections=None).exists())
+        self.assertEqual(Face.objects.count(), sum(faces.values()))
+
+    def test_second_run_resumes_from_the_checkpoint(self):
+        self.analyze()
+        self.assertEqual(len(self.analyze()), 3)
+
+
+class FaceResultsViewTests(APITestCase):
+    def setUp(self):
+        result_cache().clear()
+        for name in ('image_with_1_face.jpg', 'image_with_2_faces.jpg'):
+            with open(os.path.join('face/test_images', name), 'rb') as image:
+                response = self.client.post(
+                    reverse('face_analysis'), data={'image': image},
+                    format='multipart'
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def list_results(self, query=''):
+        response = self.client.get(reverse('face_analysis_list') + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_faces_are_stored_compactly(self):
+        self.assertEqual(pack_box([1, 2, 65535, 4]) >> 48, 1)
+        self.assertEqual(unpack_box(pack_box([1, 2, 65535, 4])),
+                         [1, 2, 65535, 4])
+        image = Image.objects.get(number_of_faces=1)
+        face = image.faces.get()
+        skin = image.analysis_results['facial_skin'][0]
+        self.assertEqual(face.unpacked_box(), skin['box'])
+        self.assertEqual(face.skin_brightness, skin['skin_brightness'])
+        self.assertEqual(face.get_skin_info_display(), skin['skin_info'])
+        self.assertEqual(str(image), image.image.name)
+
+    def test_results_are_filtered(self):
+        results = self.list_results('?skin_info=light skin')['results']
+        self.assertEqual([image['number_of_faces'] for image in results], [2])
         self.assertEqual(
-            content['analysis_results'],
-            {"Number of faces detected": 0}
+            [face['skin_info'] for face in results[0]['faces']],
+            ['dark skin', 'light skin']
         )
+        self.assertEqual(
+            len(self.list_results('?min_faces=1&skin_info=dark skin')
+                ['results']), 2
+        )
+        self.assertEqual(self.list_results('?min_faces=3')['results'], [])
+
+    def test_pages_follow_the_last_identifier(self):
+        first = self.list_results('?limit=1')
+        self.assertEqual(len(first['results']), 1)
+        second = self.client.get(first['next']).data
+        self.assertGreater(second['results'][0]['id'],
+                           first['results'][0]['id'])
+        self.assertIsNone(second['next'])
+
+    def test_invalid_parameters_are_rejected(self):
+        for query in ('?skin_info=blue', '?min_faces=-1', '?after=x'):
+            response = self.client.get(reverse('face_analysis_list') + query)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
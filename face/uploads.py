@@ -0,0 +1,151 @@
+import logging
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+from .models import Image
+
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PERSISTENCE = ('sync', 'deferred', 'none')
+
+
+@contextmanager
+def upload_buffer(uploaded_file):
+    """
+    Context manager giving access to the content of an upload without
+    copying it.
+
+    An upload Django kept in memory is exposed as a memoryview of its
+    buffer, an upload Django spooled to a temporary file is mapped in memory
+    read-only. The buffer is only valid within the context, and must not be
+    referenced by any object living longer.
+
+    Keyword arguments:
+    uploaded_file (UploadedFile): The uploaded file.
+
+    Returns:
+    contextmanager -- Context yielding a buffer-like object.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        with open(uploaded_file.temporary_file_path(), 'rb') as upload:
+            with mmap.mmap(upload.fileno(), 0,
+                           access=mmap.ACCESS_READ) as buffer:
+                yield buffer
+        return
+    if hasattr(uploaded_file.file, 'getbuffer'):
+        with uploaded_file.file.getbuffer() as buffer:
+            yield buffer
+        return
+    uploaded_file.seek(0)
+    yield uploaded_file.read()
+
+
+def analyze_upload(image, uploaded_file, persistence='sync', timer=None,
+                   deadline=None):
+    """
+    Function that analyzes an image from its upload buffer, then saves it
+    as set by the persistence mode.
+
+    Keyword arguments:
+    image (Image): The unsaved image, its image field holding the upload.
+    uploaded_file (UploadedFile): The uploaded file.
+    persistence (str): 'sync', 'deferred' or 'none'.
+    timer (StageTimer): Optional timer of the stages of the analysis.
+    deadline (float): Optional time.perf_counter() value stopping the
+    rotation search.
+
+    Returns:
+    Image -- The saved image, holding the results or the error.
+    """
+    with upload_buffer(uploaded_file) as image_data:
+        image.record_analysis(image_data, timer, deadline)
+    persist_upload(image, uploaded_file, persistence)
+    return image
+
+
+def persist_upload(image, uploaded_file, persistence='sync'):
+    """
+    Function that saves an image analyzed from its upload buffer.
+
+    With 'sync', the upload is written through the storage while the row is
+    saved, a temporary upload file being moved rather than copied. With
+    'deferred', the name of the file is reserved and the row saved at once,
+    the upload being written by a background thread. With 'none', only the
+    results are saved and the row has no image file.
+
+    Keyword arguments:
+    image (Image): The unsaved image, its image field holding the upload.
+    uploaded_file (UploadedFile): The uploaded file.
+    persistence (str): 'sync', 'deferred' or 'none'.
+
+    Returns:
+    concurrent.futures.Future -- The background write returning the stored
+    name, None unless the persistence is deferred.
+    """
+    if persistence not in UPLOAD_PERSISTENCE:
+        raise ValueError('Unknown upload persistence: ' + str(persistence))
+    if persistence == 'sync':
+        image.save()
+        return None
+    if persistence == 'none':
+        image.image = ''
+        image.save()
+        return None
+    name = default_storage.get_available_name(
+        image.image.field.generate_filename(image, uploaded_file.name)
+    )
+    # The upload is closed with the request, its content is copied for the
+    # background thread.
+    with upload_buffer(uploaded_file) as buffer:
+        content = bytes(buffer)
+    image.image = name
+    image.save()
+    return upload_executor().submit(store_upload, image.pk, name, content)
+
+
+def store_upload(image_id, name, content):
+    """
+    Function that writes an upload whose row was saved with a reserved
+    name.
+
+    When another file took the name in the meantime, the storage picks
+    another name and the row is updated.
+
+    Keyword arguments:
+    image_id (int): Identifier of the image.
+    name (str): Reserved name of the file.
+    content (bytes): The encoded image.
+
+    Returns:
+    str -- The name of the stored file, None when the write failed.
+    """
+    try:
+        stored_name = default_storage.save(name, ContentFile(content))
+    except Exception:
+        logger.exception('Unable to store the upload of image %s', image_id)
+        return None
+    if stored_name != name:
+        try:
+            Image.objects.filter(pk=image_id).update(image=stored_name)
+        finally:
+            close_old_connections()
+    return stored_name
+
+
+@lru_cache(maxsize=None)
+def upload_executor():
+    """
+    Function returning the thread writing the deferred uploads of the
+    process.
+
+    Returns:
+    ThreadPoolExecutor -- Executor with a single worker.
+    """
+    return ThreadPoolExecutor(1, thread_name_prefix='face-upload')
@@ -3,4 +3,15 @@ from . import views
 
 urlpatterns = [
     path('face', views.face_analysis, name='face_analysis'),
+    path('face/batch', views.face_analysis_batch,
+         name='face_analysis_batch'),
+    path('face/video', views.face_analysis_video,
+         name='face_analysis_video'),
+    path('face/realtime', views.face_analysis_realtime,
+         name='face_analysis_realtime'),
+    path('face/results', views.face_analysis_list,
+         name='face_analysis_list'),
+    path('face/<int:pk>', views.face_analysis_detail,
+         name='face_analysis_detail'),
+    path('metrics', views.face_metrics, name='face_metrics'),
 ]
@@ -0,0 +1,339 @@
+import itertools
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from .face_analysis_algorithm import FaceAnalysisAlgorithm
+from .rectangles import iou_matrix
+from .rotation import back_project
+from .search_strategies import SearchBudget
+from .skin_analysis import skin_analysis, skin_type
+
+
+class FaceTrack:
+    """
+    Class following one face across the frames of a video.
+
+    Attributes:
+    track_id (int): Identifier of the track in the video.
+    box (tuple): Last rectangle (x, y, w, h) of the face.
+    first_frame (int): Index of the first frame showing the face.
+    last_frame (int): Index of the last frame showing the face.
+    brightness (list): Facial skin brightness measured in each frame.
+
+    Methods:
+    update(frame_index, box, brightness): Records the face in a frame.
+    summary(): Returns the aggregate skin statistics of the face.
+    """
+
+    def __init__(self, track_id, frame_index, box, brightness):
+        """
+        Initializes a FaceTrack object.
+
+        Keyword arguments:
+        track_id (int): Identifier of the track in the video.
+        frame_index (int): Index of the first frame showing the face.
+        box (tuple): Rectangle (x, y, w, h) of the face.
+        brightness (float): Facial skin brightness in the frame.
+        """
+        self.track_id = track_id
+        self.box = box
+        self.first_frame = frame_index
+        self.last_frame = frame_index
+        self.brightness = [brightness]
+
+    def update(self, frame_index, box, brightness):
+        """
+        Method that records the face in a new frame.
+
+        Keyword arguments:
+        frame_index (int): Index of the frame.
+        box (tuple): Rectangle (x, y, w, h) of the face.
+        brightness (float): Facial skin brightness in the frame.
+        """
+        self.box = box
+        self.last_frame = frame_index
+        self.brightness.append(brightness)
+
+    def summary(self):
+        """
+        Method that returns the aggregate skin statistics of the face.
+
+        Returns:
+        dict -- The frames of the track and the mean, median, minimum and
+        maximum of the facial skin brightness, the skin information being
+        derived from the median.
+        """
+        median = round(float(np.median(self.brightness)), 2)
+        return {
+            'track': self.track_id,
+            'first_frame': self.first_frame,
+            'last_frame': self.last_frame,
+            'frames': len(self.brightness),
+            'skin_brightness': {
+                'mean': round(float(np.mean(self.brightness)), 2),
+                'median': median,
+                'min': round(float(min(self.brightness)), 2),
+                'max': round(float(max(self.brightness)), 2),
+            },
+            'skin_info': skin_type(median),
+        }
+
+
+class VideoFaceAnalyzer:
+    """
+    Class analyzing the faces of a sequence of frames.
+
+    The full rotation search only runs on keyframes, one frame out of
+    keyframe_interval. In the frames between two keyframes, each tracked
+    face is searched again in a region around its previous rectangle, at
+    the angle of the last keyframe, which costs a few cascade calls on a
+    small region instead of the whole search. A face that is not found
+    again ends its track, and the faces of a keyframe continue the tracks
+    they overlap.
+
+    Attributes:
+    keyframe_interval (int): Number of frames between two full detections.
+    tracking_padding (float): Margin of the tracking regions, relative to
+    the rectangles.
+    match_threshold (float): Intersection over union above which a
+    keyframe detection continues a track.
+    options (dict): Options of the FaceAnalysisAlgorithm of the keyframes.
+    rotation (int): Angle of the last keyframe with faces.
+    tracks (list): Every track of the video.
+
+    Methods:
+    analyze(frames): Analyzes the frames one after another.
+    summary(): Returns the aggregate skin statistics of every track.
+    """
+
+    def __init__(self, keyframe_interval=15, tracking_padding=0.5,
+                 match_threshold=0.3, **options):
+        """
+        Initializes a VideoFaceAnalyzer object.
+
+        Keyword arguments:
+        keyframe_interval (int): Number of frames between two full
+        detections.
+        tracking_padding (float): Margin of the tracking regions, relative
+        to the rectangles.
+        match_threshold (float): Intersection over union above which a
+        keyframe detection continues a track.
+        options: Options of FaceAnalysisAlgorithm, such as strategy or
+        max_dimension.
+        """
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.tracking_padding = tracking_padding
+        self.match_threshold = match_threshold
+        self.options = options
+        self.rotation = None
+        self.tracks = []
+        self._active = []
+
+    def analyze(self, frames):
+        """
+        Generator that analyzes the frames one after another.
+
+        Keyword arguments:
+        frames -- Iterable of BGR images, such as read_video_frames().
+
+        Yields:
+        dict -- The result of each frame: its index, whether it is a
+        keyframe, the angle of the rectangles and, for each face, its track,
+        its box in the frame and its facial skin.
+        """
+        for frame_index, frame in enumerate(frames):
+            algorithm = FaceAnalysisAlgorithm.from_array(frame, **self.options)
+            keyframe = frame_index % self.keyframe_interval == 0
+            if keyframe:
+                algorithm.face_detection()
+                faces = [tuple(face) for face in algorithm.faces]
+                if algorithm.rotation != self.rotation:
+                    self._active = []
+                self.rotation = algorithm.rotation
+            elif self._active:
+                found_faces = algorithm.redetect_faces(
+                    self.rotation, [track.box for track in self._active],
+                    SearchBudget(), self.tracking_padding
+                )
+                faces = [face for face in found_faces if face is not None]
+            else:
+                found_faces = faces = []
+            # The skin is sampled as in FaceAnalysisAlgorithm.face_detection(),
+            # the rectangles being in the frame rotated by the angle.
+            skins = skin_analysis(
+                faces, algorithm.skin_plane(self.rotation),
+                algorithm.skin_patch_radius
+            )
+            boxes = back_project(faces, frame.shape, self.rotation)
+            if keyframe:
+                tracks = self.__match_tracks(frame_index, faces, skins)
+            else:
+                tracks = self.__follow_tracks(frame_index, found_faces, skins)
+            yield {
+                'frame': frame_index,
+                'keyframe': keyframe,
+                'rotation': self.rotation if faces else None,
+                'faces': [
+                    dict(skin, track=track.track_id, box=box)
+                    for track, box, skin in zip(tracks, boxes.tolist(), skins)
+                ],
+            }
+
+    def summary(self):
+        """
+        Method that returns the aggregate skin statistics of every track.
+
+        Returns:
+        list -- FaceTrack.summary() of each track, in order of appearance.
+        """
+        return [track.summary() for track in self.tracks]
+
+    def __match_tracks(self, frame_index, faces, skins):
+        """
+        Method that assigns the faces of a keyframe to the active tracks
+        they overlap the most, the other faces starting new tracks.
+        """
+        tracks = [None] * len(faces)
+        if self._active and faces:
+            boxes = np.array(
+                [track.box for track in self._active] + faces, dtype=np.int64
+            )
+            overlaps = iou_matrix(boxes)[:len(self._active),
+                                         len(self._active):]
+            for _ in range(min(overlaps.shape)):
+                row, column = np.unravel_index(
+                    np.argmax(overlaps), overlaps.shape
+                )
+                if overlaps[row, column] <= self.match_threshold:
+                    break
+                tracks[column] = self._active[row]
+                overlaps[row, :] = overlaps[:, column] = -1
+        for index, (face, skin) in enumerate(zip(faces, skins)):
+            if tracks[index] is None:
+                tracks[index] = FaceTrack(
+                    len(self.tracks), frame_index, face,
+                    skin['skin_brightness']
+                )
+                self.tracks.append(tracks[index])
+            else:
+                tracks[index].update(
+                    frame_index, face, skin['skin_brightness']
+                )
+        self._active = tracks
+        return tracks
+
+    def __follow_tracks(self, frame_index, found_faces, skins):
+        """
+        Method that updates the active tracks with the faces found again,
+        the tracks of the faces not found being ended.
+        """
+        tracks = [track for track, face in zip(self._active, found_faces)
+                  if face is not None]
+        faces = [face for face in found_faces if face is not None]
+        for track, face, skin in zip(tracks, faces, skins):
+            track.update(frame_index, face, skin['skin_brightness'])
+        self._active = tracks
+        return tracks
+
+
+def read_video_frames(path, max_frames=None):
+    """
+    Generator that reads the frames of a video file.
+
+    Keyword arguments:
+    path (str): The file path of the video.
+    max_frames (int): Maximum number of frames read, every frame when None.
+
+    Yields:
+    numpy.ndarray -- The BGR frames.
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError('Unable to read the video ' + path)
+        frame_count = 0
+        while max_frames is None or frame_count < max_frames:
+            read, frame = capture.read()
+            if not read:
+                break
+            frame_count += 1
+            yield frame
+    finally:
+        capture.release()
+
+
+def read_image_sequence(paths):
+    """
+    Generator that reads a sequence of image files as frames.
+
+    Keyword arguments:
+    paths (list): The file paths of the images, in order.
+
+    Yields:
+    numpy.ndarray -- The BGR frames.
+    """
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            raise ValueError('Unable to read the image ' + path)
+        yield frame
+
+
+def analyze_uploaded_video(uploaded_file, analyzer, max_frames=None):
+    """
+    Function that opens an uploaded video file for its analysis.
+
+    The upload is read from its temporary file when Django stored it on
+    disk, otherwise it is copied to a temporary file for cv2.VideoCapture.
+    The video is opened and its first frame read before returning, so that
+    an unreadable upload raises ValueError before any result is streamed.
+
+    Keyword arguments:
+    uploaded_file (UploadedFile): The uploaded video.
+    analyzer (VideoFaceAnalyzer): The analyzer of the frames.
+    max_frames (int): Maximum number of frames analyzed.
+
+    Returns:
+    generator -- The result of each frame, then the aggregate statistics of
+    the tracks under the 'tracks' key.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        path, temporary = uploaded_file.temporary_file_path(), None
+    else:
+        _, extension = os.path.splitext(uploaded_file.name)
+        temporary = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
+        with temporary:
+            for chunk in uploaded_file.chunks():
+                temporary.write(chunk)
+        path = temporary.name
+    frames = read_video_frames(path, max_frames)
+    try:
+        first_frame = next(frames, None)
+        if first_frame is None:
+            raise ValueError('The video has no frame')
+    except BaseException:
+        frames.close()
+        if temporary is not None:
+            os.remove(temporary.name)
+        raise
+    return _analyze_frames(
+        analyzer, first_frame, frames,
+        None if temporary is None else temporary.name
+    )
+
+
+def _analyze_frames(analyzer, first_frame, frames, temporary_path):
+    """
+    Generator that analyzes the frames of an opened video, then removes its
+    temporary file.
+    """
+    try:
+        yield from analyzer.analyze(itertools.chain([first_frame], frames))
+        yield {'tracks': analyzer.summary()}
+    finally:
+        frames.close()
+        if temporary_path is not None:
+            os.remove(temporary_path)
@@ -1,15 +1,67 @@
+import asyncio
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import (Http404, HttpResponse, HttpResponseNotAllowed,
+                         JsonResponse, StreamingHttpResponse)
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from .serializers import ImageSerializer
+from . import metrics
+from .admission import DeadlineExceeded, QueueFull, analysis_executor
+from .batch import (BatchTooLarge, analyze_batch, create_batch,
+                    ndjson_lines, read_batch)
+from .jobs import worker_pool
+from .models import Face, Image, analysis_options, detector_backend
+from .profiling import StageTimer
+from .search_strategies import STRATEGIES
+from .serializers import (ImageJobSerializer, ImageResultSerializer,
+                          ImageSerializer)
+from .uploads import analyze_upload, persist_upload, upload_buffer
+from .video import VideoFaceAnalyzer, analyze_uploaded_video
+
+
+def counted(view):
+    """
+    Decorator counting the responses of a view by status code in the
+    face_http_requests_total metric, when FACE_METRICS is enabled. The
+    coroutine views stay coroutines.
+    """
+    def count(response):
+        if getattr(settings, 'FACE_METRICS', True):
+            metrics.requests_total.inc(
+                view=view.__name__, status=response.status_code
+            )
+        return response
+
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def counted_coroutine_view(request, *args, **kwargs):
+            return count(await view(request, *args, **kwargs))
+        return counted_coroutine_view
+
+    @wraps(view)
+    def counted_view(request, *args, **kwargs):
+        return count(view(request, *args, **kwargs))
+    return counted_view
 
 
 @api_view(['POST'])
+@counted
 def face_analysis(request):
     """
     View that enables image reception and recording
 
+    A synchronous analysis decodes the upload from the buffer Django
+    received it in, the upload being stored afterwards, in the background
+    or not at all as set by FACE_UPLOAD_PERSISTENCE.
+
     Keyword arguments:
     request -- (django.http.HttpRequest) The HttpRequest object containing all
     information about HTTP request.
@@ -17,12 +69,475 @@ def face_analysis(request):
     Returns:
     django.http.HttpResponse -- An HttpResponse object representing the view
     response
+
+    Query parameters:
+    strategy -- Optional rotation search strategy: exhaustive,
+    coarse_to_fine or fast.
+    detector -- Optional face detector backend: haar, lbp or dnn, the
+    FACE_DETECTOR setting by default.
+    async -- With 1, the image is queued and the view answers 202 with the
+    URL of the job instead of waiting for the analysis.
+    annotate -- With 1, a copy of the image with the faces framed is stored
+    and its URL returned in annotated_image.
+
+    Headers:
+    X-Face-Timings -- With 1, the response includes the duration of the
+    analysis and of each of its stages in timings. The header name is set
+    by FACE_TIMINGS_HEADER.
     """
+    strategy, detector, error_response = _search_options(
+        request.query_params
+    )
+    if error_response is not None:
+        return error_response
     serializer = ImageSerializer(data=request.data)
     if serializer.is_valid():
-        image = serializer.save()
-        analysis_results = image.analyze()
-        data = serializer.data
+        annotate = _flag(request, 'annotate')
+        if _flag(request, 'async'):
+            image = serializer.save(
+                strategy=strategy or '', detector=detector or '',
+                annotate=annotate
+            )
+            pool = worker_pool()
+            if pool is not None:
+                pool.submit()
+            data = serializer.data
+            data.update({
+                'id': image.id,
+                'status': image.status,
+                'url': reverse('face_analysis_detail', args=[image.id]),
+            })
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+        upload = serializer.validated_data['image']
+        image = Image(
+            image=upload, strategy=strategy or '', detector=detector or '',
+            annotate=annotate
+        )
+        timer = None
+        timings_header = getattr(
+            settings, 'FACE_TIMINGS_HEADER', 'X-Face-Timings'
+        )
+        if request.headers.get(timings_header) in ('1', 'true'):
+            timer = StageTimer()
+        start = time.perf_counter()
+        analyze_upload(
+            image, upload,
+            getattr(settings, 'FACE_UPLOAD_PERSISTENCE', 'sync'), timer
+        )
+        analysis_results = image.analysis_results
+        if image.status == Image.FAILED:
+            return Response(
+                {'error': image.error},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        data = ImageSerializer(image).data
         data['analysis_results'] = analysis_results
+        if image.annotated_image:
+            data['annotated_image'] = image.annotated_image.url
+        if timer is not None:
+            data['timings'] = {
+                'total': time.perf_counter() - start,
+                'stages': timer.timings(),
+            }
         return Response(data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['POST'])
+@counted
+def face_analysis_batch(request):
+    """
+    View that analyzes a batch of images and streams the results
+
+    Keyword arguments:
+    request -- (django.http.HttpRequest) The HttpRequest object containing all
+    information about HTTP request.
+
+    Returns:
+    django.http.StreamingHttpResponse -- Newline-delimited JSON with one
+    line per image, written as soon as its analysis is done
+
+    Query parameters:
+    strategy -- Optional rotation search strategy: exhaustive,
+    coarse_to_fine or fast.
+    detector -- Optional face detector backend: haar, lbp or dnn, the
+    FACE_DETECTOR setting by default.
+    annotate -- With 1, a copy of each image with the faces framed is
+    stored.
+    """
+    strategy, detector, error_response = _search_options(
+        request.query_params
+    )
+    if error_response is not None:
+        return error_response
+    files = request.FILES.getlist('images')
+    if not files:
+        return Response(
+            {'images': ['No file was submitted.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        images = read_batch(
+            files,
+            getattr(settings, 'FACE_BATCH_MAX_FILES', 100),
+            getattr(settings, 'FACE_BATCH_MAX_BYTES', 100 * 1024 * 1024)
+        )
+    except BatchTooLarge as exception:
+        return Response(
+            {'images': [str(exception)]},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    rows = create_batch(images, strategy or '', _flag(request, 'annotate'),
+                        detector or '')
+    outcomes = analyze_batch(
+        rows, images, getattr(settings, 'FACE_BATCH_WORKERS', None)
+    )
+    return StreamingHttpResponse(
+        ndjson_lines(outcomes), content_type='application/x-ndjson'
+    )
+
+
+@api_view(['POST'])
+@counted
+def face_analysis_video(request):
+    """
+    View that analyzes the faces of a video and streams the results
+
+    The full detection only runs on keyframes, the faces being tracked in
+    the frames between them.
+
+    Keyword arguments:
+    request -- (django.http.HttpRequest) The HttpRequest object containing all
+    information about HTTP request.
+
+    Returns:
+    django.http.StreamingHttpResponse -- Newline-delimited JSON with one
+    line per frame, then a line with the skin statistics of each tracked
+    face
+
+    Query parameters:
+    strategy -- Optional rotation search strategy of the keyframes:
+    exhaustive, coarse_to_fine or fast.
+    detector -- Optional face detector backend of the keyframes: haar, lbp
+    or dnn, the FACE_DETECTOR setting by default.
+    """
+    strategy, detector, error_response = _search_options(
+        request.query_params, default_strategy=getattr(
+            settings, 'FACE_VIDEO_SEARCH_STRATEGY', 'fast'
+        )
+    )
+    if error_response is not None:
+        return error_response
+    video = request.FILES.get('video')
+    if video is None:
+        return Response(
+            {'video': ['No file was submitted.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    options = analysis_options(strategy, detector)
+    options['max_dimension'] = getattr(
+        settings, 'FACE_VIDEO_MAX_DIMENSION', 640
+    )
+    # The frames are decoded by the video reader.
+    del options['memory_budget']
+    analyzer = VideoFaceAnalyzer(
+        getattr(settings, 'FACE_VIDEO_KEYFRAME_INTERVAL', 15), **options
+    )
+    try:
+        results = analyze_uploaded_video(
+            video, analyzer, getattr(settings, 'FACE_VIDEO_MAX_FRAMES', None)
+        )
+    except ValueError:
+        return Response(
+            {'video': ['Unable to read the video.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return StreamingHttpResponse(
+        ndjson_lines(results), content_type='application/x-ndjson'
+    )
+
+
+@api_view(['GET'])
+@counted
+def face_analysis_detail(request, pk):
+    """
+    View that returns the status and the results of an analysis
+
+    Keyword arguments:
+    request -- (django.http.HttpRequest) The HttpRequest object containing all
+    information about HTTP request.
+    pk (int): Identifier of the analyzed image.
+
+    Returns:
+    django.http.HttpResponse -- An HttpResponse object with the status, the
+    results or the error and the timestamps of the analysis
+    """
+    image = get_object_or_404(Image, pk=pk)
+    return Response(ImageJobSerializer(image).data)
+
+
+@api_view(['GET'])
+@counted
+def face_analysis_list(request):
+    """
+    View that lists the stored results of the analyses, read from the Face
+    table
+
+    The images are listed in order of their identifier, one page at a time:
+    the next page starts after the last image of the page, found through
+    the primary key index instead of skipping the previous rows.
+
+    Keyword arguments:
+    request -- (django.http.HttpRequest) The HttpRequest object containing all
+    information about HTTP request.
+
+    Returns:
+    django.http.HttpResponse -- An HttpResponse object with the results of
+    the page and the URL of the next page, None on the last page
+
+    Query parameters:
+    skin_info -- Optional skin type of at least one face of the images:
+    dark skin, matte skin, light skin or no skin.
+    min_faces -- Optional minimum number of faces of the images.
+    after -- Optional identifier after which the page starts.
+    limit -- Optional number of images of the page,
+    FACE_RESULTS_PAGE_SIZE by default and FACE_RESULTS_MAX_PAGE_SIZE at
+    most.
+    """
+    images = Image.objects.filter(status=Image.DONE)
+    skin_info = request.query_params.get('skin_info')
+    if skin_info is not None:
+        if skin_info not in Face.SkinInfo.labels:
+            expected = 'Expected one of: ' + ', '.join(Face.SkinInfo.labels)
+            return Response(
+                {'skin_info': [expected]}, status=status.HTTP_400_BAD_REQUEST
+            )
+        images = images.filter(Exists(Face.objects.filter(
+            image=OuterRef('pk'), skin_info=Face.skin_info_value(skin_info)
+        )))
+    limit = getattr(settings, 'FACE_RESULTS_PAGE_SIZE', 100)
+    parameters = {}
+    for name in ('min_faces', 'after', 'limit'):
+        value = request.query_params.get(name)
+        if value is None:
+            continue
+        if not value.isdigit():
+            return Response(
+                {name: ['Expected a non-negative integer.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        parameters[name] = int(value)
+    if 'min_faces' in parameters:
+        images = images.filter(number_of_faces__gte=parameters['min_faces'])
+    if 'after' in parameters:
+        images = images.filter(pk__gt=parameters['after'])
+    limit = max(1, min(
+        parameters.get('limit', limit),
+        getattr(settings, 'FACE_RESULTS_MAX_PAGE_SIZE', 1000)
+    ))
+    # One more image tells whether there is a next page.
+    page = list(images.order_by('pk').prefetch_related(
+        Prefetch('faces', queryset=Face.objects.order_by('pk'))
+    )[:limit + 1])
+    next_url = None
+    if len(page) > limit:
+        page = page[:limit]
+        query = request.query_params.copy()
+        query['after'] = page[-1].pk
+        next_url = reverse('face_analysis_list') + '?' + query.urlencode()
+    return Response({
+        'results': ImageResultSerializer(page, many=True).data,
+        'next': next_url,
+    })
+
+
+@counted
+async def face_analysis_realtime(request):
+    """
+    View that analyzes an image on a bounded executor, answering at once
+    when the server is overloaded
+
+    The view runs on the event loop of an ASGI server. The analysis runs on
+    one of the FACE_REALTIME_WORKERS threads, at most
+    FACE_REALTIME_QUEUE_SIZE analyses waiting for a thread. The request
+    deadline stops the rotation search, the results then reporting an
+    exhausted budget.
+
+    Keyword arguments:
+    request -- (django.http.HttpRequest) The HttpRequest object containing all
+    information about HTTP request.
+
+    Returns:
+    django.http.JsonResponse -- 201 with the analysis results, 429 when the
+    queue is full and 503 when the analysis cannot start before the
+    deadline, both with a Retry-After header
+
+    Query parameters:
+    strategy -- Optional rotation search strategy: exhaustive,
+    coarse_to_fine or fast.
+    detector -- Optional face detector backend: haar, lbp or dnn, the
+    FACE_DETECTOR setting by default.
+    deadline -- Optional seconds the client waits for, at most
+    FACE_REALTIME_DEADLINE_SECONDS.
+    annotate -- With 1, a copy of the image with the faces framed is stored
+    and its URL returned in annotated_image.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    strategy, detector, error_response = _search_options(
+        request.GET, JsonResponse
+    )
+    if error_response is not None:
+        return error_response
+    seconds = getattr(settings, 'FACE_REALTIME_DEADLINE_SECONDS', 10)
+    try:
+        seconds = min(seconds, float(request.GET.get('deadline', seconds)))
+    except ValueError:
+        seconds = 0
+    if not seconds > 0:
+        return JsonResponse(
+            {'deadline': ['Expected a positive number of seconds.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    deadline = time.perf_counter() + seconds
+    serializer = ImageSerializer(data=request.FILES)
+    if not serializer.is_valid():
+        return JsonResponse(
+            serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+    upload = serializer.validated_data['image']
+    image = Image(
+        image=upload, strategy=strategy or '', detector=detector or '',
+        annotate=request.GET.get('annotate') in ('1', 'true')
+    )
+    executor = analysis_executor()
+    if executor.expected_wait() >= seconds:
+        return _overloaded(
+            status.HTTP_503_SERVICE_UNAVAILABLE, executor.retry_after(),
+            'The analysis cannot start before the deadline.'
+        )
+    try:
+        future = executor.submit(_record_analysis, image, upload, deadline)
+    except QueueFull as exception:
+        return _overloaded(
+            status.HTTP_429_TOO_MANY_REQUESTS, exception.retry_after,
+            str(exception) + '.'
+        )
+    try:
+        await asyncio.wrap_future(future)
+    except DeadlineExceeded:
+        return _overloaded(
+            status.HTTP_503_SERVICE_UNAVAILABLE, executor.retry_after(),
+            'The deadline was reached before the analysis started.'
+        )
+    await sync_to_async(persist_upload)(
+        image, upload, getattr(settings, 'FACE_UPLOAD_PERSISTENCE', 'sync')
+    )
+    if image.status == Image.FAILED:
+        return JsonResponse(
+            {'error': image.error},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    data = ImageSerializer(image).data
+    data['analysis_results'] = image.analysis_results
+    if image.annotated_image:
+        data['annotated_image'] = image.annotated_image.url
+    return JsonResponse(data, status=status.HTTP_201_CREATED)
+
+
+# API clients post without a CSRF token, as to the DRF views. The attribute
+# read by CsrfViewMiddleware is set directly: the csrf_exempt decorator of
+# Django 4.2 would turn the coroutine view into a synchronous one.
+face_analysis_realtime.csrf_exempt = True
+
+
+def face_metrics(request):
+    """
+    View that exposes the metrics of the process in the Prometheus text
+    format
+
+    Keyword arguments:
+    request -- (django.http.HttpRequest) The HttpRequest object containing all
+    information about HTTP request.
+
+    Returns:
+    django.http.HttpResponse -- The counters and histograms of the requests
+    and analyses of the process, 404 when FACE_METRICS is disabled
+    """
+    if not getattr(settings, 'FACE_METRICS', True):
+        raise Http404('Metrics are disabled')
+    return HttpResponse(
+        metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def _record_analysis(image, upload, deadline):
+    """
+    Function analyzing an upload on a thread of the bounded executor,
+    unless the deadline of its request was reached while it waited.
+    """
+    if time.perf_counter() >= deadline:
+        raise DeadlineExceeded()
+    with upload_buffer(upload) as image_data:
+        image.record_analysis(image_data, deadline=deadline)
+
+
+def _overloaded(status_code, retry_after, message):
+    """
+    Function that returns the response rejecting a request of an overloaded
+    server.
+
+    Keyword arguments:
+    status_code (int): 429 or 503.
+    retry_after (int): Seconds after which the client may retry.
+    message (str): Description of the rejection.
+
+    Returns:
+    django.http.JsonResponse -- The response, with a Retry-After header.
+    """
+    response = JsonResponse({'error': message}, status=status_code)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _search_options(params, response_class=Response, default_strategy=None):
+    """
+    Function that reads the strategy and detector query parameters of the
+    analysis views, checking that the strategy exists and that the
+    detector backend can be used.
+
+    Keyword arguments:
+    params (QueryDict): The query parameters of the request.
+    response_class (type): Class of the error response, Response or
+    JsonResponse.
+    default_strategy (str): Strategy when none is given, None for the
+    FACE_SEARCH_STRATEGY setting.
+
+    Returns:
+    tuple -- The strategy and detector names, None when not given, and the
+    400 response of an invalid parameter, None when both are valid.
+    """
+    strategy = params.get('strategy', default_strategy)
+    if strategy is not None and strategy not in STRATEGIES:
+        expected = 'Expected one of: ' + ', '.join(sorted(STRATEGIES))
+        return None, None, response_class(
+            {'strategy': [expected]}, status=status.HTTP_400_BAD_REQUEST
+        )
+    detector = params.get('detector')
+    if detector is not None:
+        try:
+            detector_backend(detector)
+        except ValueError as exception:
+            return None, None, response_class(
+                {'detector': [str(exception)]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    return strategy, detector, None
+
+
+def _flag(request, name):
+    """
+    Function that reads a boolean query parameter.
+    """
+    return request.query_params.get(name) in ('1', 'true')